@@ -5,7 +5,7 @@ from flows.statestore.django_store import StateModel
 
 
 @periodic_task(run_every=crontab(minute='*/5', hour='*'))
-def cleanup_expired_tasks():
-    count = StateModel.objects.remove_expired_state()
+def cleanup_expired_tasks(batch_size=None, max_runtime=None, sleep=None):
+    count = StateModel.objects.remove_expired_state(batch_size=batch_size, max_runtime=max_runtime, sleep=sleep)
     logger = cleanup_expired_tasks.get_logger()
-    logger.info("Deleted %s expired tasks' state" % count)
\ No newline at end of file
+    logger.info("Deleted %s expired tasks' state" % count)
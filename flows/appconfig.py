@@ -6,6 +6,11 @@ def _setup():
     statestore.setup()
 
 
+def _freeze():
+    from flows.components import freeze_flows
+    freeze_flows()
+
+
 if django.VERSION >= (1, 7):
     from django.apps import AppConfig
 
@@ -13,5 +18,8 @@ if django.VERSION >= (1, 7):
         name = 'flows'
         def ready(self):
             _setup()
+            # flows are also frozen as their URLs are built, but any which
+            # are already defined can be done now
+            _freeze()
 else:
     _setup()
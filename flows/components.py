@@ -5,6 +5,9 @@ import inspect
 import django
 import six
 from django.views.generic.edit import FormView
+from django.template import RequestContext
+from django.template.base import Template
+from django.template.response import TemplateResponse
 from django.forms.forms import Form
 from django.core.exceptions import ImproperlyConfigured
 from django import forms
@@ -30,6 +33,11 @@ class LazyActionSet(list):
             if obj is elem:
                 return idx
         raise ValueError('%s not in list' % obj)
+
+    def __contains__(self, obj):
+        # components may be listed by name, so the names are resolved
+        # rather than compared with the component
+        return any(obj is elem for elem in self)
     
     def __iter__(self):
         iterat = super(LazyActionSet, self).__iter__()
@@ -128,6 +136,14 @@ class FlowComponent(six.with_metaclass(FlowComponentMeta, object)):
         """
         return self.args, self.kwargs
     
+    @property
+    def task_token(self):
+        """
+        The value which identifies the task in URLs and forms. Usually
+        this is the task ID, but it depends on the state store.
+        """
+        return self._flow_position_instance.task_token
+
     def send_to(self, class_or_name, with_errors=None):
         """
         An action can only 'send_to' a sibling - that is, it can only send
@@ -199,6 +215,10 @@ class Scaffold(FlowComponent):
 
     @classmethod    
     def get_initial_action_tree(cls):
+        # frozen scaffolds have their tree worked out already
+        tree = cls.__dict__.get('_initial_action_tree')
+        if tree is not None:
+            return list(tree)
         first_item = cls.action_set[0]
         return [cls] + first_item.get_initial_action_tree()
 
@@ -244,10 +264,57 @@ class FlowRenderer(object):
         return self.flow_component.get_absolute_url()
 
     def flow_support(self):
-        field = "<input type='hidden' name='%s' value='%s'/>" % (config.FLOWS_TASK_ID_PARAM, self.flow_component.task_id)
+        field = "<input type='hidden' name='%s' value='%s'/>" % (config.FLOWS_TASK_ID_PARAM, self.flow_component.task_token)
         return mark_safe(field)
     
 
+class TaskTokenInput(forms.HiddenInput):
+    """
+    A hidden input holding the task token of an action, worked out when
+    the form is rendered, once the state is final, rather than when the
+    form was built or taken from the data which was posted.
+    """
+
+    def __init__(self, action, *args, **kwargs):
+        super(TaskTokenInput, self).__init__(*args, **kwargs)
+        self.action = action
+
+    def render(self, name, value, *args, **kwargs):
+        return super(TaskTokenInput, self).render(name, self.action.task_token, *args, **kwargs)
+
+
+class ActionTemplateResponse(TemplateResponse):
+    """
+    Renders the template of an action with the task state underneath
+    the context from `get_context_data`. The template looks values up in
+    the state itself rather than in a copy of it, so when the state is
+    only loaded one key at a time, only the keys the template uses are
+    loaded.
+    """
+
+    rendering_attrs = getattr(TemplateResponse, 'rendering_attrs', []) + ['state']
+
+    def __init__(self, *args, **kwargs):
+        self.state = kwargs.pop('state', {})
+        super(ActionTemplateResponse, self).__init__(*args, **kwargs)
+
+    @property
+    def rendered_content(self):
+        template = self.resolve_template(self.template_name)
+        # as of django 1.8, templates are wrapped by the engine's backend
+        engine_template = getattr(template, 'template', template)
+        if not isinstance(engine_template, Template):
+            # other template engines are given a copy of everything
+            context = dict(self.state)
+            context.update(self.context_data or {})
+            return template.render(context, self._request)
+
+        context = RequestContext(self._request)
+        context.dicts.append(self.state)
+        context.dicts.append(dict(self.context_data or {}))
+        return engine_template.render(context)
+
+
 class DefaultActionForm(Form):
     """
     All actions are required to have a form object to fulfil the
@@ -289,16 +356,26 @@ class Action(six.with_metaclass(action_meta, FlowComponent, FormView)):
     See https://docs.djangoproject.com/en/dev/ref/class-based-views/generic-editing/#formview
     """
     form_class = DefaultActionForm
+    response_class = ActionTemplateResponse
     
     is_action = True
     
     def get_context_data(self, **kwargs):
+        # the values of the state are added when the template is rendered
         ctx = FormView.get_context_data(self, **kwargs)
-        ctx.update(self.state)
         ctx['flows_back_url'] = self._flow_position_instance.get_back_url()
         ctx['flow'] = FlowRenderer(self)
         return ctx
     
+    def render_to_response(self, context, **response_kwargs):
+        if issubclass(self.response_class, ActionTemplateResponse):
+            response_kwargs.setdefault('state', self.state)
+        else:
+            state_context = dict(self.state)
+            state_context.update(context)
+            context = state_context
+        return FormView.render_to_response(self, context, **response_kwargs)
+    
     def get_absolute_url(self):
         return self._flow_position_instance.get_absolute_url()
     
@@ -308,8 +385,7 @@ class Action(six.with_metaclass(action_meta, FlowComponent, FormView)):
     
     def get_form(self, form_class):
         form = FormView.get_form(self, form_class)
-        form.fields[config.FLOWS_TASK_ID_PARAM] = forms.CharField(widget=forms.HiddenInput, 
-                                                                  initial=self.task_id,
+        form.fields[config.FLOWS_TASK_ID_PARAM] = forms.CharField(widget=TaskTokenInput(self),
                                                                   required=False)
         if '_with_errors' in self.state:
             errors = self.state.pop('_with_errors')
@@ -350,6 +426,59 @@ def get_by_class_or_name(class_or_string):
     return class_or_string
     
     
+def _freeze_action_set(component):
+    """
+    Replaces the lazy action set of a scaffold with a tuple of the
+    components it names, which cannot be changed afterwards. Raises
+    `ImproperlyConfigured` if any of them is not defined, leaving the
+    action set as it was.
+    """
+    action_set = component.__dict__.get('action_set')
+    if isinstance(action_set, LazyActionSet):
+        resolved = tuple(action_set)
+        for member in resolved:
+            if not (inspect.isclass(member) and issubclass(member, FlowComponent)):
+                raise ImproperlyConfigured('%r in the action set of %s is not a flow component' % (member, component.__name__))
+        component.action_set = resolved
+
+
+def freeze_flow(flow_component, _path=()):
+    """
+    Resolves every action set in the flow under `flow_component` to the
+    components it names, and works out the initial action tree of each
+    scaffold, so that handling requests does not need to look up any
+    component names. Raises `ImproperlyConfigured` if the flow is not
+    valid.
+    """
+    if flow_component in _path:
+        raise ImproperlyConfigured('%s contains itself' % flow_component.__name__)
+    if not issubclass(flow_component, Scaffold) or '_initial_action_tree' in flow_component.__dict__:
+        return
+
+    _freeze_action_set(flow_component)
+    if not flow_component.action_set:
+        raise ImproperlyConfigured('%s has no actions in its action set' % flow_component.__name__)
+    for child in flow_component.action_set:
+        freeze_flow(child, _path + (flow_component,))
+
+    first_item = flow_component.action_set[0]
+    flow_component._initial_action_tree = (flow_component,) + tuple(first_item.get_initial_action_tree())
+
+
+def freeze_flows():
+    """
+    Resolves the action sets of every flow component defined so far, as
+    far as possible. Names of components which are not defined yet are
+    left to be resolved when they are used, or when `freeze_flow` is
+    called for a flow containing them.
+    """
+    for component in list(FlowComponentMeta.registry.values()):
+        try:
+            _freeze_action_set(component)
+        except ImproperlyConfigured:
+            pass
+
+
 _flow_ids = {}
 
 
@@ -1,4 +1,6 @@
 # -*- coding: UTF-8 -*-
+import os
+import tempfile
 from django.conf import settings
 
 
@@ -10,13 +12,53 @@ FLOWS_STATE_STORE = _get_setting('FLOWS_STATE_STORE', 'flows.statestore.django_s
 FLOWS_TASK_IDLE_TIMEOUT = _get_setting('FLOWS_TASK_IDLE_TIMEOUT', 20 * 60) # 20 minutes
 FLOWS_TASK_ID_PARAM = _get_setting('FLOWS_TASK_ID_PARAM', '_id')
 FLOWS_SITE_ROOT = _get_setting('FLOWS_SITE_ROOT', '')
+FLOWS_REVERSE_CACHE_SIZE = _get_setting('FLOWS_REVERSE_CACHE_SIZE', 1000)
+FLOWS_STATE_SERIALIZER = _get_setting('FLOWS_STATE_SERIALIZER', 'flows.statestore.serializers.base64_pickle')
+FLOWS_STATE_ALLOW_PICKLE = _get_setting('FLOWS_STATE_ALLOW_PICKLE', None)
+FLOWS_STATE_COMPRESSION = _get_setting('FLOWS_STATE_COMPRESSION', None)
+FLOWS_STATE_COMPRESSION_THRESHOLD = _get_setting('FLOWS_STATE_COMPRESSION_THRESHOLD', 1024)
+FLOWS_STATE_MODELS_BY_REFERENCE = _get_setting('FLOWS_STATE_MODELS_BY_REFERENCE', False)
+FLOWS_STATE_PER_KEY_ENCODING = _get_setting('FLOWS_STATE_PER_KEY_ENCODING', False)
+FLOWS_STATE_CONFLICT_POLICY = _get_setting('FLOWS_STATE_CONFLICT_POLICY', None) # None, 'retry', 'merge' or 'error'
+FLOWS_STATE_CONFLICT_RETRIES = _get_setting('FLOWS_STATE_CONFLICT_RETRIES', 3)
+FLOWS_STATE_METRICS_SINK = _get_setting('FLOWS_STATE_METRICS_SINK', None)
 
 # Redis state store settings
 FLOWS_REDIS_STATE_STORE_HOST = _get_setting( 'FLOWS_REDIS_STATE_STORE_HOST', 'localhost' )
 FLOWS_REDIS_STATE_STORE_PASSWORD = _get_setting( 'FLOWS_REDIS_STATE_STORE_PASSWORD', '' )
 FLOWS_REDIS_STATE_STORE_PORT = _get_setting( 'FLOWS_REDIS_STATE_STORE_PORT', 6379)
 FLOWS_REDIS_STATE_STORE_DB = _get_setting( 'FLOWS_REDIS_STATE_STORE_DB', 0 )
+FLOWS_REDIS_STATE_STORE_MAX_CONNECTIONS = _get_setting( 'FLOWS_REDIS_STATE_STORE_MAX_CONNECTIONS', None )
+FLOWS_REDIS_STATE_STORE_SOCKET_TIMEOUT = _get_setting( 'FLOWS_REDIS_STATE_STORE_SOCKET_TIMEOUT', None )
 
+# File state store settings
+FLOWS_FILE_STATE_STORE_ROOT = _get_setting( 'FLOWS_FILE_STATE_STORE_ROOT', os.path.join(tempfile.gettempdir(), 'flows') )
+FLOWS_FILE_STATE_STORE_FSYNC = _get_setting( 'FLOWS_FILE_STATE_STORE_FSYNC', False )
+
+# Django cache framework state store settings
+FLOWS_CACHE_STATE_STORE_ALIAS = _get_setting( 'FLOWS_CACHE_STATE_STORE_ALIAS', 'default' )
+FLOWS_CACHE_STATE_STORE_KEY_PREFIX = _get_setting( 'FLOWS_CACHE_STATE_STORE_KEY_PREFIX', 'flows:' )
+
+# Cached state store settings
+FLOWS_CACHED_STATE_STORE_BACKEND = _get_setting( 'FLOWS_CACHED_STATE_STORE_BACKEND', 'flows.statestore.django_store' )
+FLOWS_CACHED_STATE_STORE_MAX_ENTRIES = _get_setting( 'FLOWS_CACHED_STATE_STORE_MAX_ENTRIES', 1000 )
+FLOWS_CACHED_STATE_STORE_TTL = _get_setting( 'FLOWS_CACHED_STATE_STORE_TTL', 60 )
+FLOWS_CACHED_STATE_STORE_CHECK_INTERVAL = _get_setting( 'FLOWS_CACHED_STATE_STORE_CHECK_INTERVAL', 0 )
+
+# Signed state store settings
+FLOWS_SIGNED_STATE_STORE_FALLBACK = _get_setting( 'FLOWS_SIGNED_STATE_STORE_FALLBACK', 'flows.statestore.django_store' )
+FLOWS_SIGNED_STATE_STORE_MAX_SIZE = _get_setting( 'FLOWS_SIGNED_STATE_STORE_MAX_SIZE', 2000 )
+
+# Instrumented state store settings
+FLOWS_INSTRUMENTED_STATE_STORE_BACKEND = _get_setting( 'FLOWS_INSTRUMENTED_STATE_STORE_BACKEND', 'flows.statestore.django_store' )
+
+# Django state store settings
+FLOWS_DJANGO_STATE_STORE_TOUCH_INTERVAL = _get_setting( 'FLOWS_DJANGO_STATE_STORE_TOUCH_INTERVAL', 0 )
+
+# Expired state cleanup settings, used by the django state store
+FLOWS_CLEANUP_BATCH_SIZE = _get_setting( 'FLOWS_CLEANUP_BATCH_SIZE', 1000 )
+FLOWS_CLEANUP_MAX_RUNTIME = _get_setting( 'FLOWS_CLEANUP_MAX_RUNTIME', None )
+FLOWS_CLEANUP_SLEEP = _get_setting( 'FLOWS_CLEANUP_SLEEP', 0 )
 
 # Task ID binder
 FLOWS_TASK_BINDER = _get_setting( 'FLOWS_TASK_BINDER', 'flows.binder.session_binder' ) 
\ No newline at end of file
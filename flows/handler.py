@@ -2,25 +2,29 @@
 from weakref import WeakSet
 from django.conf.urls import patterns, url, include
 from django.core.exceptions import ImproperlyConfigured
-from django.core.urlresolvers import reverse
+from django.core.urlresolvers import reverse, get_urlconf, get_script_prefix
 from django.http import HttpResponseRedirect, Http404, HttpResponse
 from django.shortcuts import redirect
 from django.conf import settings
 from flows import config
 from flows.components import Scaffold, Action, name_for_flow, COMPLETE, \
-    get_by_class_or_name
+    get_by_class_or_name, freeze_flow
 from flows.history import FlowHistory
+from flows.lru import LRUCache
+from flows.urlresolvers import FlatURLResolver, has_alternatives, is_self_contained
 from flows.statestore import state_store as default_state_store
-from flows.statestore.base import StateNotFound
+from flows.statestore import metrics
+from flows.statestore.base import StateNotFound, StateConflict
 import inspect
 import logging
 import re
+import six
+import sys
 import uuid
 from flows.binder import binder
 import urlparse
 import urllib
 
-
 logger = logging.getLogger(__name__)
 
 try:
@@ -31,6 +35,114 @@ except ImportError:
     
 
 
+_CONFLICT_POLICIES = (None, 'retry', 'merge', 'error')
+
+
+def _join_url_patterns(prefix, pattern):
+    """
+    Joins the pattern of a component to the joined patterns of the
+    scaffolds above it, so that the result matches the same URLs as the
+    nested patterns would. Returns `None` if it might not, or if the view
+    would not be given the same arguments.
+    """
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    elif pattern:
+        # a nested pattern which is not anchored is searched for in the
+        # rest of the URL, and its parent's match is never reconsidered
+        # if that fails, which one pattern cannot copy
+        return None
+    if has_alternatives(pattern) or not is_self_contained(pattern):
+        # the prefix would only apply to the first alternative, and
+        # backreferences and flags would apply to the wrong parts
+        return None
+    joined = prefix + pattern
+    try:
+        parent = re.compile(prefix)
+        regex = re.compile(joined)
+    except re.error:
+        # such as a group name being used twice
+        return None
+    if len(parent.groupindex) != parent.groups:
+        # the unnamed groups of a scaffold's pattern are not passed on to
+        # the view by every version of django
+        return None
+    if regex.groupindex and len(regex.groupindex) != regex.groups:
+        # django ignores unnamed groups if there are named ones
+        return None
+    return joined
+
+
+_reversed_urls = LRUCache(config.FLOWS_REVERSE_CACHE_SIZE)
+
+# URLs are only remembered for arguments of these types
+_CACHED_TYPES = six.integer_types + (bool, six.text_type, six.binary_type)
+
+_watching_settings = False
+
+
+def _reverse(url_name, args, kwargs):
+    """
+    The same as django's `reverse`, but remembers the most recently used
+    URLs, so that pages with many links into flows are cheap to render.
+    """
+    values = list(args) + list(kwargs.values())
+    if not config.FLOWS_REVERSE_CACHE_SIZE or any(type(value) not in _CACHED_TYPES for value in values):
+        # other values, such as model instances, can give a different
+        # URL each time while still being equal
+        return reverse(url_name, args=args, kwargs=kwargs)
+    if not _watching_settings:
+        _watch_settings()
+
+    # the types are part of the key as, for example, 1 and True are
+    # equal but give different URLs
+    key = (url_name,
+           tuple((arg.__class__, arg) for arg in args),
+           frozenset((name, value.__class__, value) for name, value in kwargs.items()),
+           get_urlconf(), get_script_prefix())
+    url = _reversed_urls.get(key)
+    if url is None:
+        url = reverse(url_name, args=args, kwargs=kwargs)
+        _reversed_urls.set(key, url)
+    return url
+
+
+def clear_reverse_cache(**kwargs):
+    """
+    Forgets the URLs remembered by `get_absolute_url`. This is done when
+    the ``ROOT_URLCONF`` setting is changed in tests, but should also be
+    done if the URL patterns are changed in any other way.
+    """
+    if kwargs.get('setting', 'ROOT_URLCONF') == 'ROOT_URLCONF':
+        _reversed_urls.clear()
+
+
+def _watch_settings():
+    global _watching_settings
+    try:
+        from django.core.signals import setting_changed
+    except ImportError:
+        # compatibility for django < 1.8, where the signal belongs to
+        # django.test, which is not imported just for this; settings
+        # are only changed this way once it has been imported anyway
+        signals = sys.modules.get('django.test.signals')
+        if signals is None:
+            return
+        setting_changed = signals.setting_changed
+    setting_changed.connect(clear_reverse_cache)
+    _watching_settings = True
+
+
+def _get_conflict_retries(policy):
+    """
+    Returns how many more attempts may be made after a conflict, if
+    `policy` is the configured conflict policy.
+    """
+    if config.FLOWS_STATE_CONFLICT_POLICY == policy:
+        return config.FLOWS_STATE_CONFLICT_RETRIES
+    return 0
+
+
 class FlowHandlerBase(object):
     registry = WeakSet()
 
@@ -70,100 +182,205 @@ class FlowHandlerBase(object):
 
 class FlowHandler(FlowHandlerBase):
 
-    def __init__(self, app_namespace=None, state_store=None, *args, **kwargs):
+    conflict_retry_methods = ('GET', 'HEAD', 'OPTIONS')
+    """
+    The request methods which the 'retry' conflict policy runs again.
+    Running a step again repeats everything it does, such as sending the
+    email in a `form_valid`, so only requests which are safe to repeat
+    are retried; others get the conflict response straight away.
+    """
+
+    def __init__(self, app_namespace=None, state_store=None, flatten_urls=False, *args, **kwargs):
         super(FlowHandler, self).__init__(*args, **kwargs)
         self._entry_points = []
         self.app_namespace = app_namespace
         self.state_store = state_store or default_state_store
+        self.flatten_urls = flatten_urls
+
+        if config.FLOWS_STATE_CONFLICT_POLICY not in _CONFLICT_POLICIES:
+            raise ImproperlyConfigured('FLOWS_STATE_CONFLICT_POLICY must be one of %s' % ', '.join(map(repr, _CONFLICT_POLICIES)))
         
     
-    def _get_state(self, task_id):
-        
-        if not re.match('^[0-9a-f]{32}$', task_id):
+    def _check_task_id(self, task_id):
+        if not self.state_store.is_valid_task_id(task_id):
             # someone is messing with the task ID - don't even try
             # to do anything with it
             raise StateNotFound
-        
-        return self.state_store.get_state(task_id)
+
+    def _get_state(self, task_id):
+        """
+        Returns the state of the task along with its version, which is only
+        looked up if there is a conflict policy to use it.
+        """
+        self._check_task_id(task_id)
+        if config.FLOWS_STATE_CONFLICT_POLICY is None:
+            return self.state_store.get_state(task_id), None
+        return self.state_store.get_versioned_state(task_id)
 
     
     def _view(self, position):
+
+        # state store metrics are grouped by the flow being handled, named
+        # after its entry point so that the name is the same in every process
+        entry_point = position.flow_component_classes[0]
+        flow_name = '%s.%s' % (entry_point.__module__, entry_point.__name__)
         
         def handle_view(request, *args, **kwargs):
-            # first get the state for this task, or create state if
-            # this is an entry point with no state
-            if config.FLOWS_TASK_ID_PARAM in request.REQUEST:
-                task_id = request.REQUEST[config.FLOWS_TASK_ID_PARAM]
-                
-                try:
-                    state = self._get_state(task_id)
-                except StateNotFound:
-                    logger.debug("Could not find task with ID %s" % task_id)
-                    raise Http404
-                
-                bound_to = state.get('_bound_to', None)
-                bind_to = binder(request)
-                
-                if bound_to is None or bind_to is None or bind_to != bound_to:
-                    logger.debug('Will not give task %s as it is bound to %s, not %s' % (task_id, bound_to, bind_to))
-                    raise Http404
-                
-            else:
-                # are we at an entry point? if so, then create some new state
-                # otherwise we're trying to enter the middle of a flow, which
-                # is not allowed
-                if position.is_entry_point():
-                    initial = {}
-                    if '_on_complete' in request.REQUEST:
-                        initial['_on_complete'] = request.REQUEST['_on_complete']
-                    state = self._new_state(request, **initial)
-                else:
-                    logger.debug('Flow position is not an entry point: %s' % position)
-                    raise Http404
-                
-            # create the instances required to handle the request 
-            flow_instance = position.create_instance(state, self.state_store, args, kwargs)
-                
-            # deal with the request
-            return flow_instance.handle(request, *args, **kwargs)
+            # the state operations for one request are batched so that
+            # stores which support it can pipeline them
+            with self.state_store.batch(), metrics.flow(flow_name):
+                return self._handle_view(position, request, *args, **kwargs)
 
         return handle_view
+
+    def _handle_view(self, position, request, *args, **kwargs):
+        # with the 'retry' policy, a step whose state was changed by another
+        # request while it ran is run again from the start with fresh state
+        retries = 0
+        if request.method in self.conflict_retry_methods:
+            retries = _get_conflict_retries('retry')
+        while True:
+            try:
+                return self._handle_step(position, request, *args, **kwargs)
+            except StateConflict:
+                if not retries:
+                    return self._get_conflict_response(request)
+                retries -= 1
+
+    def _get_conflict_response(self, request):
+        logger.debug('Task state was changed by another request')
+        return HttpResponse('The task was changed by another request', status=409)
+
+    def _handle_step(self, position, request, *args, **kwargs):
+        # first get the state for this task, or create state if
+        # this is an entry point with no state
+        task_id = self._get_task_id(request)
+        if task_id is not None:
+            
+            try:
+                state, version = self._get_state(task_id)
+            except StateNotFound:
+                logger.debug("Could not find task with ID %s" % task_id)
+                raise Http404
+            
+            self._check_bound_to(request, task_id, state)
+            
+        else:
+            state = self._create_state(request, **self._get_initial_state(position, request))
+            version = self._put_new_state(state)
+            
+        # create the instances required to handle the request 
+        flow_instance = position.create_instance(state, self.state_store, args, kwargs, version=version)
+            
+        # deal with the request
+        return flow_instance.handle(request, *args, **kwargs)
+
+    def _get_task_id(self, request):
+        return request.REQUEST.get(config.FLOWS_TASK_ID_PARAM)
+
+    def _check_bound_to(self, request, task_id, state):
+        bound_to = state.get('_bound_to', None)
+        bind_to = binder(request)
+        
+        if bound_to is None or bind_to is None or self.state_store.get_binding(bind_to) != bound_to:
+            logger.debug('Will not give task %s as it is bound to %s, not %s' % (task_id, bound_to, bind_to))
+            raise Http404
+
+    def _get_initial_state(self, position, request):
+        # are we at an entry point? if so, then create some new state
+        # otherwise we're trying to enter the middle of a flow, which
+        # is not allowed
+        if not position.is_entry_point():
+            logger.debug('Flow position is not an entry point: %s' % position)
+            raise Http404
+        
+        initial = {}
+        if '_on_complete' in request.REQUEST:
+            initial['_on_complete'] = request.REQUEST['_on_complete']
+        return initial
+
     
     def _new_state(self, request, **initial_state):
+        state = self._create_state(request, **initial_state)
+        self._put_new_state(state)
+        return state
+
+    def _put_new_state(self, state):
+        # storing new state returns its first version either way, but the
+        # conflict policy needs stores which keep versions to provide one
+        if config.FLOWS_STATE_CONFLICT_POLICY is None:
+            return self.state_store.put_state(state['_id'], state)
+        return self.state_store.compare_and_set(state['_id'], state, None)
+
+    def _create_state(self, request, **initial_state):
         task_id = re.sub('-', '', str(uuid.uuid4()))
         bind_to = binder(request)
         if bind_to is None:
             raise ImproperlyConfigured('A value is required to bind the task to')
         
-        state = {'_id': task_id, '_bound_to': bind_to}
+        state = {'_id': task_id, '_bound_to': self.state_store.get_binding(bind_to)}
         state.update( initial_state )
-        self.state_store.put_state(task_id, state)
-        
         return state
     
     def _urls_for_flow(self, flow_namespace, flow_component, flow_position=None):
 
         urlpatterns = []
-                
+        flow_position, flow_urls = self._position_for(flow_namespace, flow_component, flow_position)
+            
+        if issubclass(flow_component, Scaffold) and hasattr(flow_component, 'action_set'):
+            for child in flow_component.action_set:
+                for u in flow_urls:
+                    urlpatterns += patterns('', url(u, include(self._urls_for_flow(flow_namespace, child, flow_position))))
+
+        elif issubclass(flow_component, Action):
+            name = flow_position.get_url_name(include_app_namespace=False)
+            for u in flow_urls:
+                urlpatterns += patterns('', url(u, self._view(flow_position), name=name))
+
+        else:
+            raise TypeError(str(flow_component))
+
+        return urlpatterns
+
+    def _position_for(self, flow_namespace, flow_component, flow_position):
         if flow_position is None:
             flow_position = PossibleFlowPosition(self.app_namespace, flow_namespace, [flow_component])
         else:
-            flow_position = PossibleFlowPosition(self.app_namespace, flow_namespace, flow_position.flow_component_classes + [flow_component])
+            flow_position = PossibleFlowPosition(self.app_namespace, flow_namespace, flow_position.flow_component_classes + (flow_component,))
         
         if hasattr(flow_component, 'urls'):
             flow_urls = flow_component.urls
         else:
             flow_urls = [flow_component.url]
-            
+        return flow_position, flow_urls
+
+    def _flat_urls_for_flow(self, flow_namespace, flow_component, flow_position=None, prefix='^'):
+        """
+        Like `_urls_for_flow`, but gives each action one pattern made by
+        joining the patterns of its scaffolds to its own, rather than
+        nesting an `include` for each scaffold. Django can then resolve
+        the URL of an action with a single regular expression.
+        """
+        parent_position = flow_position
+        flow_position, flow_urls = self._position_for(flow_namespace, flow_component, parent_position)
+
+        joined = [_join_url_patterns(prefix, u) for u in flow_urls]
+        if None in joined:
+            # the URL arguments would not come out the same if the patterns
+            # were joined, so this part of the flow stays nested
+            nested = self._urls_for_flow(flow_namespace, flow_component, parent_position)
+            return patterns('', url(prefix, include(nested)))
+
+        urlpatterns = []
         if issubclass(flow_component, Scaffold) and hasattr(flow_component, 'action_set'):
-            for child in flow_component.action_set:
-                for u in flow_urls:
-                    urlpatterns += patterns('', url(u, include(self._urls_for_flow(flow_namespace, child, flow_position))))
+            for pattern in joined:
+                for child in flow_component.action_set:
+                    urlpatterns += self._flat_urls_for_flow(flow_namespace, child, flow_position, pattern)
 
         elif issubclass(flow_component, Action):
             name = flow_position.get_url_name(include_app_namespace=False)
-            for u in flow_urls:
-                urlpatterns += patterns('', url(u, self._view(flow_position), name=name))
+            for pattern in joined:
+                urlpatterns += patterns('', url(pattern, self._view(flow_position), name=name))
 
         else:
             raise TypeError(str(flow_component))
@@ -328,12 +545,19 @@ class FlowHandler(FlowHandlerBase):
     
     def _get_url_patterns(self, flow_namespace):
         urlpatterns = []
+        urls_for_flow = self._flat_urls_for_flow if self.flatten_urls else self._urls_for_flow
         for flow in self._entry_points:
-            urlpatterns += self._urls_for_flow(flow_namespace, flow)
+            # any mistakes in the flow are found now rather than when
+            # handling a request
+            freeze_flow(flow)
+            urlpatterns += urls_for_flow(flow_namespace, flow)
         if settings.DEBUG:
             prefix = flow_namespace if flow_namespace else ''
             urlpatterns += patterns('', url('%s\.flowgraph$' % prefix, self.flow_graph))
             
+        if self.flatten_urls:
+            urlpatterns = [FlatURLResolver(r'^', urlpatterns)]
+
         # verify that URLs are unique
         url_list = self.list_urls(urlpatterns)
         url_set = set()
@@ -352,11 +576,12 @@ class FlowPositionInstance(object):
     that is, a user is currently performing an action as part of a flow
     """
     
-    def __init__(self, app_namespace, flow_namespace, position, state, state_store, url_args, url_kwargs):
+    def __init__(self, app_namespace, flow_namespace, position, state, state_store, url_args, url_kwargs, version=None):
         self._app_namespace = app_namespace
         self._flow_namespace = flow_namespace
         self._position = position
         self._state = state
+        self._version = version
         self._flow_components = []
         self.state_store = state_store
 
@@ -386,6 +611,14 @@ class FlowPositionInstance(object):
     @property
     def task_id(self):
         return self._state['_id']
+
+    @property
+    def task_token(self):
+        """
+        The value which identifies the task in URLs and forms; see
+        `StateStoreBase.get_task_token`.
+        """
+        return self.state_store.get_task_token(self._state)
             
     def get_root_component(self):
         return self._flow_components[0]
@@ -405,63 +638,34 @@ class FlowPositionInstance(object):
             kwargs.update(flow_kwargs)
             
         url_name = self._position.url_name
-        url = reverse(url_name, args=args, kwargs=kwargs)
+        url = _reverse(url_name, args, kwargs)
+        url = '%(root)s%(url)s' % { 'root': config.FLOWS_SITE_ROOT, 'url': url }
         
         if include_flow_id:
+            url = self.add_task_token(url)
+        return url
+
+    def add_task_token(self, url):
+        separator = '&' if '?' in url else '?'
         
-            separator = '&' if '?' in url else '?'
-            
-            return '%(root)s%(url)s%(separator)s%(task_id_param_name)s=%(task_id)s' % { 
-                                     'root': config.FLOWS_SITE_ROOT,
-                                     'url': url, 'separator': separator,
-                                     'task_id_param_name': config.FLOWS_TASK_ID_PARAM,
-                                     'task_id': self.task_id  }
-        else:
-            return '%(root)s%(url)s' % { 'root': config.FLOWS_SITE_ROOT, 'url': url }
+        return '%(url)s%(separator)s%(task_id_param_name)s=%(task_id)s' % { 
+                                 'url': url, 'separator': separator,
+                                 'task_id_param_name': config.FLOWS_TASK_ID_PARAM,
+                                 'task_id': self.task_token  }
 
     def position_instance_for(self, component_class_or_name):
         # figure out where we're being sent to
         FC = get_by_class_or_name(component_class_or_name)
-        
-        # it should be a sibling of one of the current items
-        # for example, if we are in position [A,B,E]:
-        #
-        #         A
-        #      /  |  \
-        #    B    C   D
-        #   /  \      |  \
-        #  E   F      G   H
-        # 
-        #  E can send to F (its own sibling) or C (sibling of its parent)
-
-        for fci in self._flow_components[-2::-1]: # go backwards but skip the last element (the action)
-            if FC in fci.action_set:
-                # we found the relevant action set, which means we know the root
-                # part of the tree, and now we can construct the rest
-                idx = self._flow_components.index(fci)
-                break
-        else:
-            raise ValueError('Could not figure out how to redirect to %s' % FC)
-
-        # so the new tree is from the root to the parent of the one we just found,
-        # coupled with the initial subtree from the component we're tring to redirect
-        # to
-        tree_root = self._position.flow_component_classes[:idx+1]
-        
-        # figure out the action tree for the new first component - either
-        # we have been given an action, in which case it's just one single
-        # item, or we have been given a scaffold, in which case there could
-        # be a list of [scaffold, scaffold..., action]
-        new_subtree = FC.get_initial_action_tree()
-        
-        # we use our current tree and replace the current leaf with this new 
-        # subtree to get the new position
-        new_position = PossibleFlowPosition(self._app_namespace, self._flow_namespace, tree_root + new_subtree)
+        new_position = self._position.get_position_for(FC)
         
         # now create an instance of the position with the current state
         return new_position.create_instance(self._state, self.state_store, self._url_args, self._url_kwargs)
     
     def handle(self, request, *args, **kwargs):
+        # remember what the state looked like before handling the request,
+        # so that it is only written back if something changed
+        self._remember_state()
+
         # first validate that we can actually run by checking for
         # required state, for example
         response = None
@@ -481,66 +685,151 @@ class FlowPositionInstance(object):
                     break
                 
         if response is None:
-
-            # FIXME: mjtamlyn promises to fix this in Django 1.7, but right now we need
-            # to set up the magic attributes usually set up by a closure in View.as_view
-            # so we can call dispatch on Django>1.5
-            action = self.get_action()
-            if hasattr(action, 'request'):
-                raise Exception('Action re-use?')
-            action.request = request
-            action.args = args
-            action.kwargs = kwargs
-
             # now that everything is set up, we can handle the request
-            response = self.get_action().dispatch(request, *args, **kwargs)
-            
-            # if this is a GET request, then we displayed something to the user, so
-            # we should record this in the history, unless the request returned a 
-            # redirect, in which case we haven't displayed anything
-            if request.method == 'GET' and not isinstance(response, HttpResponseRedirect):
-                self._history.add_to_history(self)
+            action = self._prepare_action(request, args, kwargs)
+            response = action.dispatch(request, *args, **kwargs)
+            self._record_history(request, response)
         
-        # now we have a response, we need to decide what to do with it
-        for flow_component in self._flow_components[::-1]: # go from leaf to root, ie, backwards
-            response = flow_component.handle_response(response)
+        response = self._handle_response(response)
             
         # now we have some kind of response, figure out what it is exactly
         if response == COMPLETE:
-            # this means that the entire flow finished - we should redirect
-            # to the on_complete url if we have one, or get upset if we don't
-            next_url = self._state.get('_on_complete', None)
-            if next_url is None:
-                # oh, we don't know where to go...
-                raise ImproperlyConfigured('Flow completed without an _on_complete URL or an explicit redirect - %s' % self.__repr__())
-            else:
-                response = redirect(next_url)
+            response = self._get_complete_response()
 
             # if we are done, then we should remove the task state
             self.state_store.delete_state(self.task_id)
             
         else:
             # update the state if necessary
-            self.state_store.put_state(self.task_id, self._state)
-            
-            if inspect.isclass(response):
-                # we got given a class, which implies the code should redirect
-                # to this new (presumably Action) class
-                response = redirect(self.position_instance_for(response).get_absolute_url()) 
+            if self._state_changed():
+                self._save_state()
             
-            elif isinstance(response, Action):
-                # this is a new action for the user, so redirect to it
-                absurl = response.get_absolute_url()
-                response = redirect(absurl)
-               
-            elif isinstance(response, basestring):
-                # this is a string which should be the name of an action
-                # which couldn't be referenced as a class for some reason
-                flow_component = get_by_class_or_name(response)
-                response = redirect(flow_component.get_absolute_url()) 
+            response = self._get_redirect(response)
+
+        return response
+
+    def _get_fingerprint(self):
+        if config.FLOWS_STATE_CONFLICT_POLICY == 'merge':
+            # merging needs to know which keys this request changed, and
+            # the fingerprints of each key will do for the whole state too
+            return self.state_store.get_key_fingerprints(self._state)
+        return self.state_store.get_fingerprint(self._state)
+
+    def _remember_state(self):
+        # stores which need every state written back anyway do not need
+        # a fingerprint unless it is used for merging
+        self._fingerprint = self._new_fingerprint = None
+        if self.state_store.refreshes_expiry_on_read or config.FLOWS_STATE_CONFLICT_POLICY == 'merge':
+            self._fingerprint = self._get_fingerprint()
+
+    def _save_state(self):
+        if config.FLOWS_STATE_CONFLICT_POLICY is None:
+            self.state_store.put_state(self.task_id, self._state)
+            return
+
+        state, version = self._state, self._version
+        retries = _get_conflict_retries('merge')
+        while True:
+            try:
+                self._version = self.state_store.compare_and_set(self.task_id, state, version)
+                return
+            except StateConflict:
+                if not retries:
+                    raise
+                retries -= 1
+            state, version = self._merge_state()
+
+    def _merge_state(self):
+        """
+        Applies the keys changed while handling this request to the latest
+        stored state, and returns the result along with the version it
+        was based on. If another request changed any of the same keys,
+        `StateConflict` is raised.
+        """
+        store = self.state_store
+        original = self._fingerprint
+        if self._new_fingerprint is None:
+            self._new_fingerprint = self._get_fingerprint()
+        mine = self._new_fingerprint
+        changed = [key for key in set(original) | set(mine) if original.get(key) != mine.get(key)]
+
+        try:
+            current, version = store.get_versioned_state(self.task_id)
+        except StateNotFound:
+            # the task was completed by the other request
+            raise StateConflict
+        theirs = store.get_key_fingerprints(current)
+        if any(theirs.get(key) != original.get(key) for key in changed):
+            raise StateConflict
+
+        for key in changed:
+            if key in self._state:
+                current[key] = self._state[key]
+            else:
+                del current[key]
+        return current, version
+
+    def _prepare_action(self, request, args, kwargs):
+        # FIXME: mjtamlyn promises to fix this in Django 1.7, but right now we need
+        # to set up the magic attributes usually set up by a closure in View.as_view
+        # so we can call dispatch on Django>1.5
+        action = self.get_action()
+        if hasattr(action, 'request'):
+            raise Exception('Action re-use?')
+        action.request = request
+        action.args = args
+        action.kwargs = kwargs
+        return action
+
+    def _record_history(self, request, response):
+        # if this is a GET request, then we displayed something to the user, so
+        # we should record this in the history, unless the request returned a 
+        # redirect, in which case we haven't displayed anything
+        if request.method == 'GET' and not isinstance(response, HttpResponseRedirect):
+            self._history.add_to_history(self)
+
+    def _handle_response(self, response):
+        # now we have a response, we need to decide what to do with it
+        for flow_component in self._flow_components[::-1]: # go from leaf to root, ie, backwards
+            response = flow_component.handle_response(response)
+        return response
+
+    def _get_complete_response(self):
+        # this means that the entire flow finished - we should redirect
+        # to the on_complete url if we have one, or get upset if we don't
+        next_url = self._state.get('_on_complete', None)
+        if next_url is None:
+            # oh, we don't know where to go...
+            raise ImproperlyConfigured('Flow completed without an _on_complete URL or an explicit redirect - %s' % self.__repr__())
+        return redirect(next_url)
+
+    def _get_redirect(self, response):
+        if inspect.isclass(response):
+            # we got given a class, which implies the code should redirect
+            # to this new (presumably Action) class
+            response = redirect(self.position_instance_for(response).get_absolute_url()) 
+        
+        elif isinstance(response, Action):
+            # this is a new action for the user, so redirect to it
+            absurl = response.get_absolute_url()
+            response = redirect(absurl)
+           
+        elif isinstance(response, basestring):
+            # this is a string which should be the name of an action
+            # which couldn't be referenced as a class for some reason
+            flow_component = get_by_class_or_name(response)
+            response = redirect(flow_component.get_absolute_url()) 
 
         return response
     
+    def _state_changed(self):
+        if not self.state_store.refreshes_expiry_on_read:
+            # the write is needed to keep the state alive regardless
+            return True
+        # kept in case the state needs to be merged
+        self._new_fingerprint = self._get_fingerprint()
+        return self._new_fingerprint != self._fingerprint
+
     def __repr__(self):
         return 'Instance of %s' % self._position.__repr__()
         
@@ -553,18 +842,44 @@ class PossibleFlowPosition(object):
     flow components. On startup, all FlowComponents (Scaffolds and Actions)
     are inspected to build up a list of all possible positions within all
     avaiable flows. This class represents one such possibility.
+
+    Positions are interned: asking for the same components in the same
+    namespaces again returns the existing position, so that handling a
+    request never has to build one.
     """
 
-    def __init__(self, app_namespace, flow_namespace, flow_components):
-        self.app_namespace = app_namespace
-        self.flow_namespace = flow_namespace
-        self.flow_component_classes = flow_components
+    __slots__ = ('app_namespace', 'flow_namespace', 'flow_component_classes',
+                 'url_name', '_local_url_name', '_is_entry_point', '_targets', '_next')
+
+    _interned = {}
+
+    def __new__(cls, app_namespace, flow_namespace, flow_components):
+        key = (app_namespace, flow_namespace, tuple(flow_components))
+        try:
+            return cls._interned[key]
+        except KeyError:
+            pass
 
+        self = super(PossibleFlowPosition, cls).__new__(cls)
+        self.app_namespace, self.flow_namespace, self.flow_component_classes = key
+        self.url_name = self._url_name_from_components(self.flow_component_classes, True)
+        self._local_url_name = self._url_name_from_components(self.flow_component_classes, False)
+        self._is_entry_point = None
+        self._targets = None
+        self._next = None
+
+        # if another thread got there first, its position is used
+        self = cls._interned.setdefault(key, self)
         PossibleFlowPosition.all_positions[self.url_name] = self
+        return self
+
+    def __init__(self, app_namespace, flow_namespace, flow_components):
+        # everything is set up once, by __new__
+        pass
             
-    def create_instance(self, state, state_store, url_args, url_kwargs):
+    def create_instance(self, state, state_store, url_args, url_kwargs, version=None):
         return FlowPositionInstance(self.app_namespace, self.flow_namespace, self, state,
-                                    state_store, url_args, url_kwargs)
+                                    state_store, url_args, url_kwargs, version)
     
     def _url_name_from_components(self, components, include_app_namespace=True):
         if self.flow_namespace is None:
@@ -576,16 +891,81 @@ class PossibleFlowPosition(object):
         return '%s%s' % (prefix, '/'.join([name_for_flow(fc) for fc in components]))
     
     def is_entry_point(self):
-        root_tree = self.flow_component_classes[0].get_initial_action_tree()
-        my_tree = self.flow_component_classes
-        return root_tree == my_tree
-    
-    @property
-    def url_name(self):
-        return self.get_url_name(include_app_namespace=True)
+        if self._is_entry_point is None:
+            # worked out when first needed, as the action sets may name
+            # components which are not defined when the URLs are built
+            root_tree = self.flow_component_classes[0].get_initial_action_tree()
+            self._is_entry_point = tuple(root_tree) == self.flow_component_classes
+        return self._is_entry_point
     
     def get_url_name(self, include_app_namespace=True):
-        return self._url_name_from_components(self.flow_component_classes, include_app_namespace)
+        return self.url_name if include_app_namespace else self._local_url_name
+
+    def get_position_for(self, flow_component):
+        """
+        Returns the position which the user is sent to when the action at
+        this position sends them to `flow_component`. That must be a
+        sibling of one of the components here; for example, if we are in
+        position [A,B,E]:
+
+                A
+             /  |  \\
+           B    C   D
+          /  \\      |  \\
+         E   F      G   H
+
+        E can send to F (its own sibling) or C (sibling of its parent).
+        """
+        if self._targets is None:
+            self._targets = self._find_targets()
+        try:
+            return self._targets[flow_component]
+        except KeyError:
+            raise ValueError('Could not figure out how to redirect to %s' % flow_component)
+
+    def _find_targets(self):
+        # the position reached from here for each component which can be
+        # sent to, worked out once when first needed, as the action sets
+        # may name components which are not defined when the URLs are built
+        targets = {}
+        classes = self.flow_component_classes
+
+        # go backwards but skip the last element (the action), so that
+        # siblings of lower components are found first
+        for idx in range(len(classes) - 2, -1, -1):
+            for target in classes[idx].action_set:
+                if target not in targets:
+                    # the new tree is from the root to the parent of the
+                    # target, followed by the initial subtree of the target
+                    tree = classes[:idx + 1] + tuple(target.get_initial_action_tree())
+                    targets[target] = PossibleFlowPosition(self.app_namespace, self.flow_namespace, tree)
+        return targets
+
+    def get_next_component(self, scaffold_class):
+        """
+        Returns the component after the one at this position in the action
+        set of `scaffold_class`, or `COMPLETE` if it was the last.
+        """
+        if self._next is None:
+            self._next = self._find_next()
+        try:
+            return self._next[scaffold_class]
+        except KeyError:
+            raise ValueError('%s has no child at %s' % (scaffold_class, self))
+
+    def _find_next(self):
+        next_components = {}
+        classes = self.flow_component_classes
+        for scaffold_class, active_child in zip(classes, classes[1:]):
+            if scaffold_class in next_components:
+                continue
+            action_set = list(scaffold_class.action_set)
+            child_idx = action_set.index(active_child)
+            if child_idx + 1 >= len(action_set):
+                next_components[scaffold_class] = COMPLETE
+            else:
+                next_components[scaffold_class] = action_set[child_idx + 1]
+        return next_components
     
     
     def __repr__(self):
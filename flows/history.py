@@ -1,9 +1,12 @@
 # -*- coding: UTF-8 -*-
+from six.moves.urllib import parse as urlparse
+from flows import config
 
 
 class FlowHistory(object):
 
     def __init__(self, flow_position_instance):
+        self._flow_position_instance = flow_position_instance
         state = flow_position_instance._state
         self._history = state['_history'] if '_history' in state else []
 
@@ -22,7 +25,9 @@ class FlowHistory(object):
     def add_to_history(self, flow_position_instance):
         url_name = flow_position_instance._position.url_name
 
-        url = flow_position_instance.get_absolute_url()
+        # the task ID is added when the URL is used rather than kept here,
+        # as with some state stores it changes along with the state
+        url = flow_position_instance.get_absolute_url(include_flow_id=False)
         current_action = flow_position_instance.get_action()
         skip_on_back = getattr(current_action, 'skip_on_back', False)
 
@@ -31,4 +36,12 @@ class FlowHistory(object):
 
 
     def get_back_url(self):
-        return self._back_url
+        if self._back_url is None or _has_task_id(self._back_url):
+            # history recorded by older versions already includes it
+            return self._back_url
+        return self._flow_position_instance.add_task_token(self._back_url)
+
+
+def _has_task_id(url):
+    query = urlparse.urlsplit(url).query
+    return config.FLOWS_TASK_ID_PARAM in urlparse.parse_qs(query, keep_blank_values=True)
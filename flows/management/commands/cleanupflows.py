@@ -1,9 +1,21 @@
+from optparse import make_option
 from django.core.management.base import NoArgsCommand
 from flows.statestore.django_store import StateModel
 
 class Command(NoArgsCommand):
     help = "Removes expired flow state from the database (only valid if using the Django state store)"
 
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=None,
+                    help='The number of rows to delete at a time. Defaults to FLOWS_CLEANUP_BATCH_SIZE.'),
+        make_option('--max-runtime', type='float', dest='max_runtime', default=None,
+                    help='Stop starting new batches after this many seconds. Defaults to FLOWS_CLEANUP_MAX_RUNTIME.'),
+        make_option('--sleep', type='float', dest='sleep', default=None,
+                    help='The number of seconds to wait between batches. Defaults to FLOWS_CLEANUP_SLEEP.'),
+    )
+
     def handle_noargs(self, **options):
-        count = StateModel.objects.remove_expired_state()
-        print 'Deleted %d expired tasks\' state' % count
\ No newline at end of file
+        count = StateModel.objects.remove_expired_state(batch_size=options['batch_size'],
+                                                        max_runtime=options['max_runtime'],
+                                                        sleep=options['sleep'])
+        print 'Deleted %d expired tasks\' state' % count
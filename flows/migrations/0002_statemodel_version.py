@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flows', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statemodel',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
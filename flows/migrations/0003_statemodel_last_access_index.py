@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flows', '0002_statemodel_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='statemodel',
+            name='last_access',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
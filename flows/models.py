@@ -1,10 +1,7 @@
 # -*- coding: UTF-8 -*-
 
-# Note: this is mainly required because using the Django test runner
-# requires that apps under test have a 'models' module, even if it's
-# just empty.
+# The model for the django state store is always registered, whichever
+# store is configured, as the migrations shipped with flows create its
+# table; otherwise makemigrations would try to delete it.
 
-
-from flows import config
-if config.FLOWS_STATE_STORE == 'flows.statestore.django_store':
-    from flows.statestore.django_store import StateModel #@UnusedImport only used to registed with django ORM
\ No newline at end of file
+from flows.statestore.django_store import StateModel #@UnusedImport only used to registed with django ORM
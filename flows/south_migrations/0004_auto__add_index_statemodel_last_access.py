@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from south.db import db
+from south.v2 import SchemaMigration
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding index on 'StateModel', fields ['last_access']
+        db.create_index('flows_statemodel', ['last_access'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'StateModel', fields ['last_access']
+        db.delete_index('flows_statemodel', ['last_access'])
+
+
+    models = {
+        'flows.statemodel': {
+            'Meta': {'object_name': 'StateModel'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_access': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'state': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'task_id': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '32'}),
+            'version': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        }
+    }
+
+    complete_apps = ['flows']
@@ -0,0 +1,62 @@
+"""
+Native asyncio methods for the redis state store, using the asyncio
+client included in redis-py 4.2 and later. This module uses Python 3
+syntax, so it is only imported on Python 3.
+"""
+import weakref
+import asyncio
+from redis import asyncio as aioredis
+from flows import config
+from flows.statestore.base import StateNotFound
+
+
+class AsyncRedisMethods(object):
+    """
+    Mixed into the redis state store to provide the asynchronous store
+    methods, with the same behaviour as the blocking ones.
+    """
+
+    def _get_async_db(self):
+        # asyncio connections belong to the loop they were made on, so
+        # each loop gets its own client
+        clients = self.__dict__.setdefault('_async_clients', weakref.WeakKeyDictionary())
+        loop = asyncio.get_event_loop()
+        if loop not in clients:
+            from flows.statestore.redis_store import _get_settings
+            settings = dict((name, value) for name, value in _get_settings().items() if value is not None)
+            clients[loop] = aioredis.Redis(**settings)
+        return clients[loop]
+
+    async def _aread(self, task_id, *keys):
+        ttl = config.FLOWS_TASK_IDLE_TIMEOUT
+        pipeline = self._get_async_db().pipeline()
+        for key in keys:
+            pipeline.get(key)
+        pipeline.expire(self._data_key(task_id), ttl)
+        pipeline.expire(self._version_key(task_id), ttl)
+        return (await pipeline.execute())[:len(keys)]
+
+    async def aget_state(self, task_id):
+        data, = await self._aread(task_id, self._data_key(task_id))
+        if not data:
+            raise StateNotFound
+        return self._deserialise(data)
+
+    async def aget_versioned_state(self, task_id):
+        version, data = await self._aread(task_id, self._version_key(task_id), self._data_key(task_id))
+        if not data:
+            raise StateNotFound
+        return self._deserialise(data), int(version) if version is not None else None
+
+    async def aput_state(self, task_id, state):
+        ttl = config.FLOWS_TASK_IDLE_TIMEOUT
+        data = self._serialise(state)
+
+        pipeline = self._get_async_db().pipeline()
+        pipeline.set(self._data_key(task_id), data, ex=ttl)
+        pipeline.incr(self._version_key(task_id))
+        pipeline.expire(self._version_key(task_id), ttl)
+        return (await pipeline.execute())[1]
+
+    async def adelete_state(self, task_id):
+        await self._get_async_db().delete(self._data_key(task_id), self._version_key(task_id))
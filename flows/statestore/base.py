@@ -1,24 +1,283 @@
 
-import pickle
 import base64
+import hashlib
+import re
+import six
+from contextlib import contextmanager
+from functools import partial
+from six.moves import cPickle
+from flows import config
+from flows.statestore import compression, lazy, metrics, serializers
 
 class StateNotFound(Exception):
     pass
 
+
+class StateConflict(Exception):
+    """
+    Raised by `compare_and_set` when the state was written by someone
+    else since it was read.
+    """
+    pass
+
+
+def run_in_thread(func, *args, **kwargs):
+    """
+    Returns an awaitable which runs a blocking call in another thread, so
+    that it does not hold up the event loop. asgiref is used if it is
+    installed, as it is by django's ASGI support, so that database
+    connections are handled the way django expects.
+    """
+    try:
+        from asgiref.sync import sync_to_async
+    except ImportError:
+        return _InThread(partial(func, *args, **kwargs))
+    return sync_to_async(func)(*args, **kwargs)
+
+
+class _InThread(object):
+    # only starts the call once awaited, so that it runs on the loop
+    # which is awaiting it
+    def __init__(self, call):
+        self._call = call
+
+    def __await__(self):
+        import asyncio
+        return asyncio.get_event_loop().run_in_executor(None, self._call).__await__()
+
+
+class _HashWriter(object):
+    """
+    A file-like object which feeds everything written to it into a hash.
+    """
+    def __init__(self, digest):
+        self.write = digest.update
+
+
+def _digest(obj):
+    digest = hashlib.md5()
+    # the memo is switched off because which objects cPickle memoises
+    # depends on their reference counts, which would make the output
+    # different for equal state
+    pickler = cPickle.Pickler(_HashWriter(digest), cPickle.HIGHEST_PROTOCOL)
+    pickler.fast = True
+    try:
+        pickler.dump(obj)
+    except ValueError:
+        # fast mode cannot cope with self-referencing state
+        return hashlib.md5(cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)).digest()
+    return digest.digest()
+
+
 class StateStoreBase(object):
-    
+
+    refreshes_expiry_on_read = False
+    """
+    Whether reading state is enough to stop it from expiring. If so,
+    state which was not changed while handling a request does not need
+    to be written back to the store.
+    """
+
+    stores_binary = False
+    """
+    Whether the store can keep arbitrary bytes. If not, state from binary
+    serialisers is base64 encoded before being stored.
+    """
+
+    serializer = None
+    """
+    The serialiser used to write state. If not set, the one configured
+    by the ``FLOWS_STATE_SERIALIZER`` setting is used.
+    """
+
+    def _get_serializer(self):
+        return self.serializer or serializers.get_serializer()
+
+    def _serialise_value(self, value):
+        # a lone value is wrapped so that any serialiser can cope with it
+        return compression.compress(self._get_serializer().dumps({'value': value}))
+
+    def _allows_pickle(self):
+        return serializers.allows_pickle(self._get_serializer())
+
+    def _serialise_values(self, state):
+        if isinstance(state, lazy.LazyState):
+            return state.encode(self._serialise_value)
+        return dict((key, self._serialise_value(value)) for key, value in state.items())
+
+    def _dumps(self, state):
+        if config.FLOWS_STATE_PER_KEY_ENCODING:
+            return lazy.pack(self._serialise_values(state))
+        if isinstance(state, lazy.LazyState):
+            state = dict(state)
+        return self._get_serializer().dumps(state)
+
     def _serialise(self, state):
-        data = pickle.dumps(state)
-        return base64.b64encode(data)
+        data = self._dumps(state)
+        if not lazy.is_packed(data):
+            # packed values were each compressed already
+            data = compression.compress(data)
+        if not self.stores_binary and (self._get_serializer().binary or
+                                       compression.is_compressed(data) or lazy.is_packed(data)):
+            data = base64.b64encode(data)
+        metrics.count_bytes(len(data))
+        return data
     
     def _deserialise(self, data):
-        return pickle.loads(base64.b64decode(data))
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        metrics.count_bytes(len(data))
+        return serializers.loads(data, self._allows_pickle())
     
+    def get_fingerprint(self, state):
+        """
+        Returns a value which will be different if the content of the
+        state is different, used to detect whether state was changed
+        while handling a request.
+        """
+        if isinstance(state, lazy.LazyState):
+            # values which have not been loaded cannot have changed, so
+            # their stored data is used rather than loading them
+            digest = hashlib.md5()
+            for key, data in sorted(self._serialise_values(state).items()):
+                digest.update(key.encode('utf-8') if isinstance(key, six.text_type) else key)
+                digest.update(hashlib.md5(data).digest())
+            return digest.digest()
+        return _digest(state)
+
+    def get_key_fingerprints(self, state):
+        """
+        Returns a dictionary of each key in the state to a fingerprint of
+        its value, used to find out which keys were changed.
+        """
+        if isinstance(state, lazy.LazyState):
+            return dict((key, hashlib.md5(data).digest())
+                        for key, data in self._serialise_values(state).items())
+        return dict((key, _digest(value)) for key, value in state.items())
+
+    def is_valid_task_id(self, task_id):
+        """
+        Checks whether a task ID given in a request could possibly be
+        one created by flows, so that nobody can fiddle with the store
+        by passing in arbitrary values.
+        """
+        return re.match('^[0-9a-f]{32}$', task_id) is not None
+
+    def get_task_token(self, state):
+        """
+        Returns the value which identifies the task in URLs and forms.
+        By default this is simply the task ID.
+        """
+        return state['_id']
+
+    def get_binding(self, value):
+        """
+        Returns what is kept in the state to bind a task to `value`, the
+        session key or whatever else the ``FLOWS_TASK_BINDER`` returned.
+        By default this is simply the value.
+        """
+        return value
+
     def get_state(self, task_id):
         raise NotImplementedError
     
     def put_state(self, task_id, state):
+        """
+        Stores the state for the task. Stores which keep a version may
+        return the new version, or `None` if it is not known.
+        """
         raise NotImplementedError
+
+    def get_version(self, task_id):
+        """
+        Returns a value which changes every time the state of the task is
+        written, or `None` if there is no state or the store does not keep
+        versions. This should be much cheaper than fetching the state, and
+        counts as reading it as far as expiry is concerned.
+        """
+        return None
+
+    def get_versioned_state(self, task_id):
+        """
+        Returns the state of the task along with its version. The version
+        is read first, so that if the state is written in the meantime, the
+        version returned is older rather than newer than the state.
+        """
+        version = self.get_version(task_id)
+        return self.get_state(task_id), version
     
     def delete_state(self, task_id):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def compare_and_set(self, task_id, state, expected_version):
+        """
+        Stores the state only if its version is still `expected_version`,
+        or if there is no state yet when that is `None`, and returns the
+        new version. Otherwise `StateConflict` is raised.
+
+        This default is not atomic, as it checks the version and writes
+        the state separately; stores should override it with a version
+        which is.
+        """
+        if self.get_version(task_id) != expected_version:
+            raise StateConflict
+        return self.put_state(task_id, state)
+
+    def get_many(self, task_ids):
+        """
+        Returns a dictionary of task ID to state for all of the given tasks
+        which have state. Stores should override this if they can fetch
+        several tasks more cheaply than one at a time.
+        """
+        states = {}
+        for task_id in task_ids:
+            try:
+                states[task_id] = self.get_state(task_id)
+            except StateNotFound:
+                pass
+        return states
+
+    def put_many(self, states):
+        """
+        Stores the state of several tasks, given as a dictionary of task ID
+        to state.
+        """
+        with self.batch():
+            for task_id, state in states.items():
+                self.put_state(task_id, state)
+
+    def delete_many(self, task_ids):
+        with self.batch():
+            for task_id in task_ids:
+                self.delete_state(task_id)
+
+    # Asynchronous versions of the methods above, for use from asyncio
+    # code. These return awaitables; by default the blocking methods are
+    # run in another thread, but stores which have an asynchronous client
+    # can override them.
+
+    def aget_state(self, task_id):
+        return run_in_thread(self.get_state, task_id)
+
+    def aget_versioned_state(self, task_id):
+        return run_in_thread(self.get_versioned_state, task_id)
+
+    def aput_state(self, task_id, state):
+        return run_in_thread(self.put_state, task_id, state)
+
+    def adelete_state(self, task_id):
+        return run_in_thread(self.delete_state, task_id)
+
+    def acompare_and_set(self, task_id, state, expected_version):
+        return run_in_thread(self.compare_and_set, task_id, state, expected_version)
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups the store operations made inside the block so that stores
+        which can send several commands in one round-trip are able to do
+        so. Writes may be deferred until the block exits, in which case
+        they are thrown away if it raises, but reads will always see them.
+        The default is simply to run each operation immediately.
+        """
+        yield
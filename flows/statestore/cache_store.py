@@ -0,0 +1,105 @@
+import uuid
+from flows import config
+from flows.statestore.base import StateStoreBase, StateNotFound
+
+try:
+    from django.core.cache import caches
+
+    def _get_cache(alias):
+        return caches[alias]
+except ImportError:
+    # compatibility for django < 1.7
+    from django.core.cache import get_cache as _get_cache
+
+
+class StateStore(StateStoreBase):
+    """
+    Keeps task state in one of the caches configured in django's ``CACHES``
+    setting, chosen by ``FLOWS_CACHE_STATE_STORE_ALIAS``. State expires
+    ``FLOWS_TASK_IDLE_TIMEOUT`` seconds after it was last written, or last
+    read if the cache backend supports ``touch``.
+
+    Each task has two cache entries: the state itself, stored along with
+    its version, and the version on its own so that it can be checked
+    cheaply. The version entry is always written last, so if it is found
+    to be up to date then so is the state.
+    """
+
+    stores_binary = True
+
+    def __init__(self, alias=None):
+        self.cache = _get_cache(alias or config.FLOWS_CACHE_STATE_STORE_ALIAS)
+
+    @property
+    def refreshes_expiry_on_read(self):
+        # without touch, the expiry could only be refreshed by setting the
+        # state again, which could overwrite a newer write by someone else
+        return hasattr(self.cache, 'touch')
+
+    def _state_key(self, task_id):
+        return '%sstate:%s' % (config.FLOWS_CACHE_STATE_STORE_KEY_PREFIX, task_id)
+
+    def _version_key(self, task_id):
+        return '%sversion:%s' % (config.FLOWS_CACHE_STATE_STORE_KEY_PREFIX, task_id)
+
+    def _touch(self, task_id):
+        if self.refreshes_expiry_on_read:
+            ttl = config.FLOWS_TASK_IDLE_TIMEOUT
+            self.cache.touch(self._state_key(task_id), ttl)
+            self.cache.touch(self._version_key(task_id), ttl)
+
+    def _read(self, task_id):
+        entry = self.cache.get(self._state_key(task_id))
+        if entry is None:
+            raise StateNotFound
+        self._touch(task_id)
+        return entry
+
+    def get_state(self, task_id):
+        return self._deserialise(self._read(task_id)[1])
+
+    def get_version(self, task_id):
+        version = self.cache.get(self._version_key(task_id))
+        if version is not None:
+            self._touch(task_id)
+        return version
+
+    def get_versioned_state(self, task_id):
+        version, data = self._read(task_id)
+        return self._deserialise(data), version
+
+    def put_state(self, task_id, state):
+        ttl = config.FLOWS_TASK_IDLE_TIMEOUT
+        version = uuid.uuid4().hex
+        self.cache.set(self._state_key(task_id), (version, self._serialise(state)), ttl)
+        self.cache.set(self._version_key(task_id), version, ttl)
+        return version
+
+    def delete_state(self, task_id):
+        self.cache.delete_many([self._version_key(task_id), self._state_key(task_id)])
+
+    def get_many(self, task_ids):
+        keys = dict((self._state_key(task_id), task_id) for task_id in task_ids)
+        states = {}
+        for key, entry in self.cache.get_many(list(keys)).items():
+            task_id = keys[key]
+            states[task_id] = self._deserialise(entry[1])
+            self._touch(task_id)
+        return states
+
+    def put_many(self, states):
+        ttl = config.FLOWS_TASK_IDLE_TIMEOUT
+        entries = {}
+        versions = {}
+        for task_id, state in states.items():
+            version = uuid.uuid4().hex
+            entries[self._state_key(task_id)] = (version, self._serialise(state))
+            versions[self._version_key(task_id)] = version
+        self.cache.set_many(entries, ttl)
+        self.cache.set_many(versions, ttl)
+
+    def delete_many(self, task_ids):
+        keys = []
+        for task_id in task_ids:
+            keys += [self._version_key(task_id), self._state_key(task_id)]
+        self.cache.delete_many(keys)
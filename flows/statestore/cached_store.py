@@ -0,0 +1,144 @@
+import threading
+import time
+from importlib import import_module
+from flows import config
+from flows.lru import LRUCache
+from flows.statestore import serializers
+from flows.statestore.base import StateStoreBase
+
+
+def _get_backend():
+    return import_module(config.FLOWS_CACHED_STATE_STORE_BACKEND).StateStore()
+
+
+class StateStore(StateStoreBase):
+    """
+    Keeps recently used task state in memory in front of another state
+    store, so that state which has not changed does not have to be
+    fetched from it again. If the backing store does not keep versions,
+    nothing is cached.
+
+    By default the backing store's version of the state is checked on
+    every read, so an out of date copy is never used, but that check is
+    still a round-trip. With a ``check_interval``, the version of each
+    task is only checked that many seconds after it was last checked,
+    and reads in between do not touch the backing store at all; they
+    may then return state up to that old if another process changes it.
+
+    The state is cached as it was serialised, and deserialised on every
+    read, so changes made while handling a request never leak into the
+    cached copy and model instances stored by reference are up to date.
+
+    Each process has its own cache, holding at most
+    ``FLOWS_CACHED_STATE_STORE_MAX_ENTRIES`` tasks for at most
+    ``FLOWS_CACHED_STATE_STORE_TTL`` seconds.
+    """
+
+    def __init__(self, backend=None, max_entries=None, ttl=None, check_interval=None):
+        self.backend = backend or _get_backend()
+        self._cache = LRUCache(max_entries if max_entries is not None else config.FLOWS_CACHED_STATE_STORE_MAX_ENTRIES,
+                               ttl if ttl is not None else config.FLOWS_CACHED_STATE_STORE_TTL)
+        self.check_interval = (check_interval if check_interval is not None
+                               else config.FLOWS_CACHED_STATE_STORE_CHECK_INTERVAL)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def refreshes_expiry_on_read(self):
+        return self.backend.refreshes_expiry_on_read
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _get_serializer(self):
+        # the same serialiser as the backing store is used, so that state
+        # loaded from the cache is exactly what would have been loaded
+        # from the store, but pickles need not be base64 encoded
+        serializer = self.backend._get_serializer()
+        return serializers.binary_pickle if serializer is serializers.base64_pickle else serializer
+
+    def _remember(self, task_id, state, version):
+        if version is None:
+            self._cache.delete(task_id)
+        else:
+            self._cache.set(task_id, [version, self._dumps(state), time.time()])
+
+    def _is_current(self, task_id, cached):
+        version, data, checked = cached
+        now = time.time()
+        if self.check_interval and now - checked < self.check_interval:
+            return True
+        if self.backend.get_version(task_id) != version:
+            return False
+        cached[2] = now
+        return True
+
+    def get_state(self, task_id):
+        return self.get_versioned_state(task_id)[0]
+
+    def get_versioned_state(self, task_id):
+        cached = self._cache.get(task_id)
+        if cached is not None and self._is_current(task_id, cached):
+            self._count(hit=True)
+            # the data came from this process, so it can be trusted to be
+            # unpickled whatever the serialiser
+            return serializers.loads(cached[1], allow_pickle=True), cached[0]
+
+        self._count(hit=False)
+        state, version = self.backend.get_versioned_state(task_id)
+        self._remember(task_id, state, version)
+        return state, version
+
+    def get_version(self, task_id):
+        return self.backend.get_version(task_id)
+
+    def put_state(self, task_id, state):
+        version = self.backend.put_state(task_id, state)
+        self._remember(task_id, state, version)
+        return version
+
+    def compare_and_set(self, task_id, state, expected_version):
+        version = self.backend.compare_and_set(task_id, state, expected_version)
+        self._remember(task_id, state, version)
+        return version
+
+    def delete_state(self, task_id):
+        self._cache.delete(task_id)
+        self.backend.delete_state(task_id)
+
+    def get_many(self, task_ids):
+        return self.backend.get_many(task_ids)
+
+    def put_many(self, states):
+        for task_id in states:
+            self._cache.delete(task_id)
+        self.backend.put_many(states)
+
+    def delete_many(self, task_ids):
+        task_ids = list(task_ids)
+        for task_id in task_ids:
+            self._cache.delete(task_id)
+        self.backend.delete_many(task_ids)
+
+    def is_valid_task_id(self, task_id):
+        return self.backend.is_valid_task_id(task_id)
+
+    def get_task_token(self, state):
+        return self.backend.get_task_token(state)
+
+    def get_binding(self, value):
+        return self.backend.get_binding(value)
+
+    def get_fingerprint(self, state):
+        return self.backend.get_fingerprint(state)
+
+    def get_key_fingerprints(self, state):
+        return self.backend.get_key_fingerprints(state)
+
+    def batch(self):
+        return self.backend.batch()
@@ -0,0 +1,65 @@
+# -*- coding: UTF-8 -*-
+"""
+Optional compression of serialised state, controlled by the
+``FLOWS_STATE_COMPRESSION`` and ``FLOWS_STATE_COMPRESSION_THRESHOLD``
+settings. Compressed data starts with a header byte saying how it was
+compressed, which can never be the start of uncompressed state, so both
+can be read side by side.
+"""
+import zlib
+from django.core.exceptions import ImproperlyConfigured
+from flows import config
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+ZLIB_HEADER = b'\x01'
+LZMA_HEADER = b'\x02'
+
+
+def _lzma():
+    if lzma is None:
+        raise ImproperlyConfigured('The "backports.lzma" package is required to use lzma compression on Python 2 - get it here https://pypi.python.org/pypi/backports.lzma')
+    return lzma
+
+
+def compress(data, method=None, threshold=None):
+    """
+    Compresses `data` if compression is switched on and it is at least as
+    big as the threshold, both of which default to the settings. Data
+    which does not get any smaller is returned as it was.
+    """
+    if method is None:
+        method = config.FLOWS_STATE_COMPRESSION
+    if threshold is None:
+        threshold = config.FLOWS_STATE_COMPRESSION_THRESHOLD
+    if method is None or len(data) < threshold:
+        return data
+
+    if method == 'zlib':
+        compressed = ZLIB_HEADER + zlib.compress(data)
+    elif method == 'lzma':
+        compressed = LZMA_HEADER + _lzma().compress(data)
+    else:
+        raise ImproperlyConfigured('Unknown state compression "%s", expected "zlib" or "lzma"' % method)
+
+    return compressed if len(compressed) < len(data) else data
+
+
+def is_compressed(data):
+    return data[:1] in (ZLIB_HEADER, LZMA_HEADER)
+
+
+def decompress(data):
+    header = data[:1]
+    if header == ZLIB_HEADER:
+        return zlib.decompress(data[1:])
+    if header == LZMA_HEADER:
+        return _lzma().decompress(data[1:])
+    return data
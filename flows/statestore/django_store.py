@@ -1,6 +1,9 @@
 import django
-from flows.statestore.base import StateStoreBase, StateNotFound
-from django.db import models
+import time
+from contextlib import contextmanager
+from flows.statestore.base import StateStoreBase, StateNotFound, StateConflict
+from django.db import models, connections, router, transaction, IntegrityError
+from django.db.models import F
 from django.utils import timezone
 from flows import config
 from datetime import timedelta
@@ -9,31 +12,60 @@ from datetime import timedelta
 class StateModelManager(models.Manager):
     def get_queryset(self):
         timeout = timezone.now() - timedelta(seconds=config.FLOWS_TASK_IDLE_TIMEOUT)
-
-        qs = super(StateModelManager, self)
-        if hasattr(qs, 'get_queryset'):
-            qs = qs.get_queryset()
-        else:
-            qs = qs.get_query_set()
-
-        return qs.filter( last_access__gte=timeout )
+        return self.get_unfiltered_queryset().filter( last_access__gte=timeout )
 
     if django.VERSION < (1, 6):
         # compatibility for older django versions
         def get_query_set(self):
             return self.get_queryset()
 
-    def remove_expired_state(self):
+    def get_unfiltered_queryset(self):
+        """
+        Returns all state, including state which has expired, by directly
+        calling the superclass's queryset method because in our own we
+        filter out expired state!
+        """
+        qs = super(StateModelManager, self)
+        if hasattr(qs, 'get_queryset'):
+            return qs.get_queryset()
+        return qs.get_query_set()
+
+    def remove_expired_state(self, batch_size=None, max_runtime=None, sleep=None):
+        """
+        Deletes expired state in batches of at most `batch_size` rows, so
+        that the table is never locked for long, and returns how many rows
+        were deleted. If `max_runtime` seconds have passed, no more batches
+        are started, and `sleep` seconds are spent between batches to
+        leave room for other queries. All three default to the
+        ``FLOWS_CLEANUP_*`` settings.
+        """
+        batch_size = batch_size or config.FLOWS_CLEANUP_BATCH_SIZE
+        max_runtime = max_runtime if max_runtime is not None else config.FLOWS_CLEANUP_MAX_RUNTIME
+        sleep = sleep if sleep is not None else config.FLOWS_CLEANUP_SLEEP
+
         timeout = config.FLOWS_TASK_IDLE_TIMEOUT
         cutoff = timezone.now() - timedelta(seconds=timeout)
+        started = time.time()
 
-        # directly call the superclass's queryset method because
-        # in our own we filter out expired state!
-        qs = super(StateModelManager, self).get_query_set()
-
+        qs = self.get_unfiltered_queryset()
         expired = qs.filter(last_access__lte=cutoff)
-        count = expired.count()
-        expired.delete()
+
+        count = 0
+        while True:
+            pks = list(expired.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            # the expiry is checked again in case the state was used since
+            deleted = expired.filter(pk__in=pks).delete()
+            # older versions of django do not say how many rows were deleted
+            count += deleted[0] if deleted is not None else len(pks)
+
+            if len(pks) < batch_size:
+                break
+            if sleep:
+                time.sleep(sleep)
+            if max_runtime and time.time() - started >= max_runtime:
+                break
         return count
 
 
@@ -45,30 +77,269 @@ class StateModel(models.Model):
         app_label = 'flows'
         
     task_id = models.CharField(max_length=32, unique=True)
+    # binary state is base64 encoded rather than kept in a BinaryField,
+    # which older versions of django do not have, and which existing
+    # tables could not be migrated to in place on every database
     state = models.TextField(null=True)
 
-    last_access = models.DateTimeField(auto_now_add=True)
+    last_access = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    # incremented every time the state is written
+    version = models.PositiveIntegerField(default=0)
 
     def __unicode__(self):
         return 'State for task %s' % self.task_id
     
 
 class StateStore(StateStoreBase):
+
+    refreshes_expiry_on_read = True
     
-    def get_state(self, task_id):
+    def _read(self, task_id, *fields):
         try:
-            state_model = StateModel.objects.get(task_id=task_id)
+            values = StateModel.objects.values_list('pk', 'last_access', *fields).get(task_id=task_id)
         except StateModel.DoesNotExist:
             raise StateNotFound
-        else:
-            state_model.last_access = timezone.now()
-            state_model.save()
-            return self._deserialise(state_model.state)
+
+        pk, last_access = values[:2]
+        _touch([pk] if _needs_touch(last_access) else [])
+        return values[2:]
+
+    def get_state(self, task_id):
+        data, = self._read(task_id, 'state')
+        return self._deserialise(data)
+
+    def get_version(self, task_id):
+        try:
+            version, = self._read(task_id, 'version')
+        except StateNotFound:
+            return None
+        return version
+
+    def get_versioned_state(self, task_id):
+        data, version = self._read(task_id, 'state', 'version')
+        return self._deserialise(data), version
         
+    def _get_values(self, task_id, state, now):
+        return {'task_id': task_id,
+                'state': self._serialise(state).decode('ascii'),
+                'last_access': now,
+                'version': 1}
+
     def put_state(self, task_id, state):
-        state_model, _ = StateModel.objects.get_or_create(task_id=task_id)
-        state_model.state = self._serialise(state)
-        state_model.save()
+        values = self._get_values(task_id, state, timezone.now())
+
+        using = router.db_for_write(StateModel)
+        connection = connections[using]
+        sql = _get_upsert_sql(connection)
+
+        if sql is None:
+            return _update_or_create(using, values)
+
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql, _prepare_values(connection, values))
+            version = cursor.fetchone()[0] if _supports_returning(connection) else None
+        finally:
+            cursor.close()
+        if django.VERSION < (1, 6):
+            transaction.commit_unless_managed(using=using)
+        return version
         
     def delete_state(self, task_id):
         StateModel.objects.filter(task_id=task_id).delete()
+
+    def compare_and_set(self, task_id, state, expected_version):
+        values = self._get_values(task_id, state, timezone.now())
+
+        if expected_version is None:
+            using = router.db_for_write(StateModel)
+            try:
+                with _atomic(using):
+                    StateModel.objects.using(using).create(**values)
+            except IntegrityError:
+                raise StateConflict
+            return values['version']
+
+        # the version is checked and bumped by the same statement
+        updates = dict((name, values[name]) for name in _UPDATE_FIELDS)
+        updates['version'] = F('version') + 1
+        if not StateModel.objects.filter(task_id=task_id, version=expected_version).update(**updates):
+            raise StateConflict
+        return expected_version + 1
+
+    def get_many(self, task_ids):
+        states = {}
+        for chunk in _chunks(list(task_ids)):
+            rows = StateModel.objects.filter(task_id__in=chunk).values_list('pk', 'task_id', 'state', 'last_access')
+            stale = []
+            for pk, task_id, data, last_access in rows:
+                states[task_id] = self._deserialise(data)
+                if _needs_touch(last_access):
+                    stale.append(pk)
+            _touch(stale)
+        return states
+
+    def put_many(self, states):
+        now = timezone.now()
+        rows = [self._get_values(task_id, state, now) for task_id, state in states.items()]
+
+        using = router.db_for_write(StateModel)
+        connection = connections[using]
+        sql = _get_upsert_sql(connection, returning=False)
+
+        if sql is None:
+            _bulk_update_or_create(using, rows)
+            return
+
+        cursor = connection.cursor()
+        try:
+            for chunk in _chunks(rows):
+                cursor.executemany(sql, [_prepare_values(connection, values) for values in chunk])
+        finally:
+            cursor.close()
+        if django.VERSION < (1, 6):
+            transaction.commit_unless_managed(using=using)
+
+    def delete_many(self, task_ids):
+        qs = StateModel.objects.get_unfiltered_queryset()
+        for chunk in _chunks(list(task_ids)):
+            qs.filter(task_id__in=chunk).delete()
+
+
+# the number of tasks handled by each query of the bulk methods, which
+# keeps well inside the limit on query parameters of every database
+_CHUNK_SIZE = 500
+
+
+def _chunks(items):
+    for start in range(0, len(items), _CHUNK_SIZE):
+        yield items[start:start + _CHUNK_SIZE]
+
+
+def _needs_touch(last_access):
+    # only bump the last access time rather than re-saving the whole
+    # row, and not at all if it was bumped very recently
+    interval = timedelta(seconds=config.FLOWS_DJANGO_STATE_STORE_TOUCH_INTERVAL)
+    return timezone.now() - last_access >= interval
+
+
+def _touch(pks):
+    if pks:
+        StateModel.objects.get_unfiltered_queryset().filter(pk__in=pks).update(last_access=timezone.now())
+
+
+# Upserting
+#
+# Each flow step writes its state once, so where the database supports it
+# this is done with a single INSERT which updates the existing row on a
+# task ID conflict. This is both cheaper than reading the row first and
+# safe when two requests for the same task arrive at the same time.
+
+_UPSERT_FIELDS = ('task_id', 'state', 'last_access', 'version')
+_UPDATE_FIELDS = ('state', 'last_access')
+
+
+def _supports_returning(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        from django.db.backends.sqlite3.base import Database
+        return Database.sqlite_version_info >= (3, 35, 0)
+    return False
+
+
+def _get_upsert_sql(connection, returning=True):
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        if getattr(connection, 'pg_version', 0) < 90500:
+            return None
+        on_conflict = 'ON CONFLICT (%(task_id)s) DO UPDATE SET %(updates)s'
+        update = '%(column)s = EXCLUDED.%(column)s'
+    elif vendor == 'sqlite':
+        from django.db.backends.sqlite3.base import Database
+        if Database.sqlite_version_info < (3, 24, 0):
+            return None
+        on_conflict = 'ON CONFLICT (%(task_id)s) DO UPDATE SET %(updates)s'
+        update = '%(column)s = excluded.%(column)s'
+    elif vendor == 'mysql':
+        on_conflict = 'ON DUPLICATE KEY UPDATE %(updates)s'
+        update = '%(column)s = VALUES(%(column)s)'
+    else:
+        return None
+
+    qn = connection.ops.quote_name
+    table = qn(StateModel._meta.db_table)
+    columns = dict((name, qn(StateModel._meta.get_field(name).column)) for name in _UPSERT_FIELDS)
+    updates = [update % {'column': columns[name]} for name in _UPDATE_FIELDS]
+    updates.append('%(version)s = %(table)s.%(version)s + 1' % {'table': table, 'version': columns['version']})
+
+    sql = 'INSERT INTO %(table)s (%(columns)s) VALUES (%(params)s) %(on_conflict)s' % {
+        'table': table,
+        'columns': ', '.join(columns[name] for name in _UPSERT_FIELDS),
+        'params': ', '.join(['%s'] * len(_UPSERT_FIELDS)),
+        'on_conflict': on_conflict % {'task_id': columns['task_id'], 'updates': ', '.join(updates)},
+    }
+    if returning and _supports_returning(connection):
+        sql += ' RETURNING %s' % columns['version']
+    return sql
+
+
+def _prepare_values(connection, values):
+    return [StateModel._meta.get_field(name).get_db_prep_save(values[name], connection=connection)
+            for name in _UPSERT_FIELDS]
+
+
+@contextmanager
+def _atomic(using):
+    if hasattr(transaction, 'atomic'):
+        with transaction.atomic(using=using):
+            yield
+    else:
+        yield
+
+
+def _update_or_create(using, values):
+    # the fallback for databases without an upsert statement: most writes
+    # are to existing state, so try an update first and only insert if
+    # there was nothing there
+    qs = StateModel.objects.get_unfiltered_queryset().using(using)
+    updates = dict((name, values[name]) for name in _UPDATE_FIELDS)
+    updates['version'] = F('version') + 1
+
+    if qs.filter(task_id=values['task_id']).update(**updates):
+        return None
+    try:
+        with _atomic(using):
+            qs.create(**values)
+    except IntegrityError:
+        # another request created the state in the meantime
+        qs.filter(task_id=values['task_id']).update(**updates)
+        return None
+    return values['version']
+
+
+def _bulk_update_or_create(using, rows):
+    # updates each existing row, then creates all of the missing ones at
+    # once
+    qs = StateModel.objects.get_unfiltered_queryset().using(using)
+    for chunk in _chunks(rows):
+        with _atomic(using):
+            existing = set(qs.filter(task_id__in=[values['task_id'] for values in chunk])
+                             .values_list('task_id', flat=True))
+            missing = []
+            for values in chunk:
+                if values['task_id'] in existing:
+                    updates = dict((name, values[name]) for name in _UPDATE_FIELDS)
+                    updates['version'] = F('version') + 1
+                    qs.filter(task_id=values['task_id']).update(**updates)
+                else:
+                    missing.append(values)
+
+        try:
+            with _atomic(using):
+                qs.bulk_create([StateModel(**values) for values in missing])
+        except IntegrityError:
+            # some were created by another request in the meantime
+            for values in missing:
+                _update_or_create(using, values)
@@ -0,0 +1,221 @@
+import errno
+import os
+import tempfile
+import time
+import uuid
+from flows import config
+from flows.statestore.base import StateStoreBase, StateNotFound, StateConflict
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows, where compare_and_set is not atomic
+    fcntl = None
+
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class StateStore(StateStoreBase):
+    """
+    Keeps the state of each task in its own file under
+    ``FLOWS_FILE_STATE_STORE_ROOT``, in subdirectories named after the
+    first two characters of the task ID so that no single directory gets
+    too big.
+
+    Files are written to a temporary file which is then renamed over the
+    old one, so a crash can never leave half-written state behind. State
+    expires ``FLOWS_TASK_IDLE_TIMEOUT`` seconds after the file was last
+    read or written.
+
+    Each file starts with a line holding a random version token which
+    changes on every write, followed by the serialised state.
+    """
+
+    refreshes_expiry_on_read = True
+    stores_binary = True
+
+    def __init__(self, root=None, fsync=None):
+        self.root = root or config.FLOWS_FILE_STATE_STORE_ROOT
+        self.fsync = config.FLOWS_FILE_STATE_STORE_FSYNC if fsync is None else fsync
+
+    def _get_dir_name(self, task_id):
+        return os.path.join(self.root, task_id[:2])
+
+    def _get_file_name(self, task_id):
+        return os.path.join(self._get_dir_name(task_id), '%s.task' % task_id)
+
+    def _is_expired(self, mtime, now=None):
+        return (now or time.time()) - mtime > config.FLOWS_TASK_IDLE_TIMEOUT
+
+    def _read(self, task_id, header_only=False):
+        fname = self._get_file_name(task_id)
+        try:
+            f = open(fname, 'rb')
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENOENT:
+                raise StateNotFound
+            raise
+
+        with f:
+            if self._is_expired(os.fstat(f.fileno()).st_mtime):
+                self._remove(fname)
+                raise StateNotFound
+            version = f.readline().rstrip(b'\n').decode('ascii')
+            data = None if header_only else f.read()
+
+        # reading the state keeps it alive
+        try:
+            os.utime(fname, None)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return version, data
+
+    def get_state(self, task_id):
+        return self._deserialise(self._read(task_id)[1])
+
+    def get_version(self, task_id):
+        try:
+            return self._read(task_id, header_only=True)[0]
+        except StateNotFound:
+            return None
+
+    def get_versioned_state(self, task_id):
+        version, data = self._read(task_id)
+        return self._deserialise(data), version
+
+    def _mkstemp(self, dir_name):
+        try:
+            return tempfile.mkstemp(dir=dir_name, prefix='.', suffix='.tmp')
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        try:
+            os.makedirs(dir_name)
+        except OSError as e:
+            # another process may have just created it
+            if e.errno != errno.EEXIST:
+                raise
+        return tempfile.mkstemp(dir=dir_name, prefix='.', suffix='.tmp')
+
+    def _write_temp(self, task_id, version, state):
+        fd, tmp_name = self._mkstemp(self._get_dir_name(task_id))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(version.encode('ascii') + b'\n')
+                f.write(self._serialise(state))
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        except Exception:
+            self._remove(tmp_name)
+            raise
+        return tmp_name
+
+    def put_state(self, task_id, state):
+        version = uuid.uuid4().hex
+        tmp_name = self._write_temp(task_id, version, state)
+        try:
+            _replace(tmp_name, self._get_file_name(task_id))
+        except Exception:
+            self._remove(tmp_name)
+            raise
+
+        if self.fsync:
+            self._fsync_dir(self._get_dir_name(task_id))
+        return version
+
+    def _open_locked(self, fname):
+        """
+        Opens the current file of a task and takes an exclusive lock on it.
+        """
+        while True:
+            try:
+                f = open(fname, 'rb')
+            except (IOError, OSError) as e:
+                if e.errno == errno.ENOENT:
+                    raise StateConflict
+                raise
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            # the file may have been replaced while waiting for the lock,
+            # in which case the lock is on a file nobody will read again
+            try:
+                current = os.stat(fname)
+            except OSError as e:
+                f.close()
+                if e.errno == errno.ENOENT:
+                    raise StateConflict
+                raise
+            if current.st_ino == os.fstat(f.fileno()).st_ino:
+                return f
+            f.close()
+
+    def compare_and_set(self, task_id, state, expected_version):
+        if fcntl is None:
+            return super(StateStore, self).compare_and_set(task_id, state, expected_version)
+
+        fname = self._get_file_name(task_id)
+        version = uuid.uuid4().hex
+        tmp_name = self._write_temp(task_id, version, state)
+        try:
+            if expected_version is None:
+                # linking fails if the file already exists, unlike renaming
+                try:
+                    os.link(tmp_name, fname)
+                except OSError as e:
+                    if e.errno == errno.EEXIST:
+                        raise StateConflict
+                    raise
+            else:
+                # every writer going through here holds the lock on the
+                # current file until it has been replaced
+                with self._open_locked(fname) as f:
+                    if f.readline().rstrip(b'\n').decode('ascii') != expected_version:
+                        raise StateConflict
+                    _replace(tmp_name, fname)
+        finally:
+            self._remove(tmp_name)
+
+        if self.fsync:
+            self._fsync_dir(self._get_dir_name(task_id))
+        return version
+
+    def _fsync_dir(self, dir_name):
+        # makes sure the rename itself survives a crash
+        fd = os.open(dir_name, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _remove(self, fname):
+        try:
+            os.remove(fname)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def delete_state(self, task_id):
+        self._remove(self._get_file_name(task_id))
+
+    def remove_expired_state(self):
+        """
+        Deletes the files of all expired tasks, as well as any temporary
+        files left behind by a crash, and returns how many were deleted.
+        """
+        now = time.time()
+        count = 0
+        for dir_path, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if not file_name.endswith(('.task', '.tmp')):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    continue
+                if self._is_expired(mtime, now):
+                    self._remove(path)
+                    count += 1
+        return count
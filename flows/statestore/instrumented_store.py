@@ -0,0 +1,83 @@
+from importlib import import_module
+from flows import config
+from flows.statestore.base import StateStoreBase
+from flows.statestore.metrics import measure
+
+
+def _get_backend():
+    return import_module(config.FLOWS_INSTRUMENTED_STATE_STORE_BACKEND).StateStore()
+
+
+class StateStore(StateStoreBase):
+    """
+    Measures every operation of another state store, reporting how long
+    it took and how many bytes of serialised state were read or written;
+    see ``flows.statestore.metrics``. The store being measured is named
+    by ``FLOWS_INSTRUMENTED_STATE_STORE_BACKEND``.
+
+    Writes made inside `batch` may be sent when the batch ends rather
+    than when they are made, in which case their time is not included.
+    The asynchronous methods run the measured blocking methods in another
+    thread.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or _get_backend()
+
+    @property
+    def refreshes_expiry_on_read(self):
+        return self.backend.refreshes_expiry_on_read
+
+    def get_state(self, task_id):
+        with measure(self, 'get_state', task_id):
+            return self.backend.get_state(task_id)
+
+    def get_version(self, task_id):
+        with measure(self, 'get_version', task_id):
+            return self.backend.get_version(task_id)
+
+    def get_versioned_state(self, task_id):
+        with measure(self, 'get_versioned_state', task_id):
+            return self.backend.get_versioned_state(task_id)
+
+    def put_state(self, task_id, state):
+        with measure(self, 'put_state', task_id):
+            return self.backend.put_state(task_id, state)
+
+    def compare_and_set(self, task_id, state, expected_version):
+        with measure(self, 'compare_and_set', task_id):
+            return self.backend.compare_and_set(task_id, state, expected_version)
+
+    def delete_state(self, task_id):
+        with measure(self, 'delete_state', task_id):
+            self.backend.delete_state(task_id)
+
+    def get_many(self, task_ids):
+        with measure(self, 'get_many'):
+            return self.backend.get_many(task_ids)
+
+    def put_many(self, states):
+        with measure(self, 'put_many'):
+            self.backend.put_many(states)
+
+    def delete_many(self, task_ids):
+        with measure(self, 'delete_many'):
+            self.backend.delete_many(task_ids)
+
+    def is_valid_task_id(self, task_id):
+        return self.backend.is_valid_task_id(task_id)
+
+    def get_task_token(self, state):
+        return self.backend.get_task_token(state)
+
+    def get_binding(self, value):
+        return self.backend.get_binding(value)
+
+    def get_fingerprint(self, state):
+        return self.backend.get_fingerprint(state)
+
+    def get_key_fingerprints(self, state):
+        return self.backend.get_key_fingerprints(state)
+
+    def batch(self):
+        return self.backend.batch()
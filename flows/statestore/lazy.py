@@ -0,0 +1,154 @@
+# -*- coding: UTF-8 -*-
+"""
+State which is only deserialised one key at a time, when each key is
+first used.
+
+When the ``FLOWS_STATE_PER_KEY_ENCODING`` setting is on, each value in
+the state is serialised on its own and the results are packed together
+with their keys. Loading such state only unpacks it; values are not
+deserialised until they are needed, so a step which only looks at a
+couple of small keys does not pay for the rest.
+"""
+import struct
+import six
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    # compatibility for python 2
+    from collections import MutableMapping
+
+
+PACKED_HEADER = b'\x03'
+
+_LENGTHS = struct.Struct('>HI')
+
+
+class LazyState(MutableMapping):
+    """
+    A mapping of state keys to values which calls `decode` with the
+    stored data of a value the first time it is used.
+
+    `stored` keeps the data each key had when the state was loaded, so
+    that stores can tell which keys need writing back.
+    """
+
+    def __init__(self, stored, decode):
+        self.stored = stored
+        self._decode = decode
+        self._raw = dict(stored)
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        value = self._values[key] = self._decode(self._raw.pop(key))
+        return value
+
+    def __setitem__(self, key, value):
+        self._raw.pop(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key in self._values:
+            del self._values[key]
+        else:
+            del self._raw[key]
+
+    def __contains__(self, key):
+        # checking for a key should not need its value
+        return key in self._values or key in self._raw
+
+    def __iter__(self):
+        return iter(list(self._values) + list(self._raw))
+
+    def __len__(self):
+        return len(self._values) + len(self._raw)
+
+    def __reduce__(self):
+        # copies and pickles of the state are plain dictionaries
+        return dict, (dict(self),)
+
+    def copy(self):
+        """
+        Returns a plain dictionary of the state, loading every value.
+        """
+        return dict(self)
+
+    def __repr__(self):
+        return '<LazyState %r>' % sorted(self)
+
+    def is_loaded(self, key):
+        return key in self._values
+
+    def encode(self, encode):
+        """
+        Returns the stored data for every key, calling `encode` only for
+        the values which have been used and so may have changed.
+        """
+        data = dict(self._raw)
+        for key, value in self._values.items():
+            data[key] = encode(value)
+        return data
+
+
+def pack(stored):
+    """
+    Packs a dictionary of state keys to serialised values into bytes.
+    """
+    parts = [PACKED_HEADER]
+    for key, data in stored.items():
+        key = encode_key(key)
+        parts.append(_LENGTHS.pack(len(key), len(data)))
+        parts.append(key)
+        parts.append(data)
+    return b''.join(parts)
+
+
+def is_packed(data):
+    return data[:1] == PACKED_HEADER
+
+
+def encode_key(key):
+    """
+    Turns a state key into the bytes it is stored as. Only string keys
+    can be stored this way, as `decode_key` could not tell what type any
+    other key had.
+    """
+    if not isinstance(key, six.string_types):
+        raise TypeError('State keys must be strings to be stored one at a time, not %r' % (key,))
+    if isinstance(key, six.text_type):
+        key = key.encode('utf-8')
+    return key
+
+
+def decode_key(key):
+    """
+    Turns a key read back from storage into a native string where
+    possible, as state keys usually are.
+    """
+    key = key.decode('utf-8')
+    if six.PY2:
+        try:
+            return key.encode('ascii')
+        except UnicodeEncodeError:
+            pass
+    return key
+
+
+def unpack(data):
+    """
+    Reverses `pack`, without deserialising any of the values.
+    """
+    stored = {}
+    offset = len(PACKED_HEADER)
+    while offset < len(data):
+        key_length, data_length = _LENGTHS.unpack_from(data, offset)
+        offset += _LENGTHS.size
+        key = decode_key(data[offset:offset + key_length])
+        offset += key_length
+        stored[key] = data[offset:offset + data_length]
+        offset += data_length
+    return stored
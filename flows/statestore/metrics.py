@@ -0,0 +1,166 @@
+# -*- coding: UTF-8 -*-
+"""
+Measurements of state store operations: how long each one took, and how
+many bytes of serialised state it read or wrote.
+
+Measurements are taken by ``flows.statestore.instrumented_store``, and
+each one is sent as the `state_operation` signal and passed to the
+callable named by the ``FLOWS_STATE_METRICS_SINK`` setting, if any.
+`InMemoryMetrics` is a ready-made sink which keeps totals and a histogram
+of state sizes for each flow, for use in tests and debugging.
+"""
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from importlib import import_module
+from django.dispatch import Signal
+from flows import config
+
+
+state_operation = Signal()
+"""
+Sent after each state store operation, with the store as the sender and
+the `StateMetric` as ``metric``.
+"""
+
+
+StateMetric = namedtuple('StateMetric', ['operation', 'task_id', 'flow', 'duration', 'size'])
+"""
+One state store operation. `task_id` is ``None`` for operations on many
+tasks, `flow` is the name of the flow being handled at the time, if any,
+`duration` is in seconds and `size` is the number of bytes of serialised
+state read or written.
+"""
+
+
+_local = threading.local()
+
+_sinks = {}
+
+
+def _get_sink():
+    path = config.FLOWS_STATE_METRICS_SINK
+    if path is None or callable(path):
+        return path
+    if path not in _sinks:
+        module_name, name = path.rsplit('.', 1)
+        _sinks[path] = getattr(import_module(module_name), name)
+    return _sinks[path]
+
+
+@contextmanager
+def flow(name):
+    """
+    Attributes the operations made inside the block to the named flow.
+    """
+    previous = getattr(_local, 'flow', None)
+    _local.flow = name
+    try:
+        yield
+    finally:
+        _local.flow = previous
+
+
+def count_bytes(size):
+    """
+    Called by stores with the size of the serialised state they read or
+    write, which is added to the operation being measured, if any.
+    """
+    sizes = getattr(_local, 'sizes', None)
+    if sizes:
+        sizes[-1] += size
+
+
+@contextmanager
+def measure(store, operation, task_id=None):
+    """
+    Measures the store operation made inside the block, then reports it.
+    """
+    sizes = getattr(_local, 'sizes', None)
+    if sizes is None:
+        sizes = _local.sizes = []
+    # operations can be nested, for example when a store falls back to
+    # another, so each level counts its own bytes
+    sizes.append(0)
+    start = time.time()
+    try:
+        yield
+    finally:
+        # failed operations, such as reads of state which is not found,
+        # are reported too
+        duration = time.time() - start
+        size = sizes.pop()
+        if sizes:
+            sizes[-1] += size
+        _report(store, StateMetric(operation, task_id, getattr(_local, 'flow', None), duration, size))
+
+
+def _report(store, metric):
+    state_operation.send(sender=store, metric=metric)
+    sink = _get_sink()
+    if sink is not None:
+        sink(metric)
+
+
+def _bucket(size):
+    # sizes are grouped by the next power of two, so 1000 bytes is
+    # counted under 1024
+    bucket = 1
+    while bucket < size:
+        bucket <<= 1
+    return bucket
+
+
+class InMemoryMetrics(object):
+    """
+    A sink which keeps, for each operation, how many times it was called
+    and the total time and bytes it took, and for each flow a histogram
+    of the sizes of the state read and written. Use it by naming an
+    instance in ``FLOWS_STATE_METRICS_SINK``, or by connecting `receive`
+    to the `state_operation` signal.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+            self._histograms = {}
+
+    def __call__(self, metric):
+        with self._lock:
+            count, duration, size = self.operations.get(metric.operation, (0, 0.0, 0))
+            self.operations[metric.operation] = (count + 1, duration + metric.duration, size + metric.size)
+            if metric.size:
+                histogram = self._histograms.setdefault(metric.flow, {})
+                bucket = _bucket(metric.size)
+                histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def receive(self, sender, metric, **kwargs):
+        self(metric)
+
+    def count(self, operation):
+        return self.operations.get(operation, (0, 0.0, 0))[0]
+
+    def duration(self, operation):
+        return self.operations.get(operation, (0, 0.0, 0))[1]
+
+    def size(self, operation):
+        return self.operations.get(operation, (0, 0.0, 0))[2]
+
+    def size_histogram(self, flow=None):
+        """
+        Returns a dictionary of bucket to the number of times state of up
+        to that many bytes, and more than half as many, was read or
+        written while handling the flow.
+        """
+        with self._lock:
+            return dict(self._histograms.get(flow, {}))
+
+    @property
+    def flows(self):
+        with self._lock:
+            return list(self._histograms)
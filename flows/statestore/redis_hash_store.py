@@ -0,0 +1,106 @@
+from flows import config
+from flows.statestore import metrics, serializers
+from flows.statestore.base import StateStoreBase, StateNotFound
+from flows.statestore.lazy import LazyState, decode_key, encode_key
+from flows.statestore.redis_store import StateStore as RedisStateStore
+
+
+class StateStore(RedisStateStore):
+    """
+    A redis state store which keeps each task as a hash with one field
+    per state key, rather than as a single value. Writing the state back
+    only sends the keys which changed since it was read, which saves a
+    lot of traffic when a large state is mostly left alone by each step.
+
+    Each value is only deserialised when it is first used. As the keys
+    of the state become the fields of the hash, they must be strings.
+    """
+
+    # the native asynchronous methods of the plain redis store do not
+    # understand hashes, so blocking calls are run in another thread
+    aget_state = StateStoreBase.aget_state
+    aget_versioned_state = StateStoreBase.aget_versioned_state
+    aput_state = StateStoreBase.aput_state
+    adelete_state = StateStoreBase.adelete_state
+
+    def _data_key(self, task_id):
+        return '%s:hash' % task_id
+
+    def _load(self, stored):
+        if not stored:
+            raise StateNotFound
+        stored = dict((decode_key(key), data) for key, data in stored.items())
+        metrics.count_bytes(sum(len(data) for data in stored.values()))
+        return serializers.lazy_state(stored, self._allows_pickle())
+
+    def get_state(self, task_id):
+        stored, = self._read(task_id, 'hgetall', self._data_key(task_id))
+        return self._load(stored)
+
+    def get_versioned_state(self, task_id):
+        self._flush()
+        ttl = config.FLOWS_TASK_IDLE_TIMEOUT
+        pipeline = self._get_db().pipeline()
+        pipeline.get(self._version_key(task_id))
+        pipeline.hgetall(self._data_key(task_id))
+        pipeline.expire(self._data_key(task_id), ttl)
+        pipeline.expire(self._version_key(task_id), ttl)
+        version, stored = pipeline.execute()[:2]
+        return self._load(stored), int(version) if version is not None else None
+
+    def _queue_put(self, pipeline, task_id, state):
+        ttl = config.FLOWS_TASK_IDLE_TIMEOUT
+        hash_key = self._data_key(task_id)
+        stored = self._serialise_values(state)
+        # every key is checked before anything is queued
+        fields = dict((key, encode_key(key)) for key in stored)
+        commands = 0
+
+        if isinstance(state, LazyState):
+            previous = state.stored
+            removed = [key for key in previous if key not in stored]
+            if removed:
+                pipeline.hdel(hash_key, *removed)
+                commands += 1
+            # if the write does not happen after all, the state is always
+            # loaded again before it is next written
+            state.stored = stored
+        else:
+            # nothing is known about what is stored, so replace it all
+            previous = {}
+            pipeline.delete(hash_key)
+            commands += 1
+
+        for key, data in stored.items():
+            if previous.get(key) != data:
+                pipeline.hset(hash_key, fields[key], data)
+                metrics.count_bytes(len(data))
+                commands += 1
+        pipeline.expire(hash_key, ttl)
+
+        # as with the plain redis store, the version is bumped last
+        pipeline.incr(self._version_key(task_id))
+        pipeline.expire(self._version_key(task_id), ttl)
+        return commands + 1
+
+    def delete_state(self, task_id):
+        self._get_writer().delete(self._data_key(task_id), self._version_key(task_id))
+
+    def get_many(self, task_ids):
+        task_ids = list(task_ids)
+        self._flush()
+        ttl = config.FLOWS_TASK_IDLE_TIMEOUT
+        pipeline = self._get_db().pipeline(transaction=False)
+        for task_id in task_ids:
+            pipeline.hgetall(self._data_key(task_id))
+            pipeline.expire(self._data_key(task_id), ttl)
+            pipeline.expire(self._version_key(task_id), ttl)
+        return dict((task_id, self._load(stored))
+                    for task_id, stored in zip(task_ids, pipeline.execute()[::3]) if stored)
+
+    def delete_many(self, task_ids):
+        keys = []
+        for task_id in task_ids:
+            keys += [self._data_key(task_id), self._version_key(task_id)]
+        if keys:
+            self._get_writer().delete(*keys)
@@ -1,5 +1,8 @@
+import six
+import threading
+from contextlib import contextmanager
 from django.core.exceptions import ImproperlyConfigured
-from flows.statestore.base import StateStoreBase, StateNotFound
+from flows.statestore.base import StateStoreBase, StateNotFound, StateConflict
 from flows import config
 
 try:
@@ -8,30 +11,175 @@ except ImportError:
     raise ImproperlyConfigured('The "redis" python client package is required to use Redis as a task state store - get it here http://pypi.python.org/pypi/redis/')
 
 
-class StateStore(StateStoreBase):
-    
-    def _get_settings(self):
-        host = config.FLOWS_REDIS_STATE_STORE_HOST
-        password = config.FLOWS_REDIS_STATE_STORE_PASSWORD
-        port = config.FLOWS_REDIS_STATE_STORE_PORT
-        db_id = config.FLOWS_REDIS_STATE_STORE_DB
-
-        return {'host': host, 'port': port,
-                'password': password, 'db': db_id }
-    
+try:
+    if six.PY2:
+        raise ImportError
+    from flows.statestore._redis_async import AsyncRedisMethods
+except ImportError:
+    # without redis.asyncio, the asynchronous methods run the blocking
+    # ones in another thread
+    class AsyncRedisMethods(object):
+        pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_settings():
+    return {'host': config.FLOWS_REDIS_STATE_STORE_HOST,
+            'port': config.FLOWS_REDIS_STATE_STORE_PORT,
+            'password': config.FLOWS_REDIS_STATE_STORE_PASSWORD,
+            'db': config.FLOWS_REDIS_STATE_STORE_DB,
+            'max_connections': config.FLOWS_REDIS_STATE_STORE_MAX_CONNECTIONS,
+            'socket_timeout': config.FLOWS_REDIS_STATE_STORE_SOCKET_TIMEOUT}
+
+
+def _get_pool():
+    # one connection pool is shared by every store in the process, so
+    # connections (and their AUTH) are reused between requests rather
+    # than being set up again for every state operation
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = redis.ConnectionPool(**_get_settings())
+    return _pool
+
+
+class StateStore(AsyncRedisMethods, StateStoreBase):
+
+    # every read also refreshes the expiry of the keys it touches
+    refreshes_expiry_on_read = True
+    stores_binary = True
+
+    def __init__(self):
+        self._local = threading.local()
+
     def _get_db(self):
-        return redis.Redis(**self._get_settings())
-    
+        return redis.Redis(connection_pool=_get_pool())
+
+    def _get_writer(self):
+        pipeline = getattr(self._local, 'pipeline', None)
+        return pipeline if pipeline is not None else self._get_db()
+
+    def _flush(self):
+        pipeline = getattr(self._local, 'pipeline', None)
+        if pipeline is not None:
+            pipeline.execute()
+
+    @contextmanager
+    def batch(self):
+        if getattr(self._local, 'pipeline', None) is not None:
+            # already batching further up the stack
+            yield
+            return
+
+        pipeline = self._get_db().pipeline(transaction=False)
+        self._local.pipeline = pipeline
+        try:
+            yield
+            # writes are only sent if the block finished, so that a request
+            # which failed part way through does not save half of its work
+            self._local.pipeline = None
+            pipeline.execute()
+        finally:
+            self._local.pipeline = None
+            pipeline.reset()
+
+    def _data_key(self, task_id):
+        return task_id
+
+    def _version_key(self, task_id):
+        return '%s:version' % task_id
+
+    def _read(self, task_id, command, *keys):
+        # any writes queued in this batch need to be visible to the read,
+        # and the expiry is refreshed in the same round-trip
+        self._flush()
+        ttl = config.FLOWS_TASK_IDLE_TIMEOUT
+        pipeline = self._get_db().pipeline()
+        for key in keys:
+            getattr(pipeline, command)(key)
+        pipeline.expire(self._data_key(task_id), ttl)
+        pipeline.expire(self._version_key(task_id), ttl)
+        return pipeline.execute()[:len(keys)]
+
     def get_state(self, task_id):
-        data = self._get_db().get(task_id)
+        data, = self._read(task_id, 'get', self._data_key(task_id))
         if not data:
             raise StateNotFound
         return self._deserialise(data)
+
+    def get_version(self, task_id):
+        version, = self._read(task_id, 'get', self._version_key(task_id))
+        return int(version) if version is not None else None
+
+    def get_versioned_state(self, task_id):
+        version, data = self._read(task_id, 'get', self._version_key(task_id), self._data_key(task_id))
+        if not data:
+            raise StateNotFound
+        return self._deserialise(data), int(version) if version is not None else None
     
-    def put_state(self, task_id, state):
+    def _queue_put(self, pipeline, task_id, state):
+        """
+        Adds the commands which write the state to the pipeline, and
+        returns the position of the new version in the pipeline's results.
+        """
         ttl = config.FLOWS_TASK_IDLE_TIMEOUT
-        data = self._serialise(state)
-        self._get_db().setex(task_id, data, ttl)
+        # the version is bumped after the state is written, so that nobody
+        # can see the new version alongside the old state
+        pipeline.set(self._data_key(task_id), self._serialise(state), ex=ttl)
+        pipeline.incr(self._version_key(task_id))
+        pipeline.expire(self._version_key(task_id), ttl)
+        return 1
+
+    def put_state(self, task_id, state):
+        batched = getattr(self._local, 'pipeline', None) is not None
+        pipeline = self._get_writer() if batched else self._get_db().pipeline()
+        index = self._queue_put(pipeline, task_id, state)
+        if batched:
+            return None
+        return pipeline.execute()[index]
+
+    def compare_and_set(self, task_id, state, expected_version):
+        self._flush()
+        pipeline = self._get_db().pipeline()
+        try:
+            # if the version changes between here and the write, redis
+            # refuses to run the write at all
+            pipeline.watch(self._version_key(task_id))
+            version = pipeline.get(self._version_key(task_id))
+            if (int(version) if version is not None else None) != expected_version:
+                raise StateConflict
+            pipeline.multi()
+            index = self._queue_put(pipeline, task_id, state)
+            return pipeline.execute()[index]
+        except redis.WatchError:
+            raise StateConflict
+        finally:
+            pipeline.reset()
 
     def delete_state(self, task_id):
-        self._get_db().delete(task_id)
\ No newline at end of file
+        self._get_writer().delete(self._data_key(task_id), self._version_key(task_id))
+
+    def get_many(self, task_ids):
+        task_ids = list(task_ids)
+        if not task_ids:
+            return {}
+        self._flush()
+        ttl = config.FLOWS_TASK_IDLE_TIMEOUT
+        pipeline = self._get_db().pipeline()
+        pipeline.mget([self._data_key(task_id) for task_id in task_ids])
+        for task_id in task_ids:
+            pipeline.expire(self._data_key(task_id), ttl)
+            pipeline.expire(self._version_key(task_id), ttl)
+        return dict((task_id, self._deserialise(data))
+                    for task_id, data in zip(task_ids, pipeline.execute()[0]) if data)
+
+    def delete_many(self, task_ids):
+        keys = []
+        for task_id in task_ids:
+            keys += [self._data_key(task_id), self._version_key(task_id)]
+        if keys:
+            self._get_writer().delete(*keys)
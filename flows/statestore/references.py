@@ -0,0 +1,145 @@
+# -*- coding: UTF-8 -*-
+"""
+When the ``FLOWS_STATE_MODELS_BY_REFERENCE`` setting is on, Django model
+instances in task state are stored as a reference to their row instead of
+being pickled whole. This keeps state small however wide the models are,
+and means the instances are always up to date when the state is loaded.
+
+References are resolved when the state is loaded, using one ``in_bulk``
+query per model class no matter how many instances the state holds, or
+how many of its keys hold them.
+"""
+import pickletools
+import six
+from six.moves import cPickle
+from django.db import models
+
+try:
+    from django.apps import apps
+    get_model = apps.get_model
+except ImportError:
+    # compatibility for django < 1.7
+    get_model = models.get_model
+
+
+_PREFIX = 'model:'
+
+
+def persistent_id(obj):
+    """
+    Returns the reference to store for `obj` if it is a saved model
+    instance, or `None` if it should be stored as normal.
+    """
+    if isinstance(obj, models.Model) and obj.pk is not None:
+        opts = obj._meta
+        model_name = getattr(opts, 'model_name', None) or opts.module_name
+        return '%s%s.%s:%s' % (_PREFIX, opts.app_label, model_name, obj.pk)
+    return None
+
+
+def _parse(reference):
+    if not reference.startswith(_PREFIX):
+        raise ValueError('Unknown reference in state: %r' % reference)
+    label, pk = reference[len(_PREFIX):].split(':', 1)
+    model = get_model(*label.split('.'))
+    return model, model._meta.pk.to_python(pk)
+
+
+def pickled_references(data):
+    """
+    Returns the references in pickled state, without unpickling it.
+    """
+    if _PREFIX.encode('ascii') not in data:
+        return []
+    unpickler = cPickle.Unpickler(six.BytesIO(data))
+    if hasattr(unpickler, 'noload'):
+        # noload walks the pickle without creating any objects, and
+        # collects the persistent IDs when given a list
+        found = []
+        unpickler.persistent_load = found
+        unpickler.noload()
+        return found
+
+    # otherwise the opcodes are followed to find the value on top of the
+    # stack, which is the reference, whenever a BINPERSID comes along
+    found = []
+    memo = {}
+    last = None
+    for opcode, arg, _ in pickletools.genops(data):
+        name = opcode.name
+        if name == 'PERSID':
+            found.append(arg)
+        elif name == 'BINPERSID':
+            found.append(last)
+        elif name in ('PUT', 'BINPUT', 'LONG_BINPUT'):
+            memo[arg] = last
+        elif name == 'MEMOIZE':
+            memo[len(memo)] = last
+        elif name in ('GET', 'BINGET', 'LONG_BINGET'):
+            last = memo.get(arg)
+        elif name != 'FRAME':
+            last = arg if isinstance(arg, six.string_types) else None
+    return [reference for reference in found if isinstance(reference, six.string_types)]
+
+
+class Instances(object):
+    """
+    The model instances fetched for the references in some state, using
+    one ``in_bulk`` query per model class. Instances which no longer
+    exist are replaced by `None`.
+
+    State loaded one key at a time shares one of these between its
+    values. `pending` is then the serialised data of every value, and
+    `find` a function returning the references in one of them; the
+    first time any instance is needed, the references in all of the
+    values are fetched together.
+    """
+
+    def __init__(self, pending=None, find=None):
+        self._instances = {}
+        self._pending = pending
+        self._find = find
+
+    def fetch(self, references):
+        if not references:
+            return
+        wanted = {}
+        for reference in references:
+            wanted[_parse(reference)] = reference
+        if self._pending is not None:
+            for data in self._pending:
+                for reference in self._find(data):
+                    wanted[_parse(reference)] = reference
+            self._pending = None
+
+        by_model = {}
+        for model, pk in wanted:
+            if (model, pk) not in self._instances:
+                by_model.setdefault(model, set()).add(pk)
+        for model, pks in by_model.items():
+            found = model._default_manager.in_bulk(list(pks))
+            for pk in pks:
+                self._instances[(model, pk)] = found.get(pk)
+
+    def lookup(self, reference):
+        key = _parse(reference)
+        if key not in self._instances:
+            self.fetch([reference])
+        return self._instances[key]
+
+
+def load_with_references(load, instances=None, references=None):
+    """
+    Calls `load` to deserialise some state, passing it a function to
+    call with each reference found, which returns the model instance to
+    use in its place. The instances are fetched in bulk before the state
+    is loaded. If the `references` in the state are not given, the state
+    is first loaded just to find them.
+    """
+    if instances is None:
+        instances = Instances()
+    if references is None:
+        references = []
+        load(references.append)
+    instances.fetch(references)
+    return load(instances.lookup)
@@ -0,0 +1,316 @@
+# -*- coding: UTF-8 -*-
+"""
+Serialisers turn task state into bytes to be kept by a state store, and
+back again. Which one is used for writing state is controlled by the
+``FLOWS_STATE_SERIALIZER`` setting; state written by any of the built-in
+serialisers can be read back, so the setting can be changed without losing
+existing tasks. Pickled state is only loaded if pickle is allowed, which
+by default it is not when the JSON serialiser is used; see `allows_pickle`.
+"""
+import base64
+import datetime
+import decimal
+import json
+import pickle
+import uuid
+import six
+from functools import partial
+from importlib import import_module
+from six.moves import cPickle
+from django.core.exceptions import SuspiciousOperation
+from django.utils import timezone
+from flows import config
+from flows.statestore import compression, lazy, references
+
+
+class PickleRefused(SuspiciousOperation):
+    """
+    Raised when pickled state is loaded but pickle is not allowed.
+    """
+    pass
+
+
+def _pickle_dumps(state, protocol):
+    if not config.FLOWS_STATE_MODELS_BY_REFERENCE:
+        return cPickle.dumps(state, protocol)
+    out = six.BytesIO()
+    pickler = cPickle.Pickler(out, protocol)
+    pickler.persistent_id = references.persistent_id
+    pickler.dump(state)
+    return out.getvalue()
+
+
+def _pickle_loads(data, instances=None):
+    def load(persistent_load):
+        unpickler = cPickle.Unpickler(six.BytesIO(data))
+        unpickler.persistent_load = persistent_load
+        return unpickler.load()
+    # the references are found without unpickling, so that the state
+    # only needs to be unpickled once
+    return references.load_with_references(load, instances, references.pickled_references(data))
+
+
+class Base64PickleSerializer(object):
+    """
+    The original format: the state is pickled and then base64 encoded, so
+    that it can be kept in a text column.
+    """
+
+    binary = False
+    pickled = True
+
+    def dumps(self, state):
+        if config.FLOWS_STATE_MODELS_BY_REFERENCE:
+            return base64.b64encode(_pickle_dumps(state, 0))
+        return base64.b64encode(pickle.dumps(state))
+
+    def loads(self, data, instances=None):
+        return _pickle_loads(base64.b64decode(data), instances)
+
+
+class PickleSerializer(object):
+    """
+    Pickles the state with the highest available protocol and keeps the
+    result as raw bytes, which is both smaller and faster than the base64
+    encoded original.
+    """
+
+    binary = True
+    pickled = True
+
+    def __init__(self, protocol=cPickle.HIGHEST_PROTOCOL):
+        # anything below protocol 2 does not start with the PROTO opcode,
+        # which is what is used to recognise pickled state
+        self.protocol = max(protocol, 2)
+
+    def dumps(self, state):
+        return _pickle_dumps(state, self.protocol)
+
+    def loads(self, data, instances=None):
+        return _pickle_loads(data, instances)
+
+
+class JSONSerializer(object):
+    """
+    Encodes the state as JSON. Unlike pickle, this does not allow arbitrary
+    code to run when loading state, and the result is readable by other
+    languages.
+
+    Values which JSON cannot represent natively must have their type
+    registered using `register_type`. Common types such as dates, times,
+    decimals, UUIDs and sets are registered already, and saved model
+    instances are always stored by reference. Note that tuples become
+    lists, and that dictionary keys must be strings.
+    """
+
+    binary = False
+    pickled = False
+
+    def __init__(self):
+        self._types_by_class = {}
+        self._types_by_name = {}
+
+    def register_type(self, cls, name, encode, decode):
+        """
+        Allows instances of `cls` to be included in state. `encode` is
+        called with an instance and must return something JSON can
+        represent, and `decode` is called with that value to recreate the
+        instance. `name` identifies the type in the stored JSON, so must
+        not be changed once state has been stored using it.
+        """
+        self._types_by_class[cls] = (name, encode)
+        self._types_by_name[name] = decode
+
+    def _encode(self, obj):
+        reference = references.persistent_id(obj)
+        if reference is not None:
+            return {'__type__': 'model', 'value': reference}
+        for cls in type(obj).__mro__:
+            if cls in self._types_by_class:
+                name, encode = self._types_by_class[cls]
+                return {'__type__': name, 'value': encode(obj)}
+        raise TypeError('%r cannot be stored as JSON; use JSONSerializer.register_type to allow it' % obj)
+
+    def _decode(self, obj, persistent_load):
+        if len(obj) == 2 and '__type__' in obj and 'value' in obj:
+            if obj['__type__'] == 'model':
+                return persistent_load(obj['value'])
+            decode = self._types_by_name.get(obj['__type__'])
+            if decode is not None:
+                return decode(obj['value'])
+        return obj
+
+    def dumps(self, state):
+        data = json.dumps(state, default=self._encode, separators=(',', ':'))
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        return data
+
+    def loads(self, data, instances=None):
+        if isinstance(data, six.binary_type):
+            data = data.decode('utf-8')
+        def load(persistent_load):
+            return json.loads(data, object_hook=partial(self._decode, persistent_load=persistent_load))
+        if '"model:' not in data:
+            # there are no references, so nothing needs finding first
+            return load(None)
+        return references.load_with_references(load, instances)
+
+    def references(self, data):
+        """
+        Returns the references to model instances in the data.
+        """
+        if isinstance(data, six.binary_type):
+            data = data.decode('utf-8')
+        found = []
+        json.loads(data, object_hook=partial(self._decode, persistent_load=found.append))
+        return found
+
+
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _encode_datetime(dt):
+    # aware datetimes are kept in UTC, as django does
+    if dt.tzinfo is not None and dt.utcoffset() is not None:
+        return [dt.astimezone(timezone.utc).strftime(_DATETIME_FORMAT), True]
+    return [dt.strftime(_DATETIME_FORMAT), False]
+
+
+def _decode_datetime(value):
+    dt = datetime.datetime.strptime(value[0], _DATETIME_FORMAT)
+    if value[1]:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+base64_pickle = Base64PickleSerializer()
+binary_pickle = PickleSerializer()
+json_serializer = JSONSerializer()
+
+json_serializer.register_type(datetime.datetime, 'datetime', _encode_datetime, _decode_datetime)
+json_serializer.register_type(datetime.date, 'date',
+                              lambda d: d.toordinal(),
+                              datetime.date.fromordinal)
+json_serializer.register_type(datetime.time, 'time',
+                              lambda t: [t.hour, t.minute, t.second, t.microsecond],
+                              lambda value: datetime.time(*value))
+json_serializer.register_type(datetime.timedelta, 'timedelta',
+                              lambda td: [td.days, td.seconds, td.microseconds],
+                              lambda value: datetime.timedelta(*value))
+json_serializer.register_type(decimal.Decimal, 'decimal', str, decimal.Decimal)
+json_serializer.register_type(uuid.UUID, 'uuid', lambda u: u.hex, uuid.UUID)
+json_serializer.register_type(set, 'set', list, set)
+json_serializer.register_type(frozenset, 'frozenset', list, frozenset)
+
+
+_serializer = None
+
+
+def get_serializer():
+    """
+    Returns the serialiser configured by ``FLOWS_STATE_SERIALIZER``.
+    """
+    global _serializer
+    if _serializer is None:
+        module_name, attr_name = config.FLOWS_STATE_SERIALIZER.rsplit('.', 1)
+        _serializer = getattr(import_module(module_name), attr_name)
+    return _serializer
+
+
+def _is_marked(data):
+    return data[:1] in (b'\x80', b'{') or compression.is_compressed(data) or lazy.is_packed(data)
+
+
+def allows_pickle(serializer):
+    """
+    Whether state which is pickled may be loaded by a store writing with
+    `serializer`. Unpickling data can run arbitrary code, so unless the
+    ``FLOWS_STATE_ALLOW_PICKLE`` setting says otherwise, this is only
+    allowed for serialisers which write pickles themselves.
+    """
+    if config.FLOWS_STATE_ALLOW_PICKLE is not None:
+        return config.FLOWS_STATE_ALLOW_PICKLE
+    return getattr(serializer, 'pickled', True)
+
+
+def _pickle_allowed(allow_pickle):
+    if allow_pickle is None:
+        return allows_pickle(get_serializer())
+    return allow_pickle
+
+
+def _check_pickle_allowed(allow_pickle):
+    if not _pickle_allowed(allow_pickle):
+        raise PickleRefused('Refusing to load pickled task state')
+
+
+def find_references(data, allow_pickle=None):
+    """
+    Returns the references to model instances in serialised data,
+    without creating any objects from it.
+    """
+    if compression.is_compressed(data):
+        return find_references(compression.decompress(data), allow_pickle)
+    first = data[:1]
+    if first == b'{':
+        return json_serializer.references(data)
+    if first == b'\x80':
+        return references.pickled_references(data) if _pickle_allowed(allow_pickle) else []
+    if lazy.is_packed(data):
+        return []
+
+    data = base64.b64decode(data)
+    if _is_marked(data):
+        return find_references(data, allow_pickle)
+    return references.pickled_references(data) if _pickle_allowed(allow_pickle) else []
+
+
+def lazy_state(stored, allow_pickle=None):
+    """
+    Returns state which loads each of the serialised values in `stored`
+    when it is first used. The values share the model instances fetched
+    for their references, so that all of them are fetched together.
+    """
+    instances = references.Instances(list(stored.values()), partial(find_references, allow_pickle=allow_pickle))
+    return lazy.LazyState(stored, partial(load_value, allow_pickle=allow_pickle, instances=instances))
+
+
+def load_value(data, allow_pickle=None, instances=None):
+    """
+    Loads a single value serialised on its own by a state store.
+    """
+    return loads(data, allow_pickle, instances)['value']
+
+
+def loads(data, allow_pickle=None, instances=None):
+    """
+    Loads state written by any of the built-in serialisers, whether or not
+    it was compressed or base64 encoded afterwards. Pickles from protocol 2
+    onwards start with the PROTO opcode, JSON state is always an object and
+    compressed or packed data starts with a header byte; none of these can
+    be the first character of base64.
+
+    State packed one key at a time is returned as a `LazyState`. If
+    `allow_pickle` is false, or it is not given and the configured
+    serialiser does not allow it, `PickleRefused` is raised rather than
+    loading pickled state.
+    """
+    first = data[:1]
+    if first == b'{':
+        return json_serializer.loads(data, instances)
+    if first == b'\x80':
+        _check_pickle_allowed(allow_pickle)
+        return binary_pickle.loads(data, instances)
+    if compression.is_compressed(data):
+        return loads(compression.decompress(data), allow_pickle, instances)
+    if lazy.is_packed(data):
+        return lazy_state(lazy.unpack(data), allow_pickle)
+
+    # everything else is base64: either the original format, or one of
+    # the above encoded for a store which can only keep text
+    data = base64.b64decode(data)
+    if _is_marked(data):
+        return loads(data, allow_pickle, instances)
+    _check_pickle_allowed(allow_pickle)
+    return _pickle_loads(data, instances)
@@ -0,0 +1,154 @@
+import base64
+from importlib import import_module
+from django.core import signing
+from django.utils.crypto import salted_hmac
+from flows import config
+from flows.lru import LRUCache
+from flows.statestore import compression, metrics, serializers
+from flows.statestore.base import StateStoreBase, StateNotFound
+
+
+_SALT = 'flows.statestore.signed_store'
+
+
+def _get_fallback():
+    return import_module(config.FLOWS_SIGNED_STATE_STORE_FALLBACK).StateStore()
+
+
+class StateStore(StateStoreBase):
+    """
+    Keeps small task state on the client rather than on the server: the
+    state is serialised as JSON, compressed and signed with django's ``SECRET_KEY``,
+    and the result is used in place of the task ID in URLs and forms. Such
+    state needs no reads or writes to any store at all, and expires
+    ``FLOWS_TASK_IDLE_TIMEOUT`` seconds after the page carrying it was
+    rendered.
+
+    State which would make a token longer than
+    ``FLOWS_SIGNED_STATE_STORE_MAX_SIZE`` characters is kept in the store
+    named by ``FLOWS_SIGNED_STATE_STORE_FALLBACK`` instead, and the task ID
+    is used as usual.
+
+    Note that the client can see (but not change) the state, and that a
+    token stays valid until it expires, even once the flow is complete.
+    The value a task is bound to is kept as a keyed hash, so the session
+    key never leaves the server. Tokens are only ever read as JSON, never
+    unpickled, and state which cannot be written as JSON is kept in the
+    fallback store.
+
+    A state's token is worked out the first time it is needed and again
+    whenever the state is written, rather than for every URL.
+    """
+
+    stores_binary = True
+
+    def __init__(self, fallback=None, max_size=None):
+        self.fallback = fallback or _get_fallback()
+        self.max_size = max_size or config.FLOWS_SIGNED_STATE_STORE_MAX_SIZE
+        self._signer = signing.TimestampSigner(salt=_SALT)
+        # the state each token was made from is kept alongside it, so that
+        # its id cannot be reused by another state while it is remembered
+        self._tokens = LRUCache(100)
+
+    @property
+    def refreshes_expiry_on_read(self):
+        return self.fallback.refreshes_expiry_on_read
+
+    def _is_token(self, task_id):
+        # signed values always contain the separator, task IDs never do
+        return ':' in task_id
+
+    def _sign(self, state):
+        try:
+            data = serializers.json_serializer.dumps(dict(state))
+        except (TypeError, ValueError):
+            token = None
+        else:
+            data = compression.compress(data, method='zlib', threshold=0)
+            token = self._signer.sign(base64.urlsafe_b64encode(data).decode('ascii'))
+            if len(token) > self.max_size:
+                token = None
+        self._tokens.set(id(state), (state, token))
+        return token
+
+    def _get_token(self, state):
+        remembered = self._tokens.get(id(state))
+        if remembered is not None and remembered[0] is state:
+            return remembered[1]
+        return self._sign(state)
+
+    def _loads(self, data):
+        metrics.count_bytes(len(data))
+        data = compression.decompress(data)
+        if not data.startswith(b'{'):
+            # anything but JSON was not written by this store
+            raise StateNotFound
+        return serializers.json_serializer.loads(data)
+
+    def is_valid_task_id(self, task_id):
+        if self._is_token(task_id):
+            return len(task_id) <= self.max_size
+        return self.fallback.is_valid_task_id(task_id)
+
+    def get_task_token(self, state):
+        return self._get_token(state) or state['_id']
+
+    def get_binding(self, value):
+        # the state is visible to the client, so the session key must not be
+        return salted_hmac(_SALT, value).hexdigest()
+
+    def get_state(self, task_id):
+        if not self._is_token(task_id):
+            return self.fallback.get_state(task_id)
+        try:
+            data = self._signer.unsign(task_id, max_age=config.FLOWS_TASK_IDLE_TIMEOUT)
+        except signing.BadSignature:
+            # this includes tokens which have expired
+            raise StateNotFound
+        return self._loads(base64.urlsafe_b64decode(data.encode('ascii')))
+
+    def get_version(self, task_id):
+        if self._is_token(task_id):
+            return None
+        return self.fallback.get_version(task_id)
+
+    def put_state(self, task_id, state):
+        # small state travels with the next response, so only state which
+        # is too big to be signed needs storing
+        if self._sign(state) is None:
+            return self.fallback.put_state(task_id, state)
+        return None
+
+    def compare_and_set(self, task_id, state, expected_version):
+        # signed state cannot be changed by anyone else, as every request
+        # carries its own copy
+        if self._sign(state) is None:
+            return self.fallback.compare_and_set(task_id, state, expected_version)
+        return None
+
+    def delete_state(self, task_id):
+        self.fallback.delete_state(task_id)
+
+    def get_many(self, task_ids):
+        states = {}
+        stored = []
+        for task_id in task_ids:
+            if not self._is_token(task_id):
+                stored.append(task_id)
+                continue
+            try:
+                states[task_id] = self.get_state(task_id)
+            except StateNotFound:
+                pass
+        states.update(self.fallback.get_many(stored))
+        return states
+
+    def put_many(self, states):
+        self.fallback.put_many(dict((task_id, state) for task_id, state in states.items()
+                                    if self._sign(state) is None))
+
+    def delete_many(self, task_ids):
+        self.fallback.delete_many(task_ids)
+
+    def batch(self):
+        return self.fallback.batch()
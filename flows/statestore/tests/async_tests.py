@@ -0,0 +1,30 @@
+import shutil
+import tempfile
+import unittest
+import six
+from flows.statestore.base import StateNotFound
+from flows.statestore.file_store import StateStore
+
+
+@unittest.skipIf(six.PY2, 'asyncio needs Python 3')
+class AsyncStateStoreTest(unittest.TestCase):
+
+    task_id = 'a1a2a3a4a5a6a7a8a9aaabacadaeafa0'
+
+    def setUp(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self.root = tempfile.mkdtemp()
+        self.store = StateStore(root=self.root)
+
+    def tearDown(self):
+        self.loop.close()
+        shutil.rmtree(self.root)
+
+    def test_round_trip(self):
+        run = self.loop.run_until_complete
+        version = run(self.store.aput_state(self.task_id, {'a': 1}))
+        self.assertEqual({'a': 1}, run(self.store.aget_state(self.task_id)))
+        self.assertEqual(({'a': 1}, version), run(self.store.aget_versioned_state(self.task_id)))
+        run(self.store.adelete_state(self.task_id))
+        self.assertRaises(StateNotFound, run, self.store.aget_state(self.task_id))
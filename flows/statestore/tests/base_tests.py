@@ -0,0 +1,23 @@
+
+import unittest
+from flows.statestore.base import StateStoreBase
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_equal_state(self):
+        store = StateStoreBase()
+        url = u'/some/url/?_id=%s' % ('a' * 32)
+        state = {'_id': 'a' * 32, '_history': [('flow_0', url, False)]}
+        copied = {'_id': 'a' * 32, '_history': [('flow_0', url[:], False)]}
+        # an extra reference to a value should not change anything
+        refs = [url]
+        self.assertEqual(store.get_fingerprint(state), store.get_fingerprint(copied))
+        del refs
+
+    def test_nested_change(self):
+        store = StateStoreBase()
+        state = {'basket': [1, 2]}
+        fingerprint = store.get_fingerprint(state)
+        state['basket'].append(3)
+        self.assertNotEqual(fingerprint, store.get_fingerprint(state))
@@ -0,0 +1,35 @@
+
+import unittest
+from flows.statestore.base import StateNotFound
+from flows.statestore.cache_store import StateStore
+from flows.statestore.tests.utils import bulk_methods_work, store_state_works
+
+
+class CacheStateStoreTest(unittest.TestCase):
+
+    task_id = 'b1b2b3b4b5b6b7b8b9babbbcbdbebfb0'
+
+    def setUp(self):
+        self.store = StateStore()
+
+    def tearDown(self):
+        self.store.cache.clear()
+
+    def test_cache_store_state(self):
+        store_state_works(self, self.store)
+
+    def test_bulk_methods(self):
+        # the test cache only holds a few hundred entries
+        bulk_methods_work(self, self.store, count=100)
+
+    def test_version(self):
+        version = self.store.put_state(self.task_id, {'a': 1})
+        self.assertEqual(version, self.store.get_version(self.task_id))
+        self.assertEqual(({'a': 1}, version), self.store.get_versioned_state(self.task_id))
+        self.assertNotEqual(version, self.store.put_state(self.task_id, {'a': 1}))
+
+    def test_delete(self):
+        self.store.put_state(self.task_id, {'a': 1})
+        self.store.delete_state(self.task_id)
+        self.assertRaises(StateNotFound, self.store.get_state, self.task_id)
+        self.assertEqual(None, self.store.get_version(self.task_id))
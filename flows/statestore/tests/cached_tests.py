@@ -0,0 +1,104 @@
+
+import time
+import unittest
+from mock import patch
+from flows import config
+from flows.statestore import django_store, signed_store
+from flows.statestore.cached_store import StateStore
+from flows.statestore.tests import models
+from flows.statestore.tests.utils import compare_and_set_works, store_state_works
+
+
+class CachedStateStoreTest(unittest.TestCase):
+
+    task_id = 'e0e1e2e3e4e5e6e7e8e9eaebecedeeef'
+
+    def setUp(self):
+        self.backend = django_store.StateStore()
+        self.store = StateStore(backend=self.backend, max_entries=10, ttl=60)
+
+    def tearDown(self):
+        self.backend.delete_state(self.task_id)
+
+    def test_store_state(self):
+        store_state_works(self, self.store)
+
+    def test_compare_and_set(self):
+        compare_and_set_works(self, self.store)
+
+    def test_hit(self):
+        self.store.put_state(self.task_id, {'a': 1})
+        self.assertEqual({'a': 1}, self.store.get_state(self.task_id))
+        self.assertEqual({'a': 1}, self.store.get_state(self.task_id))
+        self.assertEqual((2, 0), (self.store.hits, self.store.misses))
+
+    def test_changes_do_not_leak_into_cache(self):
+        self.store.put_state(self.task_id, {'a': [1]})
+        self.store.get_state(self.task_id)['a'].append(2)
+        self.assertEqual({'a': [1]}, self.store.get_state(self.task_id))
+
+    def test_written_elsewhere(self):
+        self.store.put_state(self.task_id, {'a': 1})
+        self.store.get_state(self.task_id)
+
+        # another process writing to the backing store
+        django_store.StateStore().put_state(self.task_id, {'a': 2})
+
+        self.assertEqual({'a': 2}, self.store.get_state(self.task_id))
+        self.assertEqual(1, self.store.misses)
+
+    def test_deleted(self):
+        self.store.put_state(self.task_id, {'a': 1})
+        self.store.delete_state(self.task_id)
+        self.assertRaises(django_store.StateNotFound, self.store.get_state, self.task_id)
+
+    def test_hit_only_checks_version(self):
+        self.store.put_state(self.task_id, {'a': 1})
+        with patch.object(self.backend, 'get_versioned_state') as get_versioned_state:
+            with patch.object(self.backend, 'get_version', wraps=self.backend.get_version) as get_version:
+                self.assertEqual({'a': 1}, self.store.get_state(self.task_id))
+        self.assertEqual((0, 1), (get_versioned_state.call_count, get_version.call_count))
+
+    def test_check_interval(self):
+        store = StateStore(backend=self.backend, max_entries=10, ttl=60, check_interval=30)
+        store.put_state(self.task_id, {'a': 1})
+        django_store.StateStore().put_state(self.task_id, {'a': 2})
+
+        with patch.object(self.backend, 'get_version') as get_version:
+            # within the interval the cached copy is trusted, however old
+            self.assertEqual({'a': 1}, store.get_state(self.task_id))
+        self.assertEqual(0, get_version.call_count)
+
+        later = time.time() + 31
+        with patch('flows.statestore.cached_store.time.time', return_value=later):
+            self.assertEqual({'a': 2}, store.get_state(self.task_id))
+
+    def test_models_by_reference_are_current(self):
+        apple = models.TestModel.objects.create(fruit='apple', count=1)
+        with patch.object(config, 'FLOWS_STATE_MODELS_BY_REFERENCE', True):
+            self.store.put_state(self.task_id, {'model': apple})
+            models.TestModel.objects.filter(pk=apple.pk).update(count=2)
+            self.assertEqual(2, self.store.get_state(self.task_id)['model'].count)
+        self.assertEqual(1, self.store.hits)
+
+    def test_zero_ttl(self):
+        self.assertEqual(0, StateStore(backend=self.backend, ttl=0)._cache.ttl)
+
+    def test_in_front_of_signed_store(self):
+        # the task IDs, tokens and bindings are the backing store's
+        backend = signed_store.StateStore(fallback=self.backend)
+        store = StateStore(backend=backend, max_entries=10, ttl=60)
+        state = {'_id': self.task_id, '_bound_to': store.get_binding('session-key'), 'a': 1}
+        self.assertEqual(backend.get_binding('session-key'), state['_bound_to'])
+        self.assertNotEqual('session-key', state['_bound_to'])
+
+        store.put_state(self.task_id, state)
+        token = store.get_task_token(state)
+        self.assertEqual(backend.get_task_token(state), token)
+        self.assertTrue(store.is_valid_task_id(token))
+        self.assertEqual(state, store.get_state(token))
+
+    def test_key_fingerprints_from_backend(self):
+        with patch.object(self.backend, 'get_key_fingerprints', return_value={'a': b'x'}) as fingerprints:
+            self.assertEqual({'a': b'x'}, self.store.get_key_fingerprints({'a': 1}))
+        fingerprints.assert_called_once_with({'a': 1})
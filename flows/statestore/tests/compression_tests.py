@@ -0,0 +1,46 @@
+
+import base64
+import os
+import unittest
+from flows import config
+from flows.statestore import compression, serializers
+from flows.statestore.django_store import StateStore
+
+
+class CompressionTest(unittest.TestCase):
+
+    task_id = 'c0c1c2c3c4c5c6c7c8c9cacbcccdcecf'
+    state = {'_id': task_id, 'basket': [{'sku': 'SKU-%05d' % i, 'quantity': 1} for i in range(100)]}
+
+    def setUp(self):
+        self._settings = config.FLOWS_STATE_COMPRESSION, config.FLOWS_STATE_COMPRESSION_THRESHOLD
+        config.FLOWS_STATE_COMPRESSION = 'zlib'
+        config.FLOWS_STATE_COMPRESSION_THRESHOLD = 100
+
+    def tearDown(self):
+        config.FLOWS_STATE_COMPRESSION, config.FLOWS_STATE_COMPRESSION_THRESHOLD = self._settings
+        StateStore().delete_state(self.task_id)
+
+    def test_threshold(self):
+        self.assertEqual(b'x' * 99, compression.compress(b'x' * 99))
+        self.assertTrue(compression.is_compressed(compression.compress(b'x' * 100)))
+
+    def test_incompressible(self):
+        data = os.urandom(200)
+        self.assertEqual(data, compression.compress(data))
+
+    def test_store_round_trip(self):
+        store = StateStore()
+        for serializer in (serializers.base64_pickle, serializers.binary_pickle, serializers.json_serializer):
+            store.serializer = serializer
+            data = store._serialise(self.state)
+            self.assertTrue(compression.is_compressed(base64.b64decode(data)))
+            store.put_state(self.task_id, self.state)
+            self.assertEqual(self.state, store.get_state(self.task_id))
+
+    def test_read_uncompressed(self):
+        store = StateStore()
+        config.FLOWS_STATE_COMPRESSION = None
+        store.put_state(self.task_id, self.state)
+        config.FLOWS_STATE_COMPRESSION = 'zlib'
+        self.assertEqual(self.state, store.get_state(self.task_id))
@@ -1,7 +1,11 @@
 
 import unittest
-from flows.statestore.django_store import StateStore
-from flows.statestore.tests.utils import store_state_works
+from datetime import timedelta
+from django.utils import timezone
+from flows import config
+from flows.statestore import django_store
+from flows.statestore.django_store import StateStore, StateModel
+from flows.statestore.tests.utils import bulk_methods_work, compare_and_set_works, store_state_works
     
 
 class DjangoStateStoreTest(unittest.TestCase):
@@ -9,3 +13,118 @@ class DjangoStateStoreTest(unittest.TestCase):
     def test_django_store_state(self):
         store = StateStore()
         store_state_works(self, store)
+
+    def test_compare_and_set(self):
+        compare_and_set_works(self, StateStore())
+
+
+class DjangoStateStoreTouchTest(unittest.TestCase):
+
+    task_id = 'a0b1c2d3e4f5a6b7c8d9e0f1a2b3c4d5'
+
+    def setUp(self):
+        self.store = StateStore()
+        self.store.put_state(self.task_id, {'a': 1})
+        self._interval = config.FLOWS_DJANGO_STATE_STORE_TOUCH_INTERVAL
+
+    def tearDown(self):
+        config.FLOWS_DJANGO_STATE_STORE_TOUCH_INTERVAL = self._interval
+        self.store.delete_state(self.task_id)
+
+    def _set_last_access(self, seconds_ago):
+        last_access = timezone.now() - timedelta(seconds=seconds_ago)
+        StateModel.objects.filter(task_id=self.task_id).update(last_access=last_access)
+        return last_access
+
+    def _get_last_access(self):
+        return StateModel.objects.get(task_id=self.task_id).last_access
+
+    def test_read_touches_last_access(self):
+        last_access = self._set_last_access(30)
+        self.assertEqual({'a': 1}, self.store.get_state(self.task_id))
+        self.assertTrue(self._get_last_access() > last_access)
+
+    def test_recent_touch_is_skipped(self):
+        config.FLOWS_DJANGO_STATE_STORE_TOUCH_INTERVAL = 60
+        last_access = self._set_last_access(30)
+        self.store.get_state(self.task_id)
+        self.assertEqual(last_access, self._get_last_access())
+
+        last_access = self._set_last_access(90)
+        self.store.get_state(self.task_id)
+        self.assertTrue(self._get_last_access() > last_access)
+
+
+class DjangoStateStoreUpsertTest(unittest.TestCase):
+
+    task_id = 'f0e1d2c3b4a5f6e7d8c9b0a1f2e3d4c5'
+
+    def tearDown(self):
+        StateStore().delete_state(self.task_id)
+
+    def _put_twice(self, store):
+        store.put_state(self.task_id, {'a': 1})
+        stale = timezone.now() - timedelta(seconds=30)
+        StateModel.objects.filter(task_id=self.task_id).update(last_access=stale)
+
+        store.put_state(self.task_id, {'a': 2})
+
+        self.assertEqual(1, StateModel.objects.filter(task_id=self.task_id).count())
+        self.assertEqual({'a': 2}, store.get_state(self.task_id))
+        self.assertTrue(StateModel.objects.get(task_id=self.task_id).last_access > stale)
+
+    def test_upsert(self):
+        self._put_twice(StateStore())
+
+    def test_fallback(self):
+        get_upsert_sql = django_store._get_upsert_sql
+        django_store._get_upsert_sql = lambda connection: None
+        try:
+            self._put_twice(StateStore())
+        finally:
+            django_store._get_upsert_sql = get_upsert_sql
+
+
+class DjangoStateStoreBulkTest(unittest.TestCase):
+
+    def test_bulk_methods(self):
+        bulk_methods_work(self, StateStore())
+
+    def test_bulk_methods_fallback(self):
+        get_upsert_sql = django_store._get_upsert_sql
+        django_store._get_upsert_sql = lambda connection, returning=True: None
+        try:
+            bulk_methods_work(self, StateStore())
+        finally:
+            django_store._get_upsert_sql = get_upsert_sql
+
+    def test_versions_bumped(self):
+        store = StateStore()
+        task_id = 'a' * 32
+        store.put_state(task_id, {'a': 1})
+        version = store.get_version(task_id)
+        store.put_many({task_id: {'a': 2}})
+        self.assertEqual(version + 1, store.get_version(task_id))
+        store.delete_many([task_id])
+
+
+class DjangoStateStoreExpiryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = StateStore()
+        self.task_ids = ['%032x' % i for i in range(25)]
+        self.store.put_many(dict((task_id, {'_id': task_id}) for task_id in self.task_ids))
+        stale = timezone.now() - timedelta(seconds=config.FLOWS_TASK_IDLE_TIMEOUT + 60)
+        StateModel.objects.get_unfiltered_queryset().filter(task_id__in=self.task_ids[:20]).update(last_access=stale)
+
+    def tearDown(self):
+        self.store.delete_many(self.task_ids)
+
+    def test_batches(self):
+        self.assertEqual(20, StateModel.objects.remove_expired_state(batch_size=7))
+        remaining = StateModel.objects.get_unfiltered_queryset().filter(task_id__in=self.task_ids)
+        self.assertEqual(self.task_ids[20:], sorted(remaining.values_list('task_id', flat=True)))
+
+    def test_max_runtime(self):
+        self.assertEqual(7, StateModel.objects.remove_expired_state(batch_size=7, max_runtime=0.01, sleep=0.02))
+        self.assertEqual(13, StateModel.objects.remove_expired_state(batch_size=7, sleep=0))
@@ -0,0 +1,74 @@
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from flows import config
+from flows.statestore.base import StateNotFound
+from flows.statestore.file_store import StateStore
+from flows.statestore.tests.utils import compare_and_set_works, store_state_works
+
+
+class FileStateStoreTest(unittest.TestCase):
+
+    task_id = 'a1a2a3a4a5a6a7a8a9aaabacadaeafa0'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = StateStore(root=self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _age(self, seconds):
+        then = time.time() - seconds
+        os.utime(self.store._get_file_name(self.task_id), (then, then))
+
+    def test_file_store_state(self):
+        store_state_works(self, self.store)
+
+    def test_compare_and_set(self):
+        compare_and_set_works(self, self.store)
+        # nothing is left behind by the conflicting writes
+        self.assertEqual([], os.listdir(os.path.join(self.root, 'c0')))
+
+    def test_sharded(self):
+        self.store.put_state(self.task_id, {'a': 1})
+        self.assertEqual(['%s.task' % self.task_id], os.listdir(os.path.join(self.root, 'a1')))
+
+    def test_fsync(self):
+        store = StateStore(root=self.root, fsync=True)
+        store.put_state(self.task_id, {'a': 1})
+        self.assertEqual({'a': 1}, store.get_state(self.task_id))
+
+    def test_missing(self):
+        self.assertRaises(StateNotFound, self.store.get_state, self.task_id)
+        self.assertEqual(None, self.store.get_version(self.task_id))
+        self.store.delete_state(self.task_id)
+
+    def test_version(self):
+        version = self.store.put_state(self.task_id, {'a': 1})
+        self.assertEqual(version, self.store.get_version(self.task_id))
+        self.assertEqual(({'a': 1}, version), self.store.get_versioned_state(self.task_id))
+        self.assertNotEqual(version, self.store.put_state(self.task_id, {'a': 1}))
+
+    def test_expiry(self):
+        self.store.put_state(self.task_id, {'a': 1})
+        self._age(config.FLOWS_TASK_IDLE_TIMEOUT + 10)
+        self.assertRaises(StateNotFound, self.store.get_state, self.task_id)
+        self.assertFalse(os.path.exists(self.store._get_file_name(self.task_id)))
+
+    def test_read_refreshes_expiry(self):
+        self.store.put_state(self.task_id, {'a': 1})
+        self._age(config.FLOWS_TASK_IDLE_TIMEOUT - 10)
+        self.store.get_state(self.task_id)
+        mtime = os.stat(self.store._get_file_name(self.task_id)).st_mtime
+        self.assertTrue(time.time() - mtime < 10)
+
+    def test_remove_expired_state(self):
+        self.store.put_state(self.task_id, {'a': 1})
+        self.store.put_state('b' * 32, {'b': 1})
+        self._age(config.FLOWS_TASK_IDLE_TIMEOUT + 10)
+        self.assertEqual(1, self.store.remove_expired_state())
+        self.assertEqual({'b': 1}, self.store.get_state('b' * 32))
@@ -0,0 +1,97 @@
+import unittest
+from django.test.utils import override_settings
+from mock import patch
+from flows import config
+from flows.components import ActionTemplateResponse
+from flows.statestore import compression, lazy, serializers
+from flows.statestore.django_store import StateStore
+from flows.statestore.lazy import LazyState
+from flows.tests.utils import make_request
+
+
+class LazyStateTest(unittest.TestCase):
+
+    task_id = 'd0d1d2d3d4d5d6d7d8d9dadbdcdddedf'
+    state = {'_id': task_id, 'basket': list(range(100)), u'n\xe4me': 'x'}
+
+    def setUp(self):
+        self._setting = config.FLOWS_STATE_PER_KEY_ENCODING
+        config.FLOWS_STATE_PER_KEY_ENCODING = True
+        self.store = StateStore()
+
+    def tearDown(self):
+        config.FLOWS_STATE_PER_KEY_ENCODING = self._setting
+        self.store.delete_state(self.task_id)
+
+    def test_pack(self):
+        stored = {'a': b'1', 'b': b''}
+        self.assertEqual(stored, lazy.unpack(lazy.pack(stored)))
+
+    def test_store_round_trip(self):
+        for serializer in (serializers.base64_pickle, serializers.binary_pickle, serializers.json_serializer):
+            self.store.serializer = serializer
+            self.store.put_state(self.task_id, self.state)
+            fetched = self.store.get_state(self.task_id)
+            self.assertTrue(isinstance(fetched, LazyState))
+            self.assertEqual(self.state, dict(fetched))
+
+    def test_values_loaded_when_used(self):
+        self.store.put_state(self.task_id, self.state)
+        with patch.object(serializers, 'load_value', wraps=serializers.load_value) as load_value:
+            fetched = self.store.get_state(self.task_id)
+            self.assertTrue('basket' in fetched)
+            self.assertEqual(self.task_id, fetched['_id'])
+            self.assertEqual(self.task_id, fetched['_id'])
+            self.assertEqual(1, load_value.call_count)
+        self.assertFalse(fetched.is_loaded('basket'))
+
+    def test_fingerprint(self):
+        self.store.put_state(self.task_id, self.state)
+        fetched = self.store.get_state(self.task_id)
+        fingerprint = self.store.get_fingerprint(fetched)
+
+        fetched['basket']
+        self.assertEqual(fingerprint, self.store.get_fingerprint(fetched))
+        fetched['basket'].append(100)
+        self.assertNotEqual(fingerprint, self.store.get_fingerprint(fetched))
+
+    def test_changes_written(self):
+        self.store.put_state(self.task_id, self.state)
+        fetched = self.store.get_state(self.task_id)
+        fetched['new'] = 1
+        del fetched[u'n\xe4me']
+        self.store.put_state(self.task_id, fetched)
+        self.assertEqual({'_id': self.task_id, 'basket': list(range(100)), 'new': 1},
+                         dict(self.store.get_state(self.task_id)))
+
+    def test_copy(self):
+        self.store.put_state(self.task_id, self.state)
+        copied = self.store.get_state(self.task_id).copy()
+        self.assertTrue(type(copied) is dict)
+        self.assertEqual(self.state, copied)
+
+    def test_non_string_keys_refused(self):
+        self.assertRaises(TypeError, self.store.put_state, self.task_id, {'_id': self.task_id, 1: 'a'})
+
+    def test_values_compressed_once(self):
+        state = dict(self.state, basket=list(range(1000)))
+        with patch.object(config, 'FLOWS_STATE_COMPRESSION', 'zlib'):
+            with patch.object(compression, 'compress', wraps=compression.compress) as compress:
+                data = self.store._serialise(state)
+            self.assertEqual(len(state), compress.call_count)
+            self.assertEqual(state, dict(self.store._deserialise(data)))
+
+    def test_rendering_loads_used_keys(self):
+        self.store.put_state(self.task_id, self.state)
+        fetched = self.store.get_state(self.task_id)
+        templates = [{'BACKEND': 'django.template.backends.django.DjangoTemplates',
+                      'OPTIONS': {'loaders': [('django.template.loaders.locmem.Loader',
+                                               {'lazy.html': '{{ title }} {{ basket|length }}'})]}}]
+        with override_settings(TEMPLATES=templates):
+            response = ActionTemplateResponse(make_request('/'), 'lazy.html', {'title': 'Basket'},
+                                              state=fetched)
+            response.render()
+        self.assertEqual(b'Basket 100', response.content)
+        self.assertTrue(fetched.is_loaded('basket'))
+        self.assertFalse(fetched.is_loaded('_id'))
+        self.assertFalse(fetched.is_loaded(u'n\xe4me'))
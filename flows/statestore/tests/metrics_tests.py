@@ -0,0 +1,81 @@
+import itertools
+import threading
+import unittest
+from mock import patch
+from flows import config
+from flows.statestore import django_store, metrics
+from flows.statestore.base import StateNotFound
+from flows.statestore.instrumented_store import StateStore
+from flows.statestore.metrics import InMemoryMetrics, state_operation
+from flows.statestore.tests.utils import store_state_works
+
+
+class InstrumentedStateStoreTest(unittest.TestCase):
+
+    task_id = 'd0d1d2d3d4d5d6d7d8d9dadbdcdddedf'
+
+    def setUp(self):
+        self.store = StateStore(backend=django_store.StateStore())
+        self.metrics = InMemoryMetrics()
+        # the flow being handled and the sizes being counted are kept
+        # apart from any other test's
+        for patcher in (patch.object(config, 'FLOWS_STATE_METRICS_SINK', self.metrics),
+                        patch.object(metrics, '_local', threading.local()),
+                        patch.object(metrics, '_sinks', {})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.store.delete_state(self.task_id)
+
+    def test_store_state(self):
+        store_state_works(self, self.store)
+
+    def test_operations(self):
+        # each reading of the clock is a second later than the last
+        with patch('flows.statestore.metrics.time') as clock:
+            clock.time.side_effect = itertools.count()
+            self.store.put_state(self.task_id, {'a': 'x' * 100})
+            self.store.get_state(self.task_id)
+            self.store.get_state(self.task_id)
+            self.assertRaises(StateNotFound, self.store.get_state, 'f' * 32)
+
+        self.assertEqual(1, self.metrics.count('put_state'))
+        self.assertEqual(3, self.metrics.count('get_state'))
+        self.assertTrue(self.metrics.size('put_state') > 100)
+        self.assertEqual(2 * self.metrics.size('put_state'), self.metrics.size('get_state'))
+        self.assertEqual(3, self.metrics.duration('get_state'))
+
+    def test_size_histogram(self):
+        with metrics.flow('small'):
+            self.store.put_state(self.task_id, {'a': 'x'})
+        with metrics.flow('large'):
+            self.store.put_state(self.task_id, {'a': 'x' * 5000})
+            self.store.get_state(self.task_id)
+
+        self.assertEqual(['large', 'small'], sorted(self.metrics.flows))
+        small, = self.metrics.size_histogram('small')
+        self.assertTrue(small <= 128)
+        self.assertEqual({8192: 2}, self.metrics.size_histogram('large'))
+        self.assertEqual({}, self.metrics.size_histogram())
+
+    def test_signal(self):
+        received = []
+
+        def receiver(sender, metric, **kwargs):
+            received.append((sender, metric))
+
+        state_operation.connect(receiver)
+        try:
+            self.store.delete_many([self.task_id])
+        finally:
+            state_operation.disconnect(receiver)
+
+        (sender, metric), = received
+        self.assertEqual(self.store, sender)
+        self.assertEqual(('delete_many', None, None, 0), (metric.operation, metric.task_id, metric.flow, metric.size))
+
+    def test_no_measurement(self):
+        # bytes handled outside of a measured operation are not counted
+        self.store.backend.put_state(self.task_id, {'a': 1})
+        self.assertEqual({}, self.metrics.operations)
@@ -0,0 +1,148 @@
+import unittest
+import six
+from mock import patch
+from flows.statestore.base import StateNotFound
+from flows.statestore.tests.utils import bulk_methods_work, compare_and_set_works, store_state_works
+
+try:
+    import fakeredis
+    from flows.statestore import redis_hash_store, redis_store
+except ImportError:
+    fakeredis = None
+
+
+def fake_pool(server=None):
+    return redis_store.redis.ConnectionPool(connection_class=fakeredis.FakeConnection,
+                                            server=server or fakeredis.FakeServer())
+
+
+@unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+class RedisStateStoreTest(unittest.TestCase):
+
+    task_id = 'd1d2d3d4d5d6d7d8d9dadbdcdddedfd0'
+
+    def get_store(self):
+        return redis_store.StateStore()
+
+    def setUp(self):
+        patcher = patch('flows.statestore.redis_store._pool', fake_pool())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = self.get_store()
+
+    def test_redis_store_state(self):
+        store_state_works(self, self.store)
+
+    def test_bulk_methods(self):
+        bulk_methods_work(self, self.store)
+
+    def test_compare_and_set(self):
+        compare_and_set_works(self, self.store)
+
+    def test_shared_pool(self):
+        with patch('flows.statestore.redis_store._pool', None):
+            pool = redis_store._get_pool()
+            self.assertTrue(pool is redis_store._get_pool())
+            self.assertTrue(pool is redis_store.StateStore()._get_db().connection_pool)
+
+    def test_batch_writes_on_exit(self):
+        other = self.get_store()
+        with self.store.batch():
+            self.store.put_state(self.task_id, {'a': 1})
+            self.assertRaises(StateNotFound, other.get_state, self.task_id)
+            # but the store itself sees its own writes
+            self.assertEqual({'a': 1}, self.store.get_state(self.task_id))
+            self.store.put_state(self.task_id, {'a': 2})
+        self.assertEqual({'a': 2}, other.get_state(self.task_id))
+
+    def test_failed_batch_writes_nothing(self):
+        def fail():
+            with self.store.batch():
+                self.store.put_state(self.task_id, {'a': 1})
+                raise ValueError
+        self.assertRaises(ValueError, fail)
+        self.assertRaises(StateNotFound, self.store.get_state, self.task_id)
+        # and the store is usable afterwards
+        self.store.put_state(self.task_id, {'a': 2})
+        self.assertEqual({'a': 2}, self.store.get_state(self.task_id))
+
+
+class RedisHashStateStoreTest(RedisStateStoreTest):
+
+    def get_store(self):
+        return redis_hash_store.StateStore()
+
+    def test_values_loaded_when_used(self):
+        self.store.put_state(self.task_id, {'a': 1, 'b': 2})
+        state = self.store.get_state(self.task_id)
+        self.assertFalse(state.is_loaded('a'))
+        self.assertEqual(1, state['a'])
+        self.assertTrue(state.is_loaded('a'))
+        self.assertFalse(state.is_loaded('b'))
+
+    def test_only_changed_keys_written(self):
+        self.store.put_state(self.task_id, {'a': 1, 'b': 2, 'c': 3})
+        state = self.store.get_state(self.task_id)
+        state['a'] = 10
+        del state['c']
+        hset = redis_store.redis.StrictRedis.hset
+        with patch.object(redis_store.redis.StrictRedis, 'hset', autospec=True, side_effect=hset) as written:
+            self.store.put_state(self.task_id, state)
+        self.assertEqual([b'a'], [call[0][2] for call in written.call_args_list])
+        self.assertEqual({'a': 10, 'b': 2}, dict(self.store.get_state(self.task_id)))
+
+    def test_keys_keep_their_type(self):
+        self.store.put_state(self.task_id, {'a': 1, u'\xe9': 2})
+        self.assertEqual([str, type(u'\xe9')], [type(key) for key in sorted(self.store.get_state(self.task_id))])
+
+    def test_non_string_keys_refused(self):
+        self.assertRaises(TypeError, self.store.put_state, self.task_id, {'a': 1, 2: 'b'})
+        self.assertRaises(StateNotFound, self.store.get_state, self.task_id)
+
+
+@unittest.skipIf(fakeredis is None or six.PY2, 'asyncio needs Python 3 and fakeredis')
+class AsyncRedisStateStoreTest(unittest.TestCase):
+
+    task_id = 'b1b2b3b4b5b6b7b8b9babbbcbdbebfb0'
+
+    def get_store(self):
+        return redis_store.StateStore()
+
+    def setUp(self):
+        import asyncio
+        server = fakeredis.FakeServer()
+        patcher = patch('flows.statestore.redis_store._pool', fake_pool(server))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = self.get_store()
+        if hasattr(self.store, '_get_async_db'):
+            # the native asyncio client, sharing the blocking client's data
+            from fakeredis import aioredis
+            client = aioredis.FakeRedis(server=server)
+            self.store._get_async_db = lambda: client
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_round_trip(self):
+        run = self.loop.run_until_complete
+        version = run(self.store.aput_state(self.task_id, {'a': 1}))
+        self.assertEqual({'a': 1}, dict(run(self.store.aget_state(self.task_id))))
+        state, fetched_version = run(self.store.aget_versioned_state(self.task_id))
+        self.assertEqual(({'a': 1}, version), (dict(state), fetched_version))
+        run(self.store.adelete_state(self.task_id))
+        self.assertRaises(StateNotFound, run, self.store.aget_state(self.task_id))
+
+    def test_same_as_blocking_methods(self):
+        run = self.loop.run_until_complete
+        self.store.put_state(self.task_id, {'a': 1})
+        self.assertEqual(({'a': 1}, self.store.get_version(self.task_id)),
+                         tuple(run(self.store.aget_versioned_state(self.task_id))))
+
+        version = run(self.store.aput_state(self.task_id, {'a': 2}))
+        self.assertEqual(({'a': 2}, version), self.store.get_versioned_state(self.task_id))
+
+
+class AsyncRedisHashStateStoreTest(AsyncRedisStateStoreTest):
+
+    def get_store(self):
+        return redis_hash_store.StateStore()
@@ -0,0 +1,91 @@
+
+import unittest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from mock import patch
+from flows import config
+from flows.statestore import serializers
+from flows.statestore.django_store import StateStore
+from flows.statestore.tests.models import TestModel
+from flows.statestore.tests.utils import store_state_works
+
+
+class Counted(object):
+    # counts how many times it is unpickled
+    loads = 0
+
+    def __getstate__(self):
+        return {'a': 1}
+
+    def __setstate__(self, state):
+        Counted.loads += 1
+
+
+class ModelsByReferenceTest(unittest.TestCase):
+
+    task_id = 'd0d1d2d3d4d5d6d7d8d9dadbdcdddedf'
+
+    def setUp(self):
+        self._by_reference = config.FLOWS_STATE_MODELS_BY_REFERENCE
+        config.FLOWS_STATE_MODELS_BY_REFERENCE = True
+
+    def tearDown(self):
+        config.FLOWS_STATE_MODELS_BY_REFERENCE = self._by_reference
+        StateStore().delete_state(self.task_id)
+
+    def _stores(self):
+        for serializer in (serializers.base64_pickle, serializers.binary_pickle, serializers.json_serializer):
+            store = StateStore()
+            store.serializer = serializer
+            yield store
+
+    def test_store_state(self):
+        for store in self._stores():
+            store_state_works(self, store)
+
+    def test_reference_is_small(self):
+        wide = TestModel.objects.create(fruit='x' * 20, count=1)
+        data = serializers.binary_pickle.dumps({'model': wide})
+        self.assertFalse(b'x' * 20 in data)
+
+    def test_loads_current_values(self):
+        apple = TestModel.objects.create(fruit='apple', count=1)
+        pear = TestModel.objects.create(fruit='pear', count=2)
+        for store in self._stores():
+            store.put_state(self.task_id, {'fruit': [apple, pear], 'first': apple})
+            TestModel.objects.filter(pk=apple.pk).update(count=10)
+
+            state = store.get_state(self.task_id)
+            self.assertEqual([apple.pk, pear.pk], [m.pk for m in state['fruit']])
+            self.assertEqual(10, state['first'].count)
+            TestModel.objects.filter(pk=apple.pk).update(count=1)
+
+    def test_deleted_instance(self):
+        gone = TestModel.objects.create(fruit='banana', count=3)
+        for store in self._stores():
+            store.put_state(self.task_id, {'model': gone})
+            TestModel.objects.filter(pk=gone.pk).delete()
+            self.assertEqual(None, store.get_state(self.task_id)['model'])
+            gone.save()
+
+    def test_unpickled_once(self):
+        apple = TestModel.objects.create(fruit='apple', count=1)
+        for serializer in (serializers.base64_pickle, serializers.binary_pickle):
+            Counted.loads = 0
+            state = serializers.loads(serializer.dumps({'model': apple, 'counted': Counted()}), True)
+            self.assertEqual((apple.pk, 1), (state['model'].pk, Counted.loads))
+
+    def test_one_query_per_model_across_keys(self):
+        models = [TestModel.objects.create(fruit='fruit%d' % i, count=i) for i in range(3)]
+        state = dict(('model%d' % i, model) for i, model in enumerate(models))
+        state['other'] = 1
+        with patch.object(config, 'FLOWS_STATE_PER_KEY_ENCODING', True):
+            for store in self._stores():
+                store.put_state(self.task_id, state)
+                with CaptureQueriesContext(connection) as queries:
+                    fetched = store.get_state(self.task_id)
+                    self.assertEqual(1, fetched['other'])
+                    before = len(queries)
+                    self.assertEqual([m.pk for m in models], [fetched['model%d' % i].pk for i in range(3)])
+                # the instances for every key are fetched together
+                self.assertEqual(1, len(queries) - before)
@@ -0,0 +1,80 @@
+
+import datetime
+import decimal
+import unittest
+from mock import patch
+from django.utils import timezone
+from flows import config
+from flows.statestore import compression, serializers
+from flows.statestore.django_store import StateStore
+from flows.statestore.tests.utils import store_state_works
+
+
+class SerializerTest(unittest.TestCase):
+
+    state = {'_id': 'a' * 32,
+             '_history': [['flow_0', '/a/?_id=%s' % ('a' * 32), False]],
+             'price': decimal.Decimal('10.50'),
+             'when': datetime.datetime(2014, 3, 4, 5, 6, 7, 89),
+             'aware': datetime.datetime(2014, 3, 4, 5, 6, 7, tzinfo=timezone.utc),
+             'day': datetime.date(2014, 3, 4),
+             'tags': set(['a', 'b'])}
+
+    def _round_trip(self, serializer):
+        data = serializer.dumps(self.state)
+        self.assertEqual(self.state, serializer.loads(data))
+        self.assertEqual(self.state, serializers.loads(data))
+
+    def test_base64_pickle(self):
+        self._round_trip(serializers.base64_pickle)
+
+    def test_binary_pickle(self):
+        self._round_trip(serializers.binary_pickle)
+
+    def test_json(self):
+        self._round_trip(serializers.json_serializer)
+
+    def test_json_unknown_type(self):
+        self.assertRaises(TypeError, serializers.json_serializer.dumps, {'a': object()})
+
+    def test_pickle_refused(self):
+        pickled = [serializers.base64_pickle.dumps({'a': 1}),
+                   serializers.binary_pickle.dumps({'a': 1}),
+                   compression.compress(serializers.binary_pickle.dumps({'a': 1}), method='zlib', threshold=0)]
+        for data in pickled:
+            self.assertRaises(serializers.PickleRefused, serializers.loads, data, False)
+            self.assertEqual({'a': 1}, serializers.loads(data, True))
+        self.assertEqual({'a': 1}, serializers.loads(serializers.json_serializer.dumps({'a': 1}), False))
+
+    def test_allows_pickle(self):
+        self.assertTrue(serializers.allows_pickle(serializers.binary_pickle))
+        self.assertFalse(serializers.allows_pickle(serializers.json_serializer))
+        # while moving existing tasks from pickle to JSON
+        with patch.object(config, 'FLOWS_STATE_ALLOW_PICKLE', True):
+            self.assertTrue(serializers.allows_pickle(serializers.json_serializer))
+        with patch.object(config, 'FLOWS_STATE_ALLOW_PICKLE', False):
+            self.assertFalse(serializers.allows_pickle(serializers.binary_pickle))
+
+
+class DjangoStoreSerializerTest(unittest.TestCase):
+
+    def test_binary_pickle_in_text_column(self):
+        store = StateStore()
+        store.serializer = serializers.binary_pickle
+        store_state_works(self, store)
+
+    def test_read_other_formats(self):
+        store = StateStore()
+        store.serializer = serializers.json_serializer
+        store.put_state('b' * 32, {'a': 1})
+        store.serializer = serializers.binary_pickle
+        self.assertEqual({'a': 1}, store.get_state('b' * 32))
+        store.delete_state('b' * 32)
+
+    def test_json_store_refuses_pickle(self):
+        store = StateStore()
+        store.serializer = serializers.binary_pickle
+        store.put_state('c' * 32, {'a': 1})
+        store.serializer = serializers.json_serializer
+        self.assertRaises(serializers.PickleRefused, store.get_state, 'c' * 32)
+        store.delete_state('c' * 32)
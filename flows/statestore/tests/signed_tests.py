@@ -0,0 +1,181 @@
+import base64
+import re
+import time
+import unittest
+from django import forms
+from django.core.urlresolvers import RegexURLResolver
+from django.http import Http404
+from django.test.utils import override_settings
+from mock import patch
+from six.moves import cPickle
+from six.moves.urllib import parse as urlparse
+from flows import config
+from flows.components import Action, Scaffold
+from flows.handler import FlowHandler
+from flows.statestore import compression, django_store, serializers
+from flows.statestore.base import StateNotFound
+from flows.statestore.signed_store import StateStore
+from flows.tests.utils import make_request
+
+
+class NameForm(forms.Form):
+    name = forms.CharField()
+
+
+class NameAction(Action):
+    url = r'^name/$'
+    form_class = NameForm
+    template_name = 'name.html'
+
+    def form_valid(self, form):
+        self.state['name'] = form.cleaned_data['name']
+        return DoneAction
+
+
+class DoneAction(Action):
+    url = r'^done/$'
+    template_name = 'name.html'
+
+
+class NameFlow(Scaffold):
+    url = r'^signed/'
+    action_set = [NameAction, DoneAction]
+
+
+handler = FlowHandler(state_store=StateStore(fallback=django_store.StateStore()))
+handler.register_entry_point(NameFlow)
+
+urlpatterns = handler.urls
+
+
+class SignedStateStoreTest(unittest.TestCase):
+
+    task_id = 'f0f1f2f3f4f5f6f7f8f9fafbfcfdfeff'
+
+    def setUp(self):
+        self.store = StateStore(fallback=django_store.StateStore(), max_size=500)
+
+    def tearDown(self):
+        self.store.delete_state(self.task_id)
+
+    def test_small_state_is_signed(self):
+        state = {'_id': self.task_id, 'a': 1}
+        self.assertEqual(None, self.store.put_state(self.task_id, state))
+        self.assertRaises(StateNotFound, self.store.fallback.get_state, self.task_id)
+
+        token = self.store.get_task_token(state)
+        self.assertTrue(self.store.is_valid_task_id(token))
+        self.assertEqual(state, self.store.get_state(token))
+
+    def test_large_state_falls_back(self):
+        state = {'_id': self.task_id, 'a': ''.join(map(str, range(1000)))}
+        self.store.put_state(self.task_id, state)
+
+        self.assertEqual(self.task_id, self.store.get_task_token(state))
+        self.assertEqual(state, self.store.get_state(self.task_id))
+
+    def test_tampered(self):
+        token = self.store.get_task_token({'_id': self.task_id, 'a': 1})
+        tampered = token[:-1] + ('A' if token[-1] != 'A' else 'B')
+        self.assertRaises(StateNotFound, self.store.get_state, tampered)
+
+    def test_expired(self):
+        token = self.store.get_task_token({'_id': self.task_id})
+        with patch.object(time, 'time', return_value=time.time() + 24 * 60 * 60):
+            self.assertRaises(StateNotFound, self.store.get_state, token)
+
+    def test_invalid_task_ids(self):
+        self.assertFalse(self.store.is_valid_task_id('not-a-task'))
+        self.assertFalse(self.store.is_valid_task_id('a:' * 300))
+
+    def _decode(self, token):
+        data = base64.urlsafe_b64decode(token.split(':')[0].encode('ascii'))
+        return compression.decompress(data)
+
+    def test_session_key_not_in_token(self):
+        handler = FlowHandler(state_store=self.store)
+        state = handler._create_state(make_request('/', session_key='secret-session-key'))
+        token = self.store.get_task_token(state)
+        self.assertFalse(b'secret-session-key' in self._decode(token))
+
+        # the task is still bound to the session
+        loaded = self.store.get_state(token)
+        handler._check_bound_to(make_request('/', session_key='secret-session-key'), token, loaded)
+        self.assertRaises(Http404, handler._check_bound_to,
+                          make_request('/', session_key='other-session-key'), token, loaded)
+
+    def test_only_json_accepted(self):
+        self.assertEqual(b'{', self._decode(self.store.get_task_token({'_id': self.task_id}))[:1])
+        data = compression.compress(cPickle.dumps({'_id': self.task_id}, 2), method='zlib', threshold=0)
+        token = self.store._signer.sign(base64.urlsafe_b64encode(data).decode('ascii'))
+        self.assertRaises(StateNotFound, self.store.get_state, token)
+
+    def test_state_not_json_falls_back(self):
+        state = {'_id': self.task_id, 'a': object()}
+        with patch.object(self.store.fallback, 'put_state') as put_state:
+            self.store.put_state(self.task_id, state)
+        put_state.assert_called_once_with(self.task_id, state)
+        self.assertEqual(self.task_id, self.store.get_task_token(state))
+
+    def test_token_made_once_per_write(self):
+        state = {'_id': self.task_id, 'a': 1}
+        with patch.object(serializers.json_serializer, 'dumps',
+                          wraps=serializers.json_serializer.dumps) as dumps:
+            token = self.store.get_task_token(state)
+            self.assertEqual(token, self.store.get_task_token(state))
+            self.assertEqual(1, dumps.call_count)
+
+            state['a'] = 2
+            self.store.put_state(self.task_id, state)
+            token = self.store.get_task_token(state)
+            self.assertEqual(2, dumps.call_count)
+        self.assertEqual(2, self.store.get_state(token)['a'])
+
+
+class SignedFormTest(unittest.TestCase):
+
+    def setUp(self):
+        for overridden in (override_settings(ROOT_URLCONF=__name__),
+                           override_settings(TEMPLATES=[{
+                               'BACKEND': 'django.template.backends.django.DjangoTemplates',
+                               'OPTIONS': {'loaders': [('django.template.loaders.locmem.Loader',
+                                                        {'name.html': '{{ form }}'})]}}])):
+            overridden.enable()
+            self.addCleanup(overridden.disable)
+        self.store = handler.state_store
+
+    def _call(self, path, data=None, method='get'):
+        match = RegexURLResolver(r'^/', urlpatterns).resolve(path)
+        response = match.func(make_request(path, data, method), *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            # as django does once the view has returned
+            response.render()
+        return response
+
+    def _form_token(self, response):
+        field = re.search(r'<input[^>]*name="%s"[^>]*>' % config.FLOWS_TASK_ID_PARAM,
+                          response.content.decode('utf-8')).group(0)
+        return re.search(r'value="([^"]*)"', field).group(1)
+
+    def test_form_round_trip(self):
+        # the token in the form carries the state as it was written,
+        # including the history recorded after the form was built
+        token = self._form_token(self._call('/signed/name/'))
+        self.assertEqual(['/signed/name/'], [url for _, url, _ in self.store.get_state(token)['_history']])
+
+        response = self._call('/signed/name/', {config.FLOWS_TASK_ID_PARAM: token, 'name': 'Ann'}, 'post')
+        self.assertEqual(302, response.status_code)
+        query = urlparse.parse_qs(urlparse.urlsplit(response['Location']).query)
+        state = self.store.get_state(query[config.FLOWS_TASK_ID_PARAM][0])
+        self.assertEqual('Ann', state['name'])
+        self.assertEqual(['/signed/name/'], [url for _, url, _ in state['_history']])
+
+    def test_errors_not_carried(self):
+        token = self._form_token(self._call('/signed/name/'))
+        state = self.store.get_state(token)
+        state['_with_errors'] = {'name': ['Try again']}
+        token = self.store.get_task_token(state)
+
+        response = self._call('/signed/name/', {config.FLOWS_TASK_ID_PARAM: token})
+        self.assertTrue('Try again' in response.content.decode('utf-8'))
+        self.assertFalse('_with_errors' in self.store.get_state(self._form_token(response)))
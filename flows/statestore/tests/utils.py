@@ -1,3 +1,4 @@
+from flows.statestore.base import StateConflict
 from flows.statestore.tests.models import TestModel
 
 
@@ -31,3 +32,39 @@ def store_state_works(case, store):
     
     case.assertTrue('pies' in fetched_state)
     case.assertEqual({'r': 2, 'theta': 20 }, fetched_state['pies'])
+
+
+def bulk_methods_work(case, store, count=1200):
+
+    task_ids = ['%032x' % i for i in range(count)]
+    states = dict((task_id, {'_id': task_id, 'n': n}) for n, task_id in enumerate(task_ids))
+
+    store.put_many(states)
+    case.assertEqual(states, store.get_many(task_ids + ['f' * 32]))
+
+    # overwriting some and creating others
+    states = dict((task_id, {'_id': task_id, 'n': -n}) for n, task_id in enumerate(task_ids[count // 2:] + ['e' * 32]))
+    store.put_many(states)
+    case.assertEqual(states, store.get_many(list(states)))
+    case.assertEqual({'_id': task_ids[0], 'n': 0}, store.get_state(task_ids[0]))
+
+    store.delete_many(task_ids + ['e' * 32])
+    case.assertEqual({}, store.get_many(task_ids + ['e' * 32]))
+
+
+def compare_and_set_works(case, store, task_id='c0c1c2c3c4c5c6c7c8c9cacbcccdcecf'):
+
+    version = store.compare_and_set(task_id, {'a': 1}, None)
+    case.assertEqual(version, store.get_version(task_id))
+    case.assertRaises(StateConflict, store.compare_and_set, task_id, {'a': 2}, None)
+
+    new_version = store.compare_and_set(task_id, {'a': 2}, version)
+    case.assertNotEqual(version, new_version)
+    case.assertEqual(({'a': 2}, new_version), store.get_versioned_state(task_id))
+
+    # a writer which read the state before the last write loses
+    case.assertRaises(StateConflict, store.compare_and_set, task_id, {'a': 3}, version)
+    case.assertEqual({'a': 2}, store.get_state(task_id))
+
+    store.delete_state(task_id)
+    case.assertRaises(StateConflict, store.compare_and_set, task_id, {'a': 4}, new_version)
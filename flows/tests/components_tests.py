@@ -1,6 +1,8 @@
 
 import unittest
-from flows.components import Action, Scaffold
+from django.core.exceptions import ImproperlyConfigured
+from mock import patch
+from flows.components import Action, Scaffold, FlowComponentMeta, LazyActionSet, freeze_flow, freeze_flows
 
 
 class Action1(Action):
@@ -27,3 +29,76 @@ class LazyActionSetTest(unittest.TestCase):
         actions = Scaffold1().action_set
         self.assertEqual( 0, actions.index(Action1) )
         self.assertEqual( 1, actions.index(Action2) )
+
+
+class FrozenAction(Action):
+    url = '/frozen$'
+
+
+class FrozenInner(Scaffold):
+    url = '/inner'
+    action_set = ['FrozenAction', Action2]
+
+
+class FrozenOuter(Scaffold):
+    url = '/outer'
+    action_set = [FrozenInner, 'Action1']
+
+
+class MissingName(Scaffold):
+    url = '/missing'
+    action_set = [Action1, 'NoSuchComponent']
+
+
+class Empty(Scaffold):
+    url = '/empty'
+
+
+class Looping(Scaffold):
+    url = '/looping'
+    action_set = [Action1, 'Looping']
+
+
+class Unfrozen(Scaffold):
+    url = '/unfrozen'
+    action_set = [Action1, 'Action2']
+
+
+class LazyActionSetContainsTest(unittest.TestCase):
+
+    def test_contains_named(self):
+        self.assertTrue(Action2 in LazyActionSet([Action1, 'Action2']))
+        self.assertFalse(FrozenAction in LazyActionSet([Action1, 'Action2']))
+
+
+class FreezeFlowTest(unittest.TestCase):
+
+    def test_freeze(self):
+        freeze_flow(FrozenOuter)
+        self.assertEqual((FrozenInner, Action1), FrozenOuter.action_set)
+        self.assertEqual((FrozenAction, Action2), FrozenInner.action_set)
+        self.assertEqual([FrozenOuter, FrozenInner, FrozenAction], FrozenOuter.get_initial_action_tree())
+        # the tree is a copy, so changing it does not change the flow
+        FrozenOuter.get_initial_action_tree().append(Action2)
+        self.assertEqual([FrozenInner, FrozenAction], FrozenInner.get_initial_action_tree())
+
+    def test_missing_name(self):
+        self.assertRaises(ImproperlyConfigured, freeze_flow, MissingName)
+        self.assertTrue(isinstance(MissingName.action_set, LazyActionSet))
+
+    def test_empty(self):
+        self.assertRaises(ImproperlyConfigured, freeze_flow, Empty)
+
+    def test_loop(self):
+        self.assertRaises(ImproperlyConfigured, freeze_flow, Looping)
+
+    def test_freeze_flows(self):
+        # only the components of this test are frozen, rather than those
+        # of every test module loaded so far
+        registry = dict((component.__name__, component)
+                        for component in (Action1, Action2, Unfrozen, MissingName))
+        with patch.object(FlowComponentMeta, 'registry', registry):
+            freeze_flows()
+        self.assertEqual((Action1, Action2), Unfrozen.action_set)
+        # names which cannot be resolved are left for later
+        self.assertTrue(isinstance(MissingName.action_set, LazyActionSet))
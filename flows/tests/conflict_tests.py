@@ -0,0 +1,100 @@
+import unittest
+from mock import Mock, patch
+from flows import config
+from flows.components import Action
+from flows.handler import FlowHandler, PossibleFlowPosition
+from flows.statestore.base import StateConflict
+from flows.statestore.django_store import StateStore
+
+
+class ConflictAction(Action):
+    url = '/conflict$'
+
+
+class ConflictPolicyTest(unittest.TestCase):
+
+    task_id = 'f1f2f3f4f5f6f7f8f9fafbfcfdfeff00'
+
+    def setUp(self):
+        self.store = StateStore()
+        state = {'_id': self.task_id, 'a': 1, 'b': 1, 'c': 1}
+        self.version = self.store.compare_and_set(self.task_id, state, None)
+
+    def tearDown(self):
+        self.store.delete_state(self.task_id)
+
+    def _instance(self):
+        state, version = self.store.get_versioned_state(self.task_id)
+        position = PossibleFlowPosition(None, None, [ConflictAction])
+        instance = position.create_instance(state, self.store, [], {}, version=version)
+        instance._remember_state()
+        return instance
+
+    def _write_elsewhere(self, **changes):
+        state, version = self.store.get_versioned_state(self.task_id)
+        state.update(changes)
+        self.store.compare_and_set(self.task_id, state, version)
+
+    @patch.object(config, 'FLOWS_STATE_CONFLICT_POLICY', 'error')
+    def test_save(self):
+        instance = self._instance()
+        instance._state['a'] = 2
+        instance._save_state()
+        self.assertEqual(2, self.store.get_state(self.task_id)['a'])
+
+        # the instance keeps track of the version it wrote
+        instance._state['a'] = 3
+        instance._save_state()
+        self.assertEqual(3, self.store.get_state(self.task_id)['a'])
+
+    @patch.object(config, 'FLOWS_STATE_CONFLICT_POLICY', 'error')
+    def test_error(self):
+        instance = self._instance()
+        self._write_elsewhere(b=2)
+        instance._state['a'] = 2
+        self.assertRaises(StateConflict, instance._save_state)
+        self.assertEqual({'_id': self.task_id, 'a': 1, 'b': 2, 'c': 1}, self.store.get_state(self.task_id))
+
+    @patch.object(config, 'FLOWS_STATE_CONFLICT_POLICY', 'merge')
+    def test_merge_disjoint_keys(self):
+        instance = self._instance()
+        self._write_elsewhere(b=2)
+        instance._state['a'] = 2
+        del instance._state['c']
+        instance._save_state()
+        self.assertEqual({'_id': self.task_id, 'a': 2, 'b': 2}, self.store.get_state(self.task_id))
+
+    @patch.object(config, 'FLOWS_STATE_CONFLICT_POLICY', 'merge')
+    def test_merge_same_key(self):
+        instance = self._instance()
+        self._write_elsewhere(a=3)
+        instance._state['a'] = 2
+        self.assertRaises(StateConflict, instance._save_state)
+        self.assertEqual(3, self.store.get_state(self.task_id)['a'])
+
+
+class ConflictResponseTest(unittest.TestCase):
+
+    def _handle(self, policy, results, method='GET'):
+        handler = FlowHandler(state_store=StateStore())
+        with patch.object(config, 'FLOWS_STATE_CONFLICT_POLICY', policy):
+            with patch.object(handler, '_handle_step', side_effect=results) as handle_step:
+                response = handler._handle_view(None, Mock(method=method))
+        return response, handle_step.call_count
+
+    def test_retry(self):
+        response, calls = self._handle('retry', [StateConflict, StateConflict, 'done'])
+        self.assertEqual(('done', 3), (response, calls))
+
+    def test_retries_run_out(self):
+        retries = config.FLOWS_STATE_CONFLICT_RETRIES
+        response, calls = self._handle('retry', [StateConflict] * (retries + 1))
+        self.assertEqual((409, retries + 1), (response.status_code, calls))
+
+    def test_error(self):
+        response, calls = self._handle('error', [StateConflict, 'done'])
+        self.assertEqual((409, 1), (response.status_code, calls))
+
+    def test_unsafe_requests_not_retried(self):
+        response, calls = self._handle('retry', [StateConflict, 'done'], method='POST')
+        self.assertEqual((409, 1), (response.status_code, calls))
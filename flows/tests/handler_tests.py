@@ -0,0 +1,174 @@
+import threading
+import unittest
+from django.core.urlresolvers import RegexURLResolver
+from django.http import HttpResponse
+from django.test.utils import override_settings
+from mock import patch
+from flows import config
+from flows.components import Action, Scaffold
+from flows.handler import FlowHandler
+from flows.statestore import instrumented_store, metrics
+from flows.statestore.django_store import StateStore
+from flows.statestore.metrics import InMemoryMetrics
+from flows.tests.utils import make_request
+
+
+class CountingAction(Action):
+    url = r'^count/$'
+
+    def get(self, request, *args, **kwargs):
+        if 'bump' in request.GET:
+            self.state['count'] = self.state.get('count', 0) + 1
+        if 'note' in request.GET:
+            self.state['note'] = request.GET['note']
+        return HttpResponse('count %s' % self.state.get('count', 0))
+
+
+class CountingFlow(Scaffold):
+    url = r'^counting/'
+    action_set = [CountingAction]
+
+
+handler = FlowHandler(state_store=StateStore())
+handler.register_entry_point(CountingFlow)
+
+urlpatterns = handler.urls
+
+
+def call_view(path, data=None, **kwargs):
+    match = RegexURLResolver(r'^/', urlpatterns).resolve(path)
+    return match.func(make_request(path, data, **kwargs), *match.args, **match.kwargs)
+
+
+class SkippedWriteTest(unittest.TestCase):
+
+    task_id = 'e1e2e3e4e5e6e7e8e9eaebecedeeef00'
+
+    def setUp(self):
+        # URLs of actions are reversed to record the history
+        urlconf = override_settings(ROOT_URLCONF=__name__)
+        urlconf.enable()
+        self.addCleanup(urlconf.disable)
+        self.store = handler.state_store
+        self.store.put_state(self.task_id, {'_id': self.task_id, '_bound_to': 's1'})
+
+    def tearDown(self):
+        self.store.delete_state(self.task_id)
+
+    def _get(self, **data):
+        data[config.FLOWS_TASK_ID_PARAM] = self.task_id
+        with patch.object(self.store, 'put_state', wraps=self.store.put_state) as put_state:
+            response = call_view('/counting/count/', data)
+        self.assertEqual(200, response.status_code)
+        return response, put_state.call_count
+
+    def test_unchanged_state_not_written(self):
+        # the first visit adds the action to the history
+        self.assertEqual(1, self._get()[1])
+        self.assertEqual(0, self._get()[1])
+
+    def test_changed_state_written(self):
+        self._get()
+        response, writes = self._get(bump='1')
+        self.assertEqual((b'count 1', 1), (response.content, writes))
+        self.assertEqual(1, self.store.get_state(self.task_id)['count'])
+
+    def test_state_written_for_stores_which_need_it(self):
+        self._get()
+        with patch.object(StateStore, 'refreshes_expiry_on_read', False):
+            self.assertEqual(1, self._get()[1])
+
+    @patch.object(config, 'FLOWS_STATE_CONFLICT_POLICY', 'merge')
+    def test_fingerprinted_once_each_side(self):
+        # the fingerprints of each key kept for merging are enough to tell
+        # whether anything changed
+        self._get()
+        with patch.object(self.store, 'get_fingerprint') as get_fingerprint:
+            with patch.object(self.store, 'get_key_fingerprints', wraps=self.store.get_key_fingerprints) as get_keys:
+                self.assertEqual(0, self._get()[1])
+        self.assertEqual((0, 2), (get_fingerprint.call_count, get_keys.call_count))
+
+
+class ConflictTest(unittest.TestCase):
+
+    task_id = 'e0e1e2e3e4e5e6e7e8e9eaebecedeeef'
+
+    def setUp(self):
+        urlconf = override_settings(ROOT_URLCONF=__name__)
+        urlconf.enable()
+        self.addCleanup(urlconf.disable)
+        self.store = handler.state_store
+        self.store.put_state(self.task_id, {'_id': self.task_id, '_bound_to': 's1'})
+        # the first visit adds the action to the history
+        self._get()
+
+    def tearDown(self):
+        self.store.delete_state(self.task_id)
+
+    def _get(self, **data):
+        data[config.FLOWS_TASK_ID_PARAM] = self.task_id
+        return call_view('/counting/count/', data)
+
+    def _race(self, policy, first, second):
+        # the second request runs to completion while the first one is
+        # in the middle of its step
+        get = CountingAction.get
+        other = []
+
+        def racing_get(action, request, *args, **kwargs):
+            if not other:
+                other.append(None)
+                other[0] = self._get(**second)
+            return get(action, request, *args, **kwargs)
+
+        with patch.object(config, 'FLOWS_STATE_CONFLICT_POLICY', policy):
+            with patch.object(CountingAction, 'get', racing_get):
+                response = self._get(**first)
+        return response.status_code, other[0].status_code, self.store.get_state(self.task_id)
+
+    def test_conflict(self):
+        first, second, state = self._race('error', {'bump': '1'}, {'bump': '1'})
+        self.assertEqual((409, 200, 1), (first, second, state['count']))
+
+    def test_merge(self):
+        first, second, state = self._race('merge', {'note': 'hello'}, {'bump': '1'})
+        self.assertEqual((200, 200, 1, 'hello'), (first, second, state['count'], state['note']))
+
+    def test_merge_same_key(self):
+        first, second, state = self._race('merge', {'bump': '1'}, {'bump': '1'})
+        self.assertEqual((409, 200, 1), (first, second, state['count']))
+
+    def test_retry(self):
+        first, second, state = self._race('retry', {'bump': '1'}, {'bump': '1'})
+        self.assertEqual((200, 200, 2), (first, second, state['count']))
+
+
+class FlowMetricsTest(unittest.TestCase):
+
+    task_id = 'a1a2a3a4a5a6a7a8a9aaabacadaeaf00'
+
+    def setUp(self):
+        urlconf = override_settings(ROOT_URLCONF=__name__)
+        urlconf.enable()
+        self.addCleanup(urlconf.disable)
+        self.metrics = InMemoryMetrics()
+        for patcher in (patch.object(config, 'FLOWS_STATE_METRICS_SINK', self.metrics),
+                        patch.object(metrics, '_local', threading.local()),
+                        patch.object(metrics, '_sinks', {}),
+                        patch.object(handler, 'state_store',
+                                     instrumented_store.StateStore(backend=handler.state_store))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        handler.state_store.put_state(self.task_id, {'_id': self.task_id, '_bound_to': 's1'})
+        self.metrics.reset()
+
+    def tearDown(self):
+        handler.state_store.backend.delete_state(self.task_id)
+
+    def test_operations_named_after_entry_point(self):
+        response = call_view('/counting/count/', {config.FLOWS_TASK_ID_PARAM: self.task_id, 'bump': '1'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, self.metrics.count('get_state'))
+        self.assertEqual(1, self.metrics.count('put_state'))
+        self.assertEqual(['flows.tests.handler_tests.CountingFlow'], self.metrics.flows)
+        self.assertEqual(2, sum(self.metrics.size_histogram('flows.tests.handler_tests.CountingFlow').values()))
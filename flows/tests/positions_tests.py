@@ -0,0 +1,64 @@
+import unittest
+from flows.components import Action, Scaffold, COMPLETE
+from flows.handler import PossibleFlowPosition
+
+
+class FirstStep(Action):
+    url = '^first$'
+
+
+class SecondStep(Action):
+    url = '^second$'
+
+
+class Steps(Scaffold):
+    url = '^steps/'
+    action_set = [FirstStep, SecondStep]
+
+
+class Finish(Action):
+    url = '^finish$'
+
+
+class Wizard(Scaffold):
+    url = '^wizard/'
+    action_set = [Steps, 'Finish']
+
+
+class PossibleFlowPositionTest(unittest.TestCase):
+
+    def test_interned(self):
+        position = PossibleFlowPosition('app', None, [Steps, FirstStep])
+        self.assertTrue(position is PossibleFlowPosition('app', None, (Steps, FirstStep)))
+        self.assertFalse(position is PossibleFlowPosition(None, None, [Steps, FirstStep]))
+        self.assertFalse(position is PossibleFlowPosition('app', 'other', [Steps, FirstStep]))
+        self.assertTrue(position is PossibleFlowPosition.all_positions[position.url_name])
+
+    def test_url_name(self):
+        position = PossibleFlowPosition('app', 'ns', [Steps, SecondStep])
+        self.assertTrue(position.url_name.startswith('app:flow_ns_'))
+        self.assertEqual(position.url_name, 'app:' + position.get_url_name(include_app_namespace=False))
+
+    def test_is_entry_point(self):
+        self.assertTrue(PossibleFlowPosition(None, None, [Steps, FirstStep]).is_entry_point())
+        self.assertFalse(PossibleFlowPosition(None, None, [Steps, SecondStep]).is_entry_point())
+
+    def test_slots(self):
+        position = PossibleFlowPosition(None, None, [Steps, FirstStep])
+        self.assertRaises(AttributeError, setattr, position, 'extra', 1)
+
+    def test_get_position_for(self):
+        position = PossibleFlowPosition(None, None, [Wizard, Steps, FirstStep])
+        self.assertTrue(PossibleFlowPosition(None, None, [Wizard, Steps, SecondStep]) is
+                        position.get_position_for(SecondStep))
+        # siblings of scaffolds further up, including ones given by name
+        self.assertEqual((Wizard, Finish), position.get_position_for(Finish).flow_component_classes)
+        self.assertEqual((Wizard, Steps, FirstStep), position.get_position_for(Steps).flow_component_classes)
+        self.assertRaises(ValueError, position.get_position_for, Wizard)
+
+    def test_get_next_component(self):
+        position = PossibleFlowPosition(None, None, [Wizard, Steps, FirstStep])
+        self.assertEqual(SecondStep, position.get_next_component(Steps))
+        self.assertEqual(Finish, position.get_next_component(Wizard))
+        self.assertEqual(COMPLETE, PossibleFlowPosition(None, None, [Wizard, Steps, SecondStep]).get_next_component(Steps))
+        self.assertRaises(ValueError, position.get_next_component, FirstStep)
@@ -26,3 +26,9 @@ if django.VERSION < (1, 7):
         pass
     else:
         INSTALLED_APPS.append('south')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
@@ -0,0 +1,186 @@
+import unittest
+from mock import patch
+from django.conf.urls import url
+from django.core.urlresolvers import NoReverseMatch, RegexURLResolver, Resolver404, get_script_prefix, set_script_prefix
+from flows.components import Action, Scaffold
+from django.test.signals import setting_changed
+from flows.handler import FlowHandler, _join_url_patterns, _reverse, clear_reverse_cache
+from flows.urlresolvers import FlatURLResolver
+
+
+class PlainAction(Action):
+    url = r'^plain/$'
+
+
+class NamedAction(Action):
+    url = r'^named/(?P<item_id>\d+)/$'
+
+
+class UnnamedAction(Action):
+    urls = [r'^unnamed/(\d+)/$', r'^other/(\d+)/$']
+
+
+class UnanchoredAction(Action):
+    url = r'loose/$'
+
+
+class AlternativesAction(Action):
+    url = r'^foo/$|^bar/$'
+
+
+class RepeatedAction(Action):
+    url = r'^twice/(\w+)/\1/$'
+
+
+class AlternativesScaffold(Scaffold):
+    url = r'^s/'
+    action_set = [AlternativesAction]
+
+
+class InnerScaffold(Scaffold):
+    url = r'^inner/(?P<section>\w+)/'
+    action_set = [NamedAction, UnnamedAction]
+
+
+class OuterScaffold(Scaffold):
+    url = r'^outer/'
+    action_set = [PlainAction, InnerScaffold, UnanchoredAction, AlternativesScaffold, RepeatedAction]
+
+
+class FlatURLsTest(unittest.TestCase):
+
+    paths = ['/outer/plain/', '/outer/inner/abc/named/12/', '/outer/inner/abc/unnamed/34/',
+             '/outer/inner/abc/other/56/', '/outer/loose/', '/outer/x/loose/',
+             '/outer/s/foo/', '/outer/s/bar/', '/outer/twice/ab/ab/']
+
+    def _resolver(self, flatten):
+        handler = FlowHandler(flatten_urls=flatten)
+        handler.register_entry_point(OuterScaffold)
+        return RegexURLResolver(r'^/', handler.urls)
+
+    def _resolve(self, resolver, path):
+        try:
+            match = resolver.resolve(path)
+        except Resolver404:
+            return None
+        return match.url_name, match.args, match.kwargs
+
+    def _reverse(self, resolver, url_name, args, kwargs):
+        try:
+            return resolver.reverse(url_name, *args, **kwargs)
+        except NoReverseMatch:
+            # such as for backreferences
+            return None
+
+    def test_same_as_nested(self):
+        nested = self._resolver(False)
+        flat = self._resolver(True)
+        for path in self.paths + ['/outer/missing/', '/outer/inner/abc/named/x/', '/bar/', '/outer/bar/',
+                                  '/outer/twice/ab/cd/']:
+            self.assertEqual(self._resolve(nested, path), self._resolve(flat, path))
+
+        for path in self.paths:
+            url_name, args, kwargs = self._resolve(nested, path)
+            if args and kwargs:
+                # django cannot reverse these either way
+                continue
+            self.assertEqual(self._reverse(nested, url_name, args, kwargs),
+                             self._reverse(flat, url_name, args, kwargs))
+
+    def test_not_found(self):
+        self.assertRaises(Resolver404, self._resolver(True).resolve, '/outer/missing/')
+
+    def test_resolver_patterns_with_alternatives(self):
+        view = lambda request: None
+        resolver = FlatURLResolver(r'^', [url(r'^foo/$|^bar/$', view, name='a'),
+                                          url(r'^(\w)/\1/$', view, name='b'),
+                                          url(r'^baz/$', view, name='c')])
+        self.assertEqual(['a', 'a', 'b', 'c'], [resolver.resolve(path).url_name
+                                                for path in ('foo/', 'bar/', 'x/x/', 'baz/')])
+        self.assertRaises(Resolver404, resolver.resolve, 'x/y/')
+
+    def test_join_url_patterns(self):
+        self.assertEqual('^a/b/$', _join_url_patterns('^a/', '^b/$'))
+        self.assertEqual('^a/', _join_url_patterns('^a/', ''))
+        self.assertEqual('^a/(?P<x>\d+)/(?P<y>\d+)$', _join_url_patterns('^a/(?P<x>\d+)/', '^(?P<y>\d+)$'))
+        # patterns which would not behave the same once joined
+        self.assertEqual(None, _join_url_patterns('^a/', 'b/$'))
+        self.assertEqual(None, _join_url_patterns('^(?P<x>\d+)/', '^(\d+)$'))
+        self.assertEqual(None, _join_url_patterns('^(\d+)/', '^b/$'))
+        self.assertEqual(None, _join_url_patterns('^(?P<x>\d+)/', '^(?P<x>\d+)$'))
+        self.assertEqual(None, _join_url_patterns('^a/', '^b/$|^c/$'))
+        self.assertEqual(None, _join_url_patterns('^a/', '^(?P<x>b|c)/$'))
+        self.assertEqual(None, _join_url_patterns('^a/', r'^(\w)/\1/$'))
+        self.assertEqual(None, _join_url_patterns('^a/', '^(?i)b/$'))
+        # which are fine when escaped or in a character class
+        self.assertEqual(r'^a/b\|[|]\\1$', _join_url_patterns('^a/', r'^b\|[|]\\1$'))
+
+
+class ReverseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        clear_reverse_cache()
+
+    def tearDown(self):
+        clear_reverse_cache()
+
+    def test_reversed_once(self):
+        with patch('flows.handler.reverse', return_value='/a/1/') as reverse:
+            self.assertEqual('/a/1/', _reverse('a', [1], {}))
+            self.assertEqual('/a/1/', _reverse('a', [1], {}))
+        self.assertEqual(1, reverse.call_count)
+
+    def test_arguments_and_types(self):
+        with patch('flows.handler.reverse', side_effect=lambda name, args, kwargs: repr((args, kwargs))) as reverse:
+            _reverse('a', [1], {})
+            _reverse('a', [True], {})
+            _reverse('a', [], {'x': 1})
+            _reverse('a', [], {'x': '1'})
+        self.assertEqual(4, reverse.call_count)
+
+    def test_only_simple_arguments(self):
+        class Slugged(object):
+            def __init__(self, slug):
+                self.slug = slug
+
+            def __str__(self):
+                return self.slug
+
+        instance = Slugged('old')
+        with patch('flows.handler.reverse', side_effect=lambda name, args, kwargs: '/a/%s/' % args[0]):
+            self.assertEqual('/a/old/', _reverse('a', [instance], {}))
+            instance.slug = 'new'
+            self.assertEqual('/a/new/', _reverse('a', [instance], {}))
+
+    def test_unhashable_arguments(self):
+        with patch('flows.handler.reverse', return_value='/a/') as reverse:
+            _reverse('a', [[1]], {})
+            _reverse('a', [[1]], {})
+        self.assertEqual(2, reverse.call_count)
+
+    def test_script_prefix(self):
+        with patch('flows.handler.reverse', return_value='/a/') as reverse:
+            _reverse('a', [], {})
+            old_prefix = get_script_prefix()
+            set_script_prefix('/other/')
+            try:
+                _reverse('a', [], {})
+            finally:
+                set_script_prefix(old_prefix)
+        self.assertEqual(2, reverse.call_count)
+
+    def test_cleared_when_urlconf_changes(self):
+        with patch('flows.handler.reverse', return_value='/a/') as reverse:
+            _reverse('a', [], {})
+            setting_changed.send(sender=None, setting='ROOT_URLCONF', value=None, enter=True)
+            _reverse('a', [], {})
+            setting_changed.send(sender=None, setting='DEBUG', value=None, enter=True)
+            _reverse('a', [], {})
+        self.assertEqual(2, reverse.call_count)
+
+    def test_disabled(self):
+        with patch('flows.config.FLOWS_REVERSE_CACHE_SIZE', 0):
+            with patch('flows.handler.reverse', return_value='/a/') as reverse:
+                _reverse('a', [], {})
+                _reverse('a', [], {})
+        self.assertEqual(2, reverse.call_count)
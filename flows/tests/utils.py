@@ -1,5 +1,18 @@
+from django.test import RequestFactory
 
 
 class MockFlow(object):
     # TODO: replace with mock library
-    pass
\ No newline at end of file
+    pass
+
+
+class MockSession(object):
+
+    def __init__(self, session_key):
+        self.session_key = session_key
+
+
+def make_request(path, data=None, method='get', session_key='s1'):
+    request = getattr(RequestFactory(), method)(path, data or {})
+    request.session = MockSession(session_key)
+    return request
@@ -0,0 +1,146 @@
+# -*- coding: UTF-8 -*-
+"""
+A URL resolver for the flattened URL patterns of a `FlowHandler`, which
+finds the matching pattern with a few precompiled regular expressions
+rather than trying each pattern in turn.
+"""
+import re
+from django.core.urlresolvers import RegexURLResolver, RegexURLPattern, Resolver404
+
+# python 2 cannot compile regular expressions with 100 or more groups
+_MAX_GROUPS = 99
+
+_GROUP_NAME = re.compile(r'(?<!\\)\(\?P([<=])(\w+)')
+
+
+def _rename_groups(pattern, index):
+    # the same group names are used by many patterns, so they are made
+    # unique before the patterns are combined
+    return _GROUP_NAME.sub(lambda m: '(?P%s_%d_%s' % (m.group(1), index, m.group(2)), pattern)
+
+
+def _marker(index):
+    return '_pattern_%d' % index
+
+
+def _tokens(pattern):
+    """
+    Yields the position of each escape and each character of `pattern`
+    outside of character classes, where nothing else is special.
+    """
+    i = 0
+    while i < len(pattern):
+        if pattern[i] == '[':
+            # a ']' straight after the opening, or after a '^', is part
+            # of the class rather than its end
+            i += 1
+            if pattern[i:i + 1] == '^':
+                i += 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+            continue
+        yield i
+        i += 2 if pattern[i] == '\\' else 1
+
+
+def has_alternatives(pattern):
+    """
+    Whether `pattern` has a ``|`` which is not escaped or part of a
+    character class.
+    """
+    return any(pattern[i] == '|' for i in _tokens(pattern))
+
+
+def is_self_contained(pattern):
+    """
+    Whether `pattern` matches the same way as part of a larger regular
+    expression: numeric backreferences and conditions would refer to
+    other groups, and inline flags would apply to all of it.
+    """
+    for i in _tokens(pattern):
+        following = pattern[i + 1:i + 3]
+        if pattern[i] == '\\' and following[:1].isdigit() and following[:1] != '0':
+            return False
+        if pattern[i] == '(' and following[:1] == '?' and following[1:] and following[1:] in 'aiLmsux-(':
+            return False
+    return True
+
+
+class FlatURLResolver(RegexURLResolver):
+    """
+    Resolves URLs exactly as `RegexURLResolver` does, but combines runs
+    of consecutive patterns into single regular expressions, each of
+    them alternatives, so that the pattern which matches a URL is found
+    in one pass. Entries which are not plain patterns, such as includes,
+    are tried in turn where they appear.
+    """
+
+    def __init__(self, regex, urlpatterns):
+        super(FlatURLResolver, self).__init__(regex, urlpatterns)
+        self._table = None
+
+    def _compile(self):
+        # each step is either a combined regex along with the resolvers
+        # for its alternatives, or a resolver for a single entry which is
+        # tried as usual
+        table = []
+        alternatives = []
+        resolvers = []
+        groups = 0
+
+        def combine():
+            if alternatives:
+                table.append((re.compile('^(?:%s)' % '|'.join(alternatives)), list(resolvers)))
+                del alternatives[:]
+                del resolvers[:]
+
+        for index, pattern in enumerate(self.url_patterns):
+            regex = pattern.regex.pattern
+            if (not isinstance(pattern, RegexURLPattern) or not regex.startswith('^') or
+                    not is_self_contained(regex)):
+                combine()
+                groups = 0
+                table.append((None, RegexURLResolver(r'', [pattern])))
+                continue
+
+            pattern_groups = pattern.regex.groups + 1
+            if groups + pattern_groups > _MAX_GROUPS:
+                combine()
+                groups = 0
+            # the empty group at the end is the last to match, which tells
+            # which of the alternatives matched; the pattern is grouped so
+            # that any alternatives of its own all end with it
+            alternatives.append('(?:%s)(?P<%s>)' % (_rename_groups(regex[1:], index), _marker(len(resolvers))))
+            resolvers.append(RegexURLResolver(r'', [pattern]))
+            groups += pattern_groups
+        combine()
+        return table
+
+    def resolve(self, path):
+        if self._table is None:
+            self._table = self._compile()
+
+        match = self.regex.search(path)
+        if match and not match.groupdict() and not self.default_kwargs:
+            new_path = path[match.end():]
+            for regex, entry in self._table:
+                if regex is None:
+                    try:
+                        return entry.resolve(new_path)
+                    except Resolver404:
+                        continue
+                found = regex.match(new_path)
+                if found is not None:
+                    if found.lastgroup is None:
+                        # the pattern which matched cannot be told, so the
+                        # patterns are tried in turn after all
+                        break
+                    # the chosen pattern resolves the URL itself, so that
+                    # the match is built exactly as usual
+                    return entry[int(found.lastgroup.rsplit('_', 1)[1])].resolve(new_path)
+
+        # nothing matched, so the usual resolver gives the usual error
+        return super(FlatURLResolver, self).resolve(path)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Compares handling many tasks one at a time with the bulk methods of the
+django state store, using an in-memory sqlite database.
+
+    python scripts/benchmark_bulk_state.py [tasks]
+"""
+import sys
+import time
+from django.conf import settings
+
+settings.configure(DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+                   INSTALLED_APPS=['flows'])
+
+import django
+if hasattr(django, 'setup'):
+    django.setup()
+
+from django.core.management import call_command
+from flows.statestore.django_store import StateStore
+
+
+def make_states(count):
+    return dict(('%032x' % i, {'_id': '%032x' % i, 'product_id': i, 'step': 'address'})
+                for i in range(count))
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def one_at_a_time(store, states):
+    put = timed(lambda: [store.put_state(task_id, state) for task_id, state in states.items()])
+    get = timed(lambda: [store.get_state(task_id) for task_id in states])
+    delete = timed(lambda: [store.delete_state(task_id) for task_id in states])
+    return put, get, delete
+
+
+def bulk(store, states):
+    put = timed(store.put_many, states)
+    get = timed(store.get_many, list(states))
+    delete = timed(store.delete_many, list(states))
+    return put, get, delete
+
+
+def main(count=10000):
+    if django.VERSION >= (1, 7):
+        call_command('migrate', verbosity=0)
+    else:
+        call_command('syncdb', verbosity=0, interactive=False)
+
+    store = StateStore()
+    states = make_states(count)
+    print('%-14s %10s %10s %10s' % ('%d tasks' % count, 'put (s)', 'get (s)', 'delete (s)'))
+    for name, method in (('one at a time', one_at_a_time), ('bulk', bulk)):
+        print('%-14s %10.3f %10.3f %10.3f' % ((name,) + method(store, states)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
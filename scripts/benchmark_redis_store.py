@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Compares the redis state store using a new connection pool for every
+operation, as it used to, with the shared pool and the per-request batch,
+counting the connections made and the round-trips to redis for a request
+which reads a task's state, writes it back along with another task's and
+deletes a third.
+
+    python scripts/benchmark_redis_store.py [requests] [host] [port]
+
+Without a host, fakeredis is used, so only the counts are meaningful.
+"""
+import sys
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+settings.configure(INSTALLED_APPS=['flows'])
+
+import django
+if hasattr(django, 'setup'):
+    django.setup()
+
+import redis
+from mock import patch
+from flows.statestore import redis_store
+from flows.statestore.base import StateStoreBase
+
+
+class UnpooledStateStore(redis_store.StateStore):
+    # a new pool, and so a new connection, for every operation
+
+    def __init__(self, make_pool):
+        super(UnpooledStateStore, self).__init__()
+        self._make_pool = make_pool
+
+    def _get_db(self):
+        return redis.Redis(connection_pool=self._make_pool())
+
+    batch = StateStoreBase.batch
+
+
+def make_pool_factory(host, port):
+    if host is None:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        return lambda: redis.ConnectionPool(connection_class=fakeredis.FakeConnection, server=server)
+    return lambda: redis.ConnectionPool(host=host, port=port)
+
+
+@contextmanager
+def counting():
+    counts = {'connections': 0, 'round-trips': 0}
+    connect = redis.Connection.connect
+    send = redis.Connection.send_packed_command
+
+    def counted_connect(connection):
+        if connection._sock is None:
+            counts['connections'] += 1
+        return connect(connection)
+
+    def counted_send(connection, command, *args, **kwargs):
+        counts['round-trips'] += 1
+        return send(connection, command, *args, **kwargs)
+
+    with patch.object(redis.Connection, 'connect', counted_connect):
+        with patch.object(redis.Connection, 'send_packed_command', counted_send):
+            yield counts
+
+
+def run(store, requests):
+    task_ids = ['%032x' % i for i in range(3)]
+    store.put_state(task_ids[0], {'step': 'address'})
+    with counting() as counts:
+        start = time.time()
+        for n in range(requests):
+            with store.batch():
+                store.get_state(task_ids[0])
+                store.put_state(task_ids[0], {'step': 'payment', 'n': n})
+                store.put_state(task_ids[1], {'step': 'basket', 'n': n})
+                store.delete_state(task_ids[2])
+        duration = time.time() - start
+    return duration / requests * 1e6, counts['connections'] / float(requests), counts['round-trips'] / float(requests)
+
+
+def main(requests=1000, host=None, port=6379):
+    make_pool = make_pool_factory(host, int(port))
+    print('%-10s %14s %14s %14s' % ('', 'request (us)', 'connections', 'round-trips'))
+    with patch.object(redis_store, '_pool', make_pool()):
+        for name, store in (('unpooled', UnpooledStateStore(make_pool)), ('pooled', redis_store.StateStore())):
+            print('%-10s %14.1f %14.1f %14.1f' % ((name,) + run(store, requests)))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 1000, *args[1:])
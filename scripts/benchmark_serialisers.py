@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Compares the payload size and encode/decode time of the built-in state
+serialisers on state shaped like that of a real checkout flow.
+
+    python scripts/benchmark_serialisers.py
+"""
+import datetime
+import decimal
+import timeit
+from django.conf import settings
+
+settings.configure()
+
+from flows.statestore import serializers
+
+
+def make_state(items):
+    task_id = '0123456789abcdef0123456789abcdef'
+    return {
+        '_id': task_id,
+        '_bound_to': 'q3w4e5r6t7y8u9i0o1p2a3s4d5f6g7h8',
+        '_on_complete': '/shop/thanks/',
+        '_history': [('flow_0/%d' % i, '/shop/checkout/step%d/?_id=%s' % (i, task_id), False)
+                     for i in range(6)],
+        'basket': [{'sku': 'SKU-%05d' % i,
+                    'name': 'Product number %d' % i,
+                    'quantity': i % 3 + 1,
+                    'price': decimal.Decimal('%d.99' % (i % 50)),
+                    'added': datetime.datetime(2014, 3, 4, 12, i % 60)}
+                   for i in range(items)],
+        'uploads': [{'name': 'document-%d.pdf' % i, 'size': 1024 * i,
+                     'content_type': 'application/pdf'} for i in range(items // 10)],
+        'delivery_date': datetime.date(2014, 3, 10),
+        'address': {'line1': '1 Some Street', 'city': 'Somewhere', 'postcode': 'AB1 2CD'},
+    }
+
+
+SERIALISERS = [('base64 pickle', serializers.base64_pickle),
+               ('binary pickle', serializers.binary_pickle),
+               ('json', serializers.json_serializer)]
+
+
+def main(number=200):
+    print('%-14s %6s %10s %12s %12s' % ('serialiser', 'items', 'bytes', 'encode (us)', 'decode (us)'))
+    for items in (5, 50, 500):
+        state = make_state(items)
+        for name, serializer in SERIALISERS:
+            data = serializer.dumps(state)
+            assert serializer.loads(data) is not None
+            encode = timeit.timeit(lambda: serializer.dumps(state), number=number)
+            decode = timeit.timeit(lambda: serializer.loads(data), number=number)
+            print('%-14s %6d %10d %12.1f %12.1f' % (name, items, len(data),
+                                                    encode / number * 1e6, decode / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Compares resolving and reversing the URLs of a large flow, with scaffolds
+nested three deep and hundreds of actions, when the handler's URL
+patterns are nested and when they are flattened.
+
+    python scripts/benchmark_url_resolving.py [sections] [subsections] [actions]
+"""
+import sys
+import time
+from django.conf import settings
+
+settings.configure(INSTALLED_APPS=['flows'], ROOT_URLCONF=__name__)
+
+import django
+if hasattr(django, 'setup'):
+    django.setup()
+
+from django.core.urlresolvers import RegexURLResolver
+from flows.components import Scaffold, Action
+from flows.handler import FlowHandler
+
+
+def make_flow(sections, subsections, actions):
+    # every action is given its own class so that each has its own position
+    section_classes = []
+    for i in range(sections):
+        subsection_classes = []
+        for j in range(subsections):
+            action_classes = [type('Step%d_%d_%d' % (i, j, k), (Action,), {'url': r'^step%d/(\d+)/$' % k})
+                              for k in range(actions)]
+            subsection_classes.append(type('Sub%d_%d' % (i, j), (Scaffold,),
+                                           {'url': r'^sub%d/' % j, 'action_set': action_classes}))
+        section_classes.append(type('Section%d' % i, (Scaffold,),
+                                    {'url': r'^section%d/' % i, 'action_set': subsection_classes}))
+    return type('BigFlow', (Scaffold,), {'url': r'^flow/', 'action_set': section_classes})
+
+
+def timed(func, paths, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        for path in paths:
+            func(path)
+    return (time.time() - start) / (repeat * len(paths)) * 1e6
+
+
+def main(sections=10, subsections=10, actions=5, repeat=3):
+    flow = make_flow(sections, subsections, actions)
+    paths = ['/flow/section%d/sub%d/step%d/1/' % (i, j, k)
+             for i in range(sections) for j in range(subsections) for k in range(actions)]
+
+    print('%-10s %d actions' % ('', len(paths)))
+    print('%-10s %14s %14s' % ('', 'resolve (us)', 'reverse (us)'))
+    for name, flatten in (('nested', False), ('flattened', True)):
+        handler = FlowHandler(flatten_urls=flatten)
+        handler.register_entry_point(flow)
+        resolver = RegexURLResolver(r'^/', handler.urls)
+        names = dict((path, resolver.resolve(path).url_name) for path in paths)
+        resolve = timed(resolver.resolve, paths, repeat)
+        reverse = timed(lambda path: resolver.reverse(names[path], 1), paths, repeat)
+        print('%-10s %14.1f %14.1f' % (name, resolve, reverse))
+
+
+urlpatterns = []
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -3,7 +3,7 @@ python scripts/travis_skip.py
 
 if [ "$?" -eq "0" ]
 then
-    pip install coverage coveralls django-nose
+    pip install coverage coveralls django-nose mock fakeredis
     pip install --editable .
     pip install $DJANGO
 else